@@ -0,0 +1,132 @@
+import argparse
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from src.database import CUSTOM_PACK_ORDER_GAP, Database
+from src.pagination import Page
+from src.web.search_index import SearchIndex
+
+# Regression benchmark of the keyset listings on a synthetic registry. Every listing is walked
+# from the first page to the last; a deep page must cost about as much as the first one, which
+# fails as soon as a listing falls back to OFFSET scans or a full sort.
+#   python -m benchmarks.bench_keyset_pagination [--stickers 200000] [--max-ratio 5]
+
+STICKERS_PER_PACK: int = 100
+CUSTOM_PACK_SIZE: int = 5000
+# Pages averaged at the start and at the end of a walk
+SAMPLE_PAGES: int = 20
+
+def build_registry(path: Path, sticker_count: int) -> None:
+    # Packs of STICKERS_PER_PACK stickers with a few shared last_update values, so ties are paged
+    # through too, and one custom pack taking a sticker from many of them
+    db: Database = Database(path)
+    db.close()
+    conn: sqlite3.Connection = sqlite3.connect(path)
+    pack_count: int = -(-sticker_count // STICKERS_PER_PACK)
+    with conn:
+        _ = conn.executemany(
+            "INSERT INTO sticker_packs (name, title, artist, last_update, sticker_count) VALUES (?, ?, ?, ?, ?)",
+            [(f"pack{i:06d}", f"Pack {i}", f"Artist {i % 50}", 1_700_000_000 + i // 3, STICKERS_PER_PACK)
+             for i in range(pack_count)]
+        )
+        _ = conn.executemany(
+            """INSERT INTO stickers (file_id, file_unique_id, emoji, file_path, pack_name, display_order)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            ((f"file{n}", f"unique{n:08d}", "😀" if n % 2 else "🐱", f"unique{n:08d}.webp",
+              f"pack{n // STICKERS_PER_PACK:06d}", n % STICKERS_PER_PACK) for n in range(sticker_count))
+        )
+        _ = conn.execute("INSERT INTO custom_packs (name, title, last_modified) VALUES ('custom', 'Custom', 0)")
+        step: int = max(1, sticker_count // CUSTOM_PACK_SIZE)
+        _ = conn.executemany(
+            """INSERT INTO custom_pack_stickers (custom_pack_name, pack_name, file_unique_id, display_order)
+               VALUES ('custom', ?, ?, ?)""",
+            ((f"pack{n // STICKERS_PER_PACK:06d}", f"unique{n:08d}", (idx + 1) * CUSTOM_PACK_ORDER_GAP)
+             for idx, n in enumerate(range(0, sticker_count, step)))
+        )
+    _ = conn.execute("ANALYZE")
+    conn.close()
+
+def walk(fetch: Callable[[str | None], Page[object]]) -> tuple[int, list[float]]:
+    # Items seen and the latency of every page
+    latencies: list[float] = []
+    items: int = 0
+    after: str | None = None
+    while True:
+        start: float = time.perf_counter()
+        page: Page[object] = fetch(after)
+        latencies.append(time.perf_counter() - start)
+        items += len(page['items'])
+        after = page['next']
+        if after is None:
+            return items, latencies
+
+def offset_latency(conn: sqlite3.Connection, offset: int, limit: int) -> float:
+    # The sticker listing as it was paged before keyset pagination, with its window count
+    start: float = time.perf_counter()
+    _ = conn.execute("""
+        SELECT s.pack_name, p.title, p.artist, s.file_unique_id, s.emoji, s.file_path, s.display_order,
+               COUNT(*) OVER () AS total
+        FROM stickers s
+        JOIN sticker_packs p ON s.pack_name = p.name
+        ORDER BY p.last_update DESC, s.pack_name, s.display_order, s.file_unique_id
+        LIMIT ? OFFSET ?
+    """, (limit, offset)).fetchall()
+    return time.perf_counter() - start
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_keyset_pagination")
+    _ = parser.add_argument('--stickers', type=int, default=200_000)
+    _ = parser.add_argument('--page-size', type=int, default=100)
+    _ = parser.add_argument('--max-ratio', type=float, default=5.0,
+                            help="fail when the last pages are this many times slower than the first ones")
+    args = parser.parse_args()
+    limit: int = args.page_size
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path: Path = Path(temp_dir) / "bench.db"
+        start: float = time.perf_counter()
+        build_registry(path, args.stickers)
+        print(f"Built {args.stickers} stickers in {time.perf_counter() - start:.1f}s")
+        db: Database = Database(path)
+        ranked: list[str] = SearchIndex(db).search_stickers("Artist 7")
+        listings: dict[str, Callable[[str | None], Page[object]]] = {
+            'search_stickers': lambda after: db.search_stickers("", after, limit),
+            'search_stickers (query)': lambda after: db.search_stickers("Artist 7", after, limit, ranked=ranked),
+            'search_stickers (sorted)': lambda after: db.search_stickers("", after, limit, sort='pack_title_desc'),
+            'search_sticker_packs': lambda after: db.search_sticker_packs("", after, limit),
+            'search_sticker_packs (sorted)': lambda after: db.search_sticker_packs("", after, limit, sort='artist_asc'),
+            'get_custom_pack_stickers': lambda after: db.get_custom_pack_stickers("custom", after, limit),
+            'get_pack_stickers': lambda after: db.get_pack_stickers("pack000000", after, 10),
+        }
+        failed: bool = False
+        print(f"{'listing':<28}{'items':>9}{'pages':>7}{'first ms':>10}{'last ms':>10}{'ratio':>8}")
+        for name, fetch in listings.items():
+            items, latencies = walk(fetch)
+            sample: int = max(1, min(SAMPLE_PAGES, len(latencies) // 2))
+            first: float = statistics.median(latencies[:sample])
+            last: float = statistics.median(latencies[-sample:])
+            ratio: float = last / first if first else 1.0
+            failed |= ratio > args.max_ratio
+            print(f"{name:<28}{items:>9}{len(latencies):>7}{first * 1000:>10.2f}{last * 1000:>10.2f}{ratio:>8.2f}")
+        # Totals are counted once per data generation and then served from the query cache
+        start = time.perf_counter()
+        total: int | None = db.search_stickers("", None, limit, with_total=True)['total']
+        counted: float = time.perf_counter() - start
+        start = time.perf_counter()
+        _ = db.search_stickers("", None, limit, with_total=True)
+        print(f"Total of {total} stickers: {counted * 1000:.2f}ms counted, {(time.perf_counter() - start) * 1000:.3f}ms cached")
+        conn: sqlite3.Connection = sqlite3.connect(path)
+        for offset in (0, args.stickers // 2, args.stickers - limit):
+            print(f"OFFSET baseline at {offset:>7}: {offset_latency(conn, offset, limit) * 1000:.2f}ms")
+        conn.close()
+        db.close()
+    if failed:
+        print(f"Deep pages are more than {args.max_ratio}x slower than the first ones")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+import argparse
+import io
+import json
+import logging
+import os
+import queue
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from typing import BinaryIO, TypedDict
+
+from src.config import BACKUP_MANIFEST_DIR, BLOB_DIR, DATABASE_FILE, DOWNLOAD_DIR, REGISTRY_DIR
+from src.database import Database
+from src.storage import BlobStore
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+BACKUP_FORMAT: int = 1
+MANIFEST_MEMBER: str = "manifest.json"
+DATABASE_MEMBER: str = DATABASE_FILE.name
+# Trees stored in the archive, relative to REGISTRY_DIR. Blobs come first so they are restored
+# before the pack files linking to them.
+BACKUP_TREES: list[Path] = [BLOB_DIR, DOWNLOAD_DIR]
+BLOB_TREE: str = f"{BLOB_DIR.relative_to(REGISTRY_DIR).as_posix()}/"
+# Chunks buffered between the archive writer thread and a streamed HTTP response
+STREAM_QUEUE_SIZE: int = 16
+
+class BackupManifest(TypedDict):
+    format: int
+    created_at: int
+    # created_at of the manifest an incremental backup was taken against
+    base_created_at: int | None
+    # Every file of the registry at backup time, archive path -> [size, mtime_ns]
+    files: dict[str, list[int]]
+    # Files of the base that no longer exist, removed on restore
+    deleted: list[str]
+    # Pack files that are hard links into the blob store, archive path -> blob archive path.
+    # Missing from manifests written before links were recorded.
+    links: dict[str, str]
+    # Blob archive paths stored in this archive. Missing from manifests written before it was recorded.
+    blobs: list[str]
+
+def _scan_files() -> tuple[dict[str, list[int]], dict[str, str]]:
+    files: dict[str, list[int]] = {}
+    links: dict[str, str] = {}
+    # (st_dev, st_ino) -> archive path of every blob, the blob tree is scanned first
+    blobs: dict[tuple[int, int], str] = {}
+    for tree in BACKUP_TREES:
+        if not tree.exists():
+            continue
+        for directory, _, filenames in os.walk(tree):
+            for filename in filenames:
+                # Hidden files are downloads or links still being written
+                if filename.startswith('.'):
+                    continue
+                path: Path = Path(directory) / filename
+                try:
+                    stat: os.stat_result = path.stat()
+                except FileNotFoundError:
+                    continue
+                name: str = path.relative_to(REGISTRY_DIR).as_posix()
+                files[name] = [stat.st_size, stat.st_mtime_ns]
+                if tree == BLOB_DIR:
+                    blobs[(stat.st_dev, stat.st_ino)] = name
+                elif stat.st_nlink > 1 and (stat.st_dev, stat.st_ino) in blobs:
+                    links[name] = blobs[(stat.st_dev, stat.st_ino)]
+    return files, links
+
+def _add_link(archive: tarfile.TarFile, name: str, blob: str) -> None:
+    # Hard link member, restored as a link to a blob restored earlier by this or a previous archive
+    info: tarfile.TarInfo = archive.gettarinfo(REGISTRY_DIR / name, arcname=name)
+    info.type = tarfile.LNKTYPE
+    info.linkname = blob
+    info.size = 0
+    archive.addfile(info)
+
+def _add_bytes(archive: tarfile.TarFile, name: str, data: bytes) -> None:
+    info: tarfile.TarInfo = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    archive.addfile(info, io.BytesIO(data))
+
+def write_backup(db: Database, output: BinaryIO, base: BackupManifest | None = None) -> BackupManifest:
+    # Writes an uncompressed tar stream: the manifest first, then a database snapshot, then the
+    # files that are new or changed (by size and mtime, or by the blob they link to) since the
+    # base manifest, or all of them. Pack files linking to a blob are stored as hard links to it,
+    # even when the blob itself is unchanged and only in an earlier archive.
+    with tempfile.TemporaryDirectory(dir=REGISTRY_DIR) as temp_dir:
+        snapshot: Path = Path(temp_dir) / DATABASE_MEMBER
+        db.backup_to(snapshot)
+        files, links = _scan_files()
+        base_files: dict[str, list[int]] = base['files'] if base else {}
+        base_links: dict[str, str] = base.get('links', {}) if base else {}
+        changed: list[str] = [
+            path for path, stat in files.items()
+            if base_files.get(path) != stat or base_links.get(path) != links.get(path)
+        ]
+        manifest: BackupManifest = {
+            'format': BACKUP_FORMAT,
+            'created_at': int(time.time()),
+            'base_created_at': base['created_at'] if base else None,
+            'files': files,
+            'deleted': sorted(set(base_files) - set(files)),
+            'links': links,
+            'blobs': [path for path in changed if path.startswith(BLOB_TREE)],
+        }
+        logger.info(
+            f"Writing {'incremental' if base else 'full'} backup with {len(changed)} of {len(files)} files"
+        )
+        with tarfile.open(fileobj=output, mode='w|') as archive:
+            _add_bytes(archive, MANIFEST_MEMBER, json.dumps(manifest).encode())
+            archive.add(snapshot, arcname=DATABASE_MEMBER)
+            for path in changed:
+                try:
+                    if path in links:
+                        _add_link(archive, path, links[path])
+                    else:
+                        archive.add(REGISTRY_DIR / path, arcname=path, recursive=False)
+                except FileNotFoundError:
+                    # Removed since the scan, e.g. by a pack deletion
+                    logger.warning(f"Skipped {path}, it was removed during the backup")
+    return manifest
+
+def save_manifest(manifest: BackupManifest) -> Path:
+    BACKUP_MANIFEST_DIR.mkdir(parents=True, exist_ok=True)
+    path: Path = BACKUP_MANIFEST_DIR / f"{manifest['created_at']}.json"
+    _ = path.write_text(json.dumps(manifest))
+    return path
+
+def load_manifest(source: Path | str) -> BackupManifest | None:
+    # Accepts a manifest file, a backup archive, the created_at of a saved manifest or 'latest'
+    if source == 'latest':
+        saved: list[Path] = sorted(BACKUP_MANIFEST_DIR.glob("*.json"), key=lambda p: int(p.stem))
+        return json.loads(saved[-1].read_text()) if saved else None
+    path: Path = Path(source)
+    if isinstance(source, str) and source.isdigit():
+        path = BACKUP_MANIFEST_DIR / f"{source}.json"
+    if not path.is_file():
+        return None
+    if path.suffix == '.json':
+        return json.loads(path.read_text())
+    with tarfile.open(path, mode='r|*') as archive:
+        return _read_manifest(archive)
+
+def _read_manifest(archive: tarfile.TarFile) -> BackupManifest:
+    member: tarfile.TarInfo | None = archive.next()
+    if member is None or member.name != MANIFEST_MEMBER:
+        raise ValueError("Not a sticker registry backup: the manifest must be the first member")
+    data = archive.extractfile(member)
+    if data is None:
+        raise ValueError("Backup manifest is not a regular file")
+    manifest: BackupManifest = json.load(data)
+    if manifest.get('format') != BACKUP_FORMAT:
+        raise ValueError(f"Unsupported backup format: {manifest.get('format')}")
+    return manifest
+
+def _is_blob_path(store: BlobStore, name: str) -> bool:
+    return name.startswith(BLOB_TREE) and store.path(Path(name).name) == REGISTRY_DIR / name
+
+def _missing_blob_error(blob: str) -> ValueError:
+    return ValueError(
+        f"Backup links to blob {blob}, which is neither in the archive nor restored yet: "
+        "restore the full backup and then its incremental backups in order"
+    )
+
+def _check_linked_blobs(store: BlobStore, manifest: BackupManifest) -> None:
+    # Every blob the registry links to must be stored already or come with the archive
+    carried: set[str] | None = (
+        set(manifest['blobs']) if 'blobs' in manifest
+        else {path for path in manifest['files'] if path.startswith(BLOB_TREE)} if manifest['base_created_at'] is None
+        else None
+    )
+    if carried is None:
+        # Written before the stored blobs were recorded, links are checked as they are restored
+        return
+    for blob in sorted(set(manifest.get('links', {}).values()) - carried):
+        if not store.has(Path(blob).name):
+            raise _missing_blob_error(blob)
+
+def restore_backup(stream: BinaryIO) -> BackupManifest:
+    # Reads the archive sequentially, so it can come from a pipe. Restore a full backup first and
+    # then its incremental backups in order; the bot and web app must not be running.
+    restored_database: Path = REGISTRY_DIR / f".{DATABASE_MEMBER}.restore"
+    REGISTRY_DIR.mkdir(parents=True, exist_ok=True)
+    store: BlobStore = BlobStore(BLOB_DIR)
+    with tarfile.open(fileobj=stream, mode='r|*') as archive:
+        manifest: BackupManifest = _read_manifest(archive)
+        _check_linked_blobs(store, manifest)
+        tree_names: tuple[str, ...] = tuple(f"{tree.relative_to(REGISTRY_DIR).as_posix()}/" for tree in BACKUP_TREES)
+        for member in archive:
+            if member.name == MANIFEST_MEMBER:
+                # Iteration starts over the members already read
+                continue
+            if member.name == DATABASE_MEMBER:
+                member.name = restored_database.name
+                archive.extract(member, REGISTRY_DIR, filter='data')
+                os.replace(restored_database, DATABASE_FILE)
+                # The snapshot is self-contained, leftovers of the old database must not be replayed into it
+                for suffix in ('-wal', '-shm'):
+                    DATABASE_FILE.with_name(DATABASE_FILE.name + suffix).unlink(missing_ok=True)
+            elif (member.islnk() and member.name.startswith(tree_names) and '..' not in Path(member.name).parts
+                  and _is_blob_path(store, member.linkname)):
+                # Linked through the store, as the blob may come from an earlier archive of the
+                # chain, which a streamed archive cannot reach back to
+                if not store.has(Path(member.linkname).name):
+                    raise _missing_blob_error(member.linkname)
+                target: Path = REGISTRY_DIR / member.name
+                target.parent.mkdir(parents=True, exist_ok=True)
+                store.link(Path(member.linkname).name, target)
+            elif member.name.startswith(tree_names):
+                if not member.isdir():
+                    # Existing files can be links into the blob store, writing through them would change every link
+                    (REGISTRY_DIR / member.name).unlink(missing_ok=True)
+                archive.extract(member, REGISTRY_DIR, filter='data')
+            else:
+                logger.warning(f"Skipped unexpected archive member {member.name}")
+    for path in manifest['deleted']:
+        if path.startswith(tree_names) and '..' not in Path(path).parts:
+            (REGISTRY_DIR / path).unlink(missing_ok=True)
+    logger.info(f"Restored backup taken at {manifest['created_at']}")
+    return manifest
+
+class _QueueWriter(io.RawIOBase):
+    # File object handing written bytes to the thread consuming the queue
+    def __init__(self, chunks: queue.Queue[bytes | None], cancelled: threading.Event) -> None:
+        super().__init__()
+        self._chunks: queue.Queue[bytes | None] = chunks
+        self._cancelled: threading.Event = cancelled
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b: bytes) -> int:  # pyright: ignore[reportIncompatibleMethodOverride]
+        while True:
+            if self._cancelled.is_set():
+                raise BrokenPipeError("Backup download was cancelled")
+            try:
+                self._chunks.put(bytes(b), timeout=1)
+                return len(b)
+            except queue.Full:
+                continue
+
+def iter_backup(db: Database, base: BackupManifest | None = None) -> Iterator[bytes]:
+    # Streams write_backup through a bounded queue, so memory stays flat for large registries.
+    # The manifest is saved as the next incremental base only when the whole archive was sent.
+    chunks: queue.Queue[bytes | None] = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    cancelled: threading.Event = threading.Event()
+    result: list[BackupManifest] = []
+    errors: list[Exception] = []
+
+    def produce() -> None:
+        try:
+            result.append(write_backup(db, _QueueWriter(chunks, cancelled), base))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            while not cancelled.is_set():
+                try:
+                    chunks.put(None, timeout=1)
+                    break
+                except queue.Full:
+                    continue
+
+    thread: threading.Thread = threading.Thread(target=produce, name="backup-writer", daemon=True)
+    thread.start()
+    try:
+        while (chunk := chunks.get()) is not None:
+            yield chunk
+    finally:
+        cancelled.set()
+        thread.join()
+    if errors:
+        raise errors[0]
+    _ = save_manifest(result[0])
+
+def main() -> None:
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(prog="python -m src.backup", description="Back up or restore the sticker registry")
+    commands = parser.add_subparsers(dest='command', required=True)
+    create = commands.add_parser('create', help="write a backup archive ('-' for stdout)")
+    _ = create.add_argument('output')
+    _ = create.add_argument('--incremental', action='store_true', help="only include files changed since the base")
+    _ = create.add_argument('--base', default='latest', help="manifest, archive or created_at to diff against (default: latest backup)")
+    restore = commands.add_parser('restore', help="restore backup archives in order ('-' for stdin)")
+    _ = restore.add_argument('archives', nargs='+')
+    args = parser.parse_args()
+    if args.command == 'create':
+        base: BackupManifest | None = None
+        if args.incremental:
+            base = load_manifest(args.base)
+            if base is None:
+                parser.error(f"No backup manifest found for --base {args.base}")
+        db: Database = Database(DATABASE_FILE)
+        if args.output == '-':
+            manifest: BackupManifest = write_backup(db, sys.stdout.buffer, base)
+        else:
+            with open(args.output, 'wb') as output:
+                manifest = write_backup(db, output, base)
+        logger.info(f"Saved backup manifest to {save_manifest(manifest)}")
+    else:
+        for archive_path in args.archives:
+            if archive_path == '-':
+                _ = restore_backup(sys.stdin.buffer)
+            else:
+                with open(archive_path, 'rb') as stream:
+                    _ = restore_backup(stream)
+
+if __name__ == '__main__':
+    main()
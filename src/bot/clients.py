@@ -0,0 +1,54 @@
+import asyncio
+import logging
+
+import aiohttp
+from telegram import Bot
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Open connections kept by the shared download session, in total and per CDN host
+CONNECTION_LIMIT: int = 32
+CONNECTION_LIMIT_PER_HOST: int = 16
+KEEPALIVE_TIMEOUT_SECONDS: float = 60.0
+
+class TelegramClients:
+    # One Telegram bot and one keep-alive HTTP session per process, shared by the manager and the
+    # update service. Both are bound to the event loop that first uses them and are created lazily.
+    def __init__(self, token: str | None = None, bot: Bot | None = None) -> None:
+        self._token: str = token or ""
+        self._bot: Bot | None = bot
+        # A bot passed in (the bot application's own) is initialized and shut down by its owner
+        self._owns_bot: bool = bot is None
+        self._bot_ready: bool = bot is not None
+        self._session: aiohttp.ClientSession | None = None
+        self._lock: asyncio.Lock = asyncio.Lock()
+
+    async def get_bot(self) -> Bot:
+        async with self._lock:
+            if self._bot is None:
+                self._bot = Bot(self._token)
+            if not self._bot_ready:
+                await self._bot.initialize()
+                self._bot_ready = True
+            return self._bot
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        async with self._lock:
+            if self._session is None or self._session.closed:
+                connector: aiohttp.TCPConnector = aiohttp.TCPConnector(
+                    limit=CONNECTION_LIMIT,
+                    limit_per_host=CONNECTION_LIMIT_PER_HOST,
+                    keepalive_timeout=KEEPALIVE_TIMEOUT_SECONDS
+                )
+                self._session = aiohttp.ClientSession(connector=connector)
+            return self._session
+
+    async def close(self) -> None:
+        async with self._lock:
+            if self._session is not None and not self._session.closed:
+                await self._session.close()
+            self._session = None
+            if self._owns_bot and self._bot is not None and self._bot_ready:
+                await self._bot.shutdown()
+                self._bot_ready = False
+        logger.info("Closed shared Telegram clients")
@@ -1,12 +1,15 @@
 import logging
 from functools import partial
 
-from telegram.ext import ApplicationBuilder, MessageHandler, filters
+from telegram.ext import Application, ApplicationBuilder, MessageHandler, filters
 
+from src.bot.clients import TelegramClients
 from src.bot.handlers import handle_sticker_pack
 from src.bot.manager import StickerPackManager
-from src.config import BOT_TOKEN, DATABASE_FILE, DOWNLOAD_DIR, validate_config
+from src.config import BLOB_DIR, BOT_TOKEN, DATABASE_FILE, DOWNLOAD_DIR, THUMBNAIL_DIR, validate_config
 from src.database import Database
+from src.storage import BlobStore
+from src.thumbnails import ThumbnailCache
 
 # Configure logging
 logging.basicConfig(
@@ -15,6 +18,14 @@ logging.basicConfig(
 )
 logger: logging.Logger = logging.getLogger(__name__)
 
+async def _close_clients(application: Application) -> None:
+    clients: TelegramClients | None = application.bot_data.get('clients')
+    if clients:
+        await clients.close()
+    thumbnails: ThumbnailCache | None = application.bot_data.get('thumbnails')
+    if thumbnails:
+        thumbnails.close()
+
 def main() -> None:
     # Validate configuration
     if not validate_config():
@@ -25,10 +36,15 @@ def main() -> None:
     # Initialize database
     db: Database = Database(DATABASE_FILE)
     logger.info(f"Database initialized at {DATABASE_FILE}")
-    # Initialize sticker pack manager
-    manager: StickerPackManager = StickerPackManager(DOWNLOAD_DIR, db)
     # Build Telegram bot application
-    application = ApplicationBuilder().token(BOT_TOKEN or "").build()
+    application = ApplicationBuilder().token(BOT_TOKEN or "").post_shutdown(_close_clients).build()
+    # The application's bot and a single download session are shared by every handler
+    clients: TelegramClients = TelegramClients(bot=application.bot)
+    application.bot_data['clients'] = clients
+    # Initialize sticker pack manager
+    thumbnails: ThumbnailCache = ThumbnailCache(THUMBNAIL_DIR)
+    application.bot_data['thumbnails'] = thumbnails
+    manager: StickerPackManager = StickerPackManager(DOWNLOAD_DIR, db, clients, BlobStore(BLOB_DIR), thumbnails)
     # Create handler with manager bound to it
     sticker_handler = MessageHandler(
         filters.Sticker.ALL,
@@ -1,40 +1,100 @@
 import asyncio
+import hashlib
 import logging
+import os
+import time
 from datetime import datetime
 from pathlib import Path
+from typing import BinaryIO
 
 import aiohttp
-from telegram import File, Sticker, StickerSet
+from telegram import Bot, File, Sticker, StickerSet
 from telegram.ext import ContextTypes
 
+from src.bot.clients import TelegramClients
+from src.bot.rate_limit import RateLimitedBot
+from src.config import DOWNLOAD_CONCURRENCY, TELEGRAM_API_CONCURRENCY
 from src.database import Database, StickerRecord
+from src.storage import BlobStore, fsync_dir
+from src.thumbnails import SPRITE_TILES, ThumbnailCache
 
 logger: logging.Logger = logging.getLogger(__name__)
 
+# Read size of streamed downloads, large video stickers never sit in memory whole
+DOWNLOAD_CHUNK_SIZE: int = 64 * 1024
+
 class StickerPackManager:
-    def __init__(self, download_dir: Path, db: Database) -> None:
+    def __init__(self, download_dir: Path, db: Database, clients: TelegramClients, store: BlobStore,
+                 thumbnails: ThumbnailCache) -> None:
         self.download_dir: Path = download_dir
         self.db: Database = db
+        self.clients: TelegramClients = clients
+        self.store: BlobStore = store
+        self.thumbnails: ThumbnailCache = thumbnails
         self._lock: asyncio.Lock = asyncio.Lock()
+        # Shared by every pack processed concurrently, so the limits hold process-wide
+        self._api_semaphore: asyncio.Semaphore = asyncio.Semaphore(TELEGRAM_API_CONCURRENCY)
+        self._download_semaphore: asyncio.Semaphore = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
 
     def _get_pack_dir(self, pack_name: str) -> Path:
         pack_dir: Path = self.download_dir / pack_name
         pack_dir.mkdir(parents=True, exist_ok=True)
+        self._remove_partial_files(pack_dir)
         return pack_dir
 
-    async def _download_sticker(self, session: aiohttp.ClientSession, file_url: str, output_path: Path) -> bool:
+    @staticmethod
+    def _temp_path(output_path: Path) -> Path:
+        return output_path.with_name(f".{output_path.name}.part")
+
+    async def _download_sticker(self, session: aiohttp.ClientSession, file_url: str, output_path: Path) -> tuple[int, str] | None:
+        # Streams the file into a temporary file next to output_path and returns its size and SHA-256.
+        # The temporary file is moved into place by _commit_files once the whole pack is downloaded.
+        temp_path: Path = self._temp_path(output_path)
         try:
             async with session.get(file_url) as response:
-                if response.status == 200:
-                    content: bytes = await response.read()
-                    output_path.parent.mkdir(parents=True, exist_ok=True)
-                    _ = await asyncio.to_thread(output_path.write_bytes, content)
-                    return True
-                logger.error(f"Failed to download {file_url}: {response.status}")
-                return False
+                if response.status != 200:
+                    logger.error(f"Failed to download {file_url}: {response.status}")
+                    return None
+                digest = hashlib.sha256()
+                size: int = 0
+                # File calls go to a worker thread, a slow disk never stalls the other downloads
+                f: BinaryIO = await asyncio.to_thread(temp_path.open, 'wb')
+                try:
+                    async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                        digest.update(chunk)
+                        size += len(chunk)
+                        _ = await asyncio.to_thread(f.write, chunk)
+                finally:
+                    await asyncio.to_thread(f.close)
+                return size, digest.hexdigest()
         except Exception as e:
             logger.error(f"Error downloading sticker: {e}")
-            return False
+            await asyncio.to_thread(temp_path.unlink, missing_ok=True)
+            return None
+
+    def _commit_files(self, pack_dir: Path, downloaded: list[tuple[str, str]], linked: list[tuple[str, str]]) -> None:
+        # Takes (filename, sha256) pairs. Downloaded files are flushed in one batch and moved into the
+        # blob store, then every file is linked into the pack directory and the touched directories
+        # are synced once, so a crash never leaves a truncated file behind a name the database points to
+        for filename, _ in downloaded:
+            fd: int = os.open(self._temp_path(pack_dir / filename), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        touched_dirs: set[Path] = {pack_dir}
+        for filename, sha256 in downloaded:
+            touched_dirs.add(self.store.add(self._temp_path(pack_dir / filename), sha256).parent)
+        for filename, sha256 in downloaded + linked:
+            self.store.link(sha256, pack_dir / filename)
+        for directory in touched_dirs:
+            fsync_dir(directory)
+
+    @staticmethod
+    def _remove_partial_files(pack_dir: Path) -> None:
+        # Leftovers of a download interrupted by a crash
+        for temp_path in pack_dir.glob(".*.part"):
+            temp_path.unlink(missing_ok=True)
 
     def _get_file_extension(self, sticker: Sticker) -> str:
         if sticker.is_animated:
@@ -44,19 +104,39 @@ class StickerPackManager:
         return "webp"
 
     async def _download_and_track(self, session: aiohttp.ClientSession, file_url: str, output_path: Path, sticker: Sticker, display_order: int) -> StickerRecord | None:
-        success: bool = await self._download_sticker(session, file_url, output_path)
-        if success:
+        downloaded: tuple[int, str] | None = await self._download_sticker(session, file_url, output_path)
+        if downloaded:
             sticker_record: StickerRecord = {
                 'file_id': sticker.file_id,
                 'file_unique_id': sticker.file_unique_id,
                 'emoji': sticker.emoji,
                 'file_path': output_path.name,
-                'display_order': display_order
+                'display_order': display_order,
+                'file_size': downloaded[0],
+                'sha256': downloaded[1]
             }
             logger.info(f"Downloaded: {output_path.name} (order: {display_order})")
             return sticker_record
         return None
 
+    async def _fetch_sticker(self, bot: Bot | RateLimitedBot, session: aiohttp.ClientSession, output_path: Path, sticker: Sticker, display_order: int, timings: dict[str, float]) -> StickerRecord | None:
+        # Resolves the file path and downloads it as one pipeline step, each stage bounded by its own semaphore
+        async with self._api_semaphore:
+            started: float = time.perf_counter()
+            try:
+                file: File = await bot.get_file(sticker.file_id)
+            except Exception as e:
+                logger.error(f"Error resolving file of sticker {sticker.file_unique_id}: {e}")
+                return None
+            finally:
+                timings['resolve'] += time.perf_counter() - started
+        async with self._download_semaphore:
+            started = time.perf_counter()
+            try:
+                return await self._download_and_track(session, file.file_path or "", output_path, sticker, display_order)
+            finally:
+                timings['download'] += time.perf_counter() - started
+
     async def process_sticker_pack(self, sticker: Sticker, context: ContextTypes.DEFAULT_TYPE) -> None:
         if not sticker.set_name:
             logger.warning("Sticker has no set name, skipping")
@@ -66,102 +146,129 @@ class StickerPackManager:
             # Get the full sticker set
             sticker_set: StickerSet = await context.bot.get_sticker_set(pack_name)
             logger.info(f"Retrieved sticker set: {sticker_set.title}")
-            # Get existing stickers with their orders
-            existing_orders: dict[str, int] = self.db.get_sticker_unique_ids_with_order(pack_name)
-            current_sticker_ids: set[str] = {s.file_unique_id for s in sticker_set.stickers}
-            # Check if pack has changes
-            new_stickers: set[str] = current_sticker_ids - existing_orders.keys()
-            removed_stickers: set[str] = set(existing_orders.keys()) - current_sticker_ids
-            if not new_stickers and not removed_stickers and existing_orders:
-                # Check if order changed
-                order_changed = False
-                for idx, stk in enumerate(sticker_set.stickers):
-                    if existing_orders.get(stk.file_unique_id) != idx:
-                        order_changed = True
-                        break
-                if not order_changed:
-                    logger.info(f"Pack '{pack_name}' is up to date with {len(existing_orders)} stickers, skipping")
-                    return
-                logger.info(f"Pack '{pack_name}' order changed, updating...")
-            logger.info(f"Processing pack '{pack_name}' ({sticker_set.title})")
-            if existing_orders:
-                logger.info(f"New stickers to download: {len(new_stickers)}")
-                if removed_stickers:
-                    logger.info(f"Removed stickers (will be moved to end): {len(removed_stickers)}")
-            else:
-                logger.info(f"First time download: {len(current_sticker_ids)} stickers")
-            pack_dir: Path = self._get_pack_dir(pack_name)
-            # Update pack info in database
-            pack_artist: str = 'Unclassified'
-            existing_pack = self.db.get_sticker_pack(pack_name)
-            if existing_pack:
-                pack_artist = existing_pack['artist']
-            async with self._lock:
-                self.db.upsert_sticker_pack({
-                    'name': pack_name,
-                    'title': sticker_set.title,
-                    'artist': pack_artist,
-                    'last_update': int(datetime.now().timestamp()),
-                    'sticker_count': len(current_sticker_ids)
-                })
-            # Calculate the highest order number for deleted stickers
-            max_order: int = len(sticker_set.stickers)
-            # Process all stickers with their new order
-            async with aiohttp.ClientSession() as session:
-                download_tasks: list[asyncio.Task[StickerRecord | None]] = []
-                for idx, stk in enumerate(sticker_set.stickers):
-                    # Skip if already downloaded and order hasn't changed
-                    if stk.file_unique_id in existing_orders and existing_orders[stk.file_unique_id] == idx:
-                        continue
-                    # Get file extension
-                    ext: str = self._get_file_extension(stk)
-                    # Prepare file info
-                    filename: str = f"{stk.file_unique_id}.{ext}"
-                    file_path: Path = pack_dir / filename
-                    # If sticker exists but order changed, just update the order in DB
-                    if stk.file_unique_id in existing_orders:
-                        async with self._lock:
-                            self.db.upsert_sticker(pack_name, {
-                                'file_id': stk.file_id,
-                                'file_unique_id': stk.file_unique_id,
-                                'emoji': stk.emoji,
-                                'file_path': filename,
-                                'display_order': idx
-                            })
-                        logger.info(f"Updated order for {filename}: {existing_orders[stk.file_unique_id]} -> {idx}")
-                        continue
-                    # Download new sticker
-                    file: File = await context.bot.get_file(stk.file_id)
-                    task: asyncio.Task[StickerRecord | None] = asyncio.create_task(
-                        self._download_and_track(session, file.file_path or "", file_path, stk, idx)
-                    )
-                    download_tasks.append(task)
-                # Download all new stickers concurrently
-                if download_tasks:
-                    downloaded_stickers: list[StickerRecord | None] = await asyncio.gather(*download_tasks)
-                    # Save to database
-                    async with self._lock:
-                        for sticker_record in downloaded_stickers:
-                            if sticker_record:
-                                self.db.upsert_sticker(pack_name, sticker_record)
-                # Handle removed stickers
-                if removed_stickers:
-                    async with self._lock:
-                        for removed_idx, removed_id in enumerate(removed_stickers):
-                            # Get existing sticker info
-                            stickers, _ = self.db.get_pack_stickers(pack_name, page=1, per_page=10000)
-                            removed_sticker: StickerRecord | None = next((s for s in stickers if s['file_unique_id'] == removed_id), None)
-                            if removed_sticker:
-                                # Update order to be at the end
-                                new_order: int = max_order + removed_idx
-                                self.db.upsert_sticker(pack_name, {
-                                    'file_id': removed_sticker['file_id'],
-                                    'file_unique_id': removed_sticker['file_unique_id'],
-                                    'emoji': removed_sticker['emoji'],
-                                    'file_path': removed_sticker['file_path'],
-                                    'display_order': new_order
-                                })
-                                logger.info(f"Moved removed sticker {removed_sticker['file_path']} to order {new_order}")
-            logger.info(f"Successfully processed pack '{pack_name}'")
+            await self.update_sticker_set(sticker_set, context.bot)
         except Exception as e:
             logger.error(f"Error processing sticker pack '{pack_name}': {e}", exc_info=True)
+
+    async def update_sticker_set(self, sticker_set: StickerSet, bot: Bot | RateLimitedBot) -> None:
+        # Syncs an already fetched sticker set into the database and download directory, errors are raised
+        pack_name: str = sticker_set.name
+        # Get existing stickers with their orders
+        existing_orders: dict[str, int] = self.db.get_sticker_unique_ids_with_order(pack_name)
+        current_sticker_ids: set[str] = {s.file_unique_id for s in sticker_set.stickers}
+        # Check if pack has changes
+        new_stickers: set[str] = current_sticker_ids - existing_orders.keys()
+        removed_stickers: set[str] = set(existing_orders.keys()) - current_sticker_ids
+        if not new_stickers and not removed_stickers and existing_orders:
+            # Check if order changed
+            order_changed = False
+            for idx, stk in enumerate(sticker_set.stickers):
+                if existing_orders.get(stk.file_unique_id) != idx:
+                    order_changed = True
+                    break
+            if not order_changed:
+                logger.info(f"Pack '{pack_name}' is up to date with {len(existing_orders)} stickers, skipping")
+                return
+            logger.info(f"Pack '{pack_name}' order changed, updating...")
+        logger.info(f"Processing pack '{pack_name}' ({sticker_set.title})")
+        if existing_orders:
+            logger.info(f"New stickers to download: {len(new_stickers)}")
+            if removed_stickers:
+                logger.info(f"Removed stickers (will be moved to end): {len(removed_stickers)}")
+        else:
+            logger.info(f"First time download: {len(current_sticker_ids)} stickers")
+        pack_dir: Path = await asyncio.to_thread(self._get_pack_dir, pack_name)
+        # Sticker rows to write: reordered existing stickers and new downloads
+        sticker_records: list[StickerRecord] = []
+        failed_downloads: int = 0
+        session: aiohttp.ClientSession = await self.clients.get_session()
+        download_tasks: list[asyncio.Task[StickerRecord | None]] = []
+        # New stickers whose content is already in the blob store are linked instead of downloaded
+        known_blobs: dict[str, tuple[str, int]] = self.db.get_file_blobs(sorted(new_stickers))
+        linked: list[tuple[str, str]] = []
+        # Time spent inside each stage, summed over the pack's stickers
+        timings: dict[str, float] = {'resolve': 0.0, 'download': 0.0}
+        started: float = time.perf_counter()
+        for idx, stk in enumerate(sticker_set.stickers):
+            # Skip if already downloaded and order hasn't changed
+            if stk.file_unique_id in existing_orders and existing_orders[stk.file_unique_id] == idx:
+                continue
+            # Get file extension
+            ext: str = self._get_file_extension(stk)
+            # Prepare file info
+            filename: str = f"{stk.file_unique_id}.{ext}"
+            file_path: Path = pack_dir / filename
+            # If sticker exists but order changed, just update the order in DB
+            if stk.file_unique_id in existing_orders:
+                sticker_records.append({
+                    'file_id': stk.file_id,
+                    'file_unique_id': stk.file_unique_id,
+                    'emoji': stk.emoji,
+                    'file_path': filename,
+                    'display_order': idx
+                })
+                logger.info(f"Updated order for {filename}: {existing_orders[stk.file_unique_id]} -> {idx}")
+                continue
+            known_blob: tuple[str, int] | None = known_blobs.get(stk.file_unique_id)
+            if known_blob and self.store.has(known_blob[0]):
+                sticker_records.append({
+                    'file_id': stk.file_id,
+                    'file_unique_id': stk.file_unique_id,
+                    'emoji': stk.emoji,
+                    'file_path': filename,
+                    'display_order': idx,
+                    'file_size': known_blob[1],
+                    'sha256': known_blob[0]
+                })
+                linked.append((filename, known_blob[0]))
+                continue
+            # Resolve and download new sticker
+            task: asyncio.Task[StickerRecord | None] = asyncio.create_task(
+                self._fetch_sticker(bot, session, file_path, stk, idx, timings)
+            )
+            download_tasks.append(task)
+        # Resolve and download all new stickers concurrently
+        downloaded: list[tuple[str, str]] = []
+        if download_tasks:
+            downloaded_stickers: list[StickerRecord | None] = await asyncio.gather(*download_tasks)
+            sticker_records.extend(s for s in downloaded_stickers if s)
+            failed_downloads = downloaded_stickers.count(None)
+            downloaded = [(s['file_path'], s.get('sha256') or "") for s in downloaded_stickers if s]
+            logger.info(
+                f"Pack '{pack_name}': fetched {len(download_tasks)} stickers in {time.perf_counter() - started:.2f}s "
+                f"(resolve {timings['resolve']:.2f}s, download {timings['download']:.2f}s summed over stickers)"
+            )
+        if downloaded or linked:
+            await asyncio.to_thread(self._commit_files, pack_dir, downloaded, linked)
+            if linked:
+                logger.info(f"Pack '{pack_name}': linked {len(linked)} stickers already in the blob store")
+            generated: int = await self.thumbnails.generate_many(pack_dir / filename for filename, _ in downloaded + linked)
+            if generated:
+                logger.info(f"Pack '{pack_name}': generated {generated} thumbnails")
+        # Removed stickers are moved to the end, keeping their previous relative order
+        max_order: int = len(sticker_set.stickers)
+        tail_orders: dict[str, int] = {
+            removed_id: max_order + removed_idx
+            for removed_idx, removed_id in enumerate(sorted(removed_stickers, key=lambda u: existing_orders[u]))
+        }
+        for removed_id, new_order in tail_orders.items():
+            logger.info(f"Moved removed sticker {removed_id} to order {new_order}")
+        # Write the pack, its stickers and the new orders in a single transaction
+        last_update: int = int(datetime.now().timestamp())
+        async with self._lock:
+            self.db.upsert_pack_stickers({
+                'name': pack_name,
+                'title': sticker_set.title,
+                'artist': 'Unclassified',
+                'last_update': last_update,
+                'sticker_count': len(current_sticker_ids)
+            }, sticker_records, tail_orders)
+        # The overview page shows the first stickers of the pack from one sprite sheet
+        _ = await asyncio.to_thread(
+            self.thumbnails.build_sprite, pack_name, last_update,
+            [pack_dir / f"{stk.file_unique_id}.{self._get_file_extension(stk)}" for stk in sticker_set.stickers[:SPRITE_TILES]]
+        )
+        if failed_downloads:
+            # Saved stickers are kept, the missing ones are picked up by the next update
+            raise RuntimeError(f"{failed_downloads} stickers of pack '{pack_name}' failed to download")
+        logger.info(f"Successfully processed pack '{pack_name}'")
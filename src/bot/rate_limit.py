@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable
+from datetime import timedelta
+from typing import TypeVar
+
+from telegram import Bot, File, StickerSet
+from telegram.error import RetryAfter
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        self.rate: float = rate
+        self.capacity: float = capacity if capacity is not None else max(1.0, rate)
+        self._tokens: float = self.capacity
+        self._updated: float = time.monotonic()
+        self._paused_until: float = 0.0
+        self._lock: asyncio.Lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        # Stops handing out tokens until the pause is over, then restarts from an empty bucket
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+        self._updated = self._paused_until
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now: float = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + max(0.0, now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    retry_after: int | timedelta = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+class RateLimitedBot:
+    # Wraps the Bot methods used while updating packs so every call takes a token from a shared bucket
+    def __init__(self, bot: Bot, limiter: TokenBucket) -> None:
+        self.bot: Bot = bot
+        self.limiter: TokenBucket = limiter
+
+    async def _call(self, method: Callable[[], Awaitable[T]]) -> T:
+        while True:
+            await self.limiter.acquire()
+            try:
+                return await method()
+            except RetryAfter as e:
+                # Telegram asked every caller to back off, not only this one
+                seconds: float = _retry_after_seconds(e)
+                logger.warning(f"Rate limited by Telegram, pausing requests for {seconds:.1f}s")
+                self.limiter.pause(seconds)
+
+    async def get_sticker_set(self, name: str) -> StickerSet:
+        return await self._call(lambda: self.bot.get_sticker_set(name))
+
+    async def get_file(self, file_id: str) -> File:
+        return await self._call(lambda: self.bot.get_file(file_id))
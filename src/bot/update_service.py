@@ -1,85 +1,130 @@
 import asyncio
 import logging
+from collections.abc import Callable
 from pathlib import Path
 
-from telegram.ext import Application, ContextTypes, CallbackContext
+from telegram import Bot
+from telegram.error import BadRequest
 
+from src.bot.clients import TelegramClients
 from src.bot.manager import StickerPackManager
-from src.config import BOT_TOKEN
+from src.bot.rate_limit import RateLimitedBot, TokenBucket
+from src.config import (
+    UPDATE_MAX_ATTEMPTS,
+    UPDATE_REQUESTS_PER_SECOND,
+    UPDATE_RETRY_BACKOFF_SECONDS,
+    UPDATE_WORKERS,
+)
 from src.database import Database
+from src.storage import BlobStore
+from src.thumbnails import ThumbnailCache
 
 logger = logging.getLogger(__name__)
 
+# Called with the per-pack results so far and the number of packs in the run
+ProgressCallback = Callable[[dict[str, bool], int], None]
+
 
 class UpdateService:
-    def __init__(self, download_dir: Path, db: Database) -> None:
+    def __init__(self, download_dir: Path, db: Database, clients: TelegramClients, store: BlobStore,
+                 thumbnails: ThumbnailCache) -> None:
         self.download_dir: Path = download_dir
         self.db: Database = db
-        self.manager: StickerPackManager = StickerPackManager(download_dir, db)
+        self.clients: TelegramClients = clients
+        self.manager: StickerPackManager = StickerPackManager(download_dir, db, clients, store, thumbnails)
 
     async def update_pack(self, pack_name: str) -> bool:
         logger.info(f"Starting update for pack: {pack_name}")
-        async with Application.builder().token(BOT_TOKEN or "").build() as app:
-            await app.initialize()
-            try:
-                pack_info = self.db.get_sticker_pack(pack_name)
-                if not pack_info:
-                    logger.error(f"Pack not found: {pack_name}")
-                    return False
-                stickers, _ = self.db.get_pack_stickers(
-                    pack_name, page=1, per_page=1
-                )
-                if not stickers:
-                    logger.error(f"No stickers found in pack: {pack_name}")
-                    return False
-                telegram_pack = await app.bot.get_sticker_set(pack_name)
-                if not telegram_pack or not telegram_pack.stickers:
-                    logger.error(f"Telegram pack empty: {pack_name}")
-                    return False
-                context = _create_context(app)
-                await self.manager.process_sticker_pack(
-                    telegram_pack.stickers[0],
-                    context
-                )
-                logger.info(f"Successfully updated pack: {pack_name}")
-                return True
-            except Exception:
-                logger.exception(f"Error updating pack {pack_name}")
+        try:
+            pack_info = self.db.get_sticker_pack(pack_name)
+            if not pack_info:
+                logger.error(f"Pack not found: {pack_name}")
+                return False
+            if not self.db.get_pack_stickers(pack_name, limit=1)['items']:
+                logger.error(f"No stickers found in pack: {pack_name}")
                 return False
+            bot: Bot = await self.clients.get_bot()
+            telegram_pack = await bot.get_sticker_set(pack_name)
+            if not telegram_pack or not telegram_pack.stickers:
+                logger.error(f"Telegram pack empty: {pack_name}")
+                return False
+            await self.manager.update_sticker_set(telegram_pack, bot)
+            logger.info(f"Successfully updated pack: {pack_name}")
+            return True
+        except Exception:
+            logger.exception(f"Error updating pack {pack_name}")
+            return False
 
-    async def update_all_packs(self) -> dict[str, bool]:
-        packs, _ = self.db.search_sticker_packs(
-            "", page=1, per_page=10000
+    async def update_all_packs(self, bot: Bot | None = None, on_progress: ProgressCallback | None = None) -> dict[str, bool]:
+        # Resumes the previous run if it was interrupted, otherwise updates every known pack.
+        # on_progress is called with the results so far and the pack count, once up front and after every pack.
+        pack_names: list[str] = self.db.begin_pack_update_run(
+            self.db.get_all_pack_names()
         )
-        logger.info(f"Starting update for {len(packs)} packs")
-        results: dict[str, bool] = {}
-        async with Application.builder().token(BOT_TOKEN or "").build() as app:
-            await app.initialize()
-            context = _create_context(app)
-            for pack in packs:
-                pack_name = pack["name"]
-                try:
-                    telegram_pack = await app.bot.get_sticker_set(pack_name)
-                    if not telegram_pack or not telegram_pack.stickers:
-                        results[pack_name] = False
-                        continue
-                    await self.manager.process_sticker_pack(
-                        telegram_pack.stickers[0],
-                        context
-                    )
-                    results[pack_name] = True
-                    await asyncio.sleep(0.5)
-                except Exception:
-                    logger.exception(f"Error updating pack {pack_name}")
-                    results[pack_name] = False
-
+        logger.info(f"Starting update for {len(pack_names)} packs")
+        if on_progress:
+            on_progress({}, len(pack_names))
+        if bot is None:
+            bot = await self.clients.get_bot()
+        results = await self._run_pack_updates(pack_names, bot, on_progress)
+        self.db.finish_pack_update_run()
         success_count: int = sum(results.values())
         logger.info(
             f"Update complete: {success_count}/{len(results)} packs updated"
         )
-
         return results
 
+    async def _run_pack_updates(self, pack_names: list[str], bot: Bot, on_progress: ProgressCallback | None) -> dict[str, bool]:
+        # Fixed pool of workers sharing one queue; every Telegram call goes through a single token bucket
+        limited_bot = RateLimitedBot(bot, TokenBucket(UPDATE_REQUESTS_PER_SECOND))
+        queue: asyncio.Queue[str] = asyncio.Queue()
+        for pack_name in pack_names:
+            queue.put_nowait(pack_name)
+        results: dict[str, bool] = {}
+
+        async def worker() -> None:
+            while True:
+                try:
+                    pack_name = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                results[pack_name] = await self._update_with_retries(
+                    pack_name, limited_bot
+                )
+                if on_progress:
+                    on_progress(results, len(pack_names))
 
-def _create_context(app) -> ContextTypes.DEFAULT_TYPE:
-    return CallbackContext(application=app)
+        workers = max(1, min(UPDATE_WORKERS, len(pack_names)))
+        _ = await asyncio.gather(*(worker() for _ in range(workers)))
+        return results
+
+    async def _update_with_retries(self, pack_name: str, bot: RateLimitedBot) -> bool:
+        for attempt in range(1, UPDATE_MAX_ATTEMPTS + 1):
+            try:
+                telegram_pack = await bot.get_sticker_set(pack_name)
+                if not telegram_pack or not telegram_pack.stickers:
+                    logger.error(f"Telegram pack empty: {pack_name}")
+                    self.db.record_pack_update(
+                        pack_name, "failed", attempt, "Telegram pack empty"
+                    )
+                    return False
+                await self.manager.update_sticker_set(telegram_pack, bot)
+                self.db.record_pack_update(pack_name, "done", attempt)
+                return True
+            except BadRequest as e:
+                # Deleted or renamed packs will not come back by retrying
+                logger.error(f"Telegram rejected pack {pack_name}: {e}")
+                self.db.record_pack_update(pack_name, "failed", attempt, str(e))
+                return False
+            except Exception as e:
+                if attempt == UPDATE_MAX_ATTEMPTS:
+                    logger.exception(f"Error updating pack {pack_name}")
+                    self.db.record_pack_update(pack_name, "failed", attempt, str(e))
+                    return False
+                delay: float = UPDATE_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+                logger.warning(
+                    f"Error updating pack {pack_name} (attempt {attempt}), retrying in {delay:.1f}s: {e}"
+                )
+                self.db.record_pack_update(pack_name, "pending", attempt, str(e))
+                await asyncio.sleep(delay)
+        return False
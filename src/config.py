@@ -8,14 +8,43 @@ _ = load_dotenv()
 
 # Paths
 PROJECT_ROOT: Path = Path(__file__).resolve().parent.parent
-DOWNLOAD_DIR: Path = PROJECT_ROOT / "sticker_registry" / "pack_files"
-DATABASE_FILE: Path = PROJECT_ROOT / "sticker_registry" / "sticker_data.sqlite"
+REGISTRY_DIR: Path = PROJECT_ROOT / "sticker_registry"
+DOWNLOAD_DIR: Path = REGISTRY_DIR / "pack_files"
+# Deduplicated sticker files, pack_files holds hard links into it so both must share a filesystem
+BLOB_DIR: Path = REGISTRY_DIR / "blobs"
+DATABASE_FILE: Path = REGISTRY_DIR / "sticker_data.sqlite"
+# Manifests of the backups taken so far, the base of incremental backups
+BACKUP_MANIFEST_DIR: Path = REGISTRY_DIR / "backup_manifests"
+# Static previews shown in the grids, a cache that can be deleted at any time
+THUMBNAIL_DIR: Path = REGISTRY_DIR / "thumbnails"
+# Stickers converted to fit Signal's limits, a cache that can be deleted at any time
+SIGNAL_MEDIA_DIR: Path = REGISTRY_DIR / "signal_media"
 
 # Telegram Bot Token
 BOT_TOKEN: str | None = os.getenv("BOT_TOKEN")
 SIGNAL_UUID: str | None = os.getenv("SIGNAL_UUID")
 SIGNAL_PASSWORD: str | None = os.getenv("SIGNAL_PASSWORD")
 
+# Bulk pack updates
+UPDATE_WORKERS: int = int(os.getenv("UPDATE_WORKERS", "4"))
+UPDATE_REQUESTS_PER_SECOND: float = float(os.getenv("UPDATE_REQUESTS_PER_SECOND", "20"))
+UPDATE_MAX_ATTEMPTS: int = int(os.getenv("UPDATE_MAX_ATTEMPTS", "3"))
+UPDATE_RETRY_BACKOFF_SECONDS: float = float(os.getenv("UPDATE_RETRY_BACKOFF_SECONDS", "2"))
+# Concurrent get_file calls and CDN downloads while fetching new stickers
+TELEGRAM_API_CONCURRENCY: int = int(os.getenv("TELEGRAM_API_CONCURRENCY", "8"))
+DOWNLOAD_CONCURRENCY: int = int(os.getenv("DOWNLOAD_CONCURRENCY", "16"))
+# Thumbnail edge in pixels and threads decoding stickers into thumbnails
+THUMBNAIL_SIZE: int = int(os.getenv("THUMBNAIL_SIZE", "128"))
+THUMBNAIL_WORKERS: int = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+# Threads reading and converting sticker files for Signal uploads, shared by every upload
+SIGNAL_MEDIA_WORKERS: int = int(os.getenv("SIGNAL_MEDIA_WORKERS", "4"))
+
+# Sticker files served by the web app: '' sends them from Python, 'x-sendfile' (Apache, lighttpd)
+# or 'x-accel-redirect' (nginx) hands them to a front proxy
+STICKER_SENDFILE_MODE: str = os.getenv("STICKER_SENDFILE_MODE", "").lower()
+# Internal nginx location mapped to the pack_files directory, used with 'x-accel-redirect'
+STICKER_ACCEL_REDIRECT_PREFIX: str = os.getenv("STICKER_ACCEL_REDIRECT_PREFIX", "/internal/sticker_files/")
+
 def validate_config() -> bool:
     if not BOT_TOKEN:
         print("ERROR: BOT_TOKEN not found in environment variables")
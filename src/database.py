@@ -1,8 +1,21 @@
+import functools
+import itertools
 import json
 import time
 import sqlite3
+import threading
+from collections.abc import Callable, Hashable, Iterable, Iterator
+from contextlib import contextmanager
 from pathlib import Path
-from typing import TypedDict
+from typing import Any, Concatenate, NotRequired, ParamSpec, TypedDict, TypeVar
+
+from src.pagination import Page, decode_token, encode_token, seek_condition
+from src.query_cache import QueryCache, detach, freeze
+from src.signal_media import CUSTOM_PACK_SIGNAL_AUTHOR, signal_fingerprint
+
+P = ParamSpec('P')
+R = TypeVar('R')
+T = TypeVar('T')
 
 class StickerRecord(TypedDict):
     file_id: str
@@ -10,6 +23,9 @@ class StickerRecord(TypedDict):
     emoji: str | None
     file_path: str
     display_order: int
+    # Recorded when the file is downloaded; rows written before that or only reordered leave them out
+    file_size: NotRequired[int | None]
+    sha256: NotRequired[str | None]
 
 class StickerPackRecord(TypedDict):
     name: str
@@ -19,8 +35,21 @@ class StickerPackRecord(TypedDict):
     sticker_count: int
     signal_url: str | None
     signal_uploaded_at: int | None
+    # signal_fingerprint of the content last uploaded, None for uploads made before fingerprints
+    signal_fingerprint: str | None
     used_in_custom_packs: bool
 
+class StickerPackListing(StickerPackRecord):
+    thumbnails: list[StickerRecord]
+
+class PackFilters(TypedDict, total=False):
+    # True keeps only the packs matching a filter, False drops them, a missing filter keeps every pack
+    on_signal: bool
+    in_custom_packs: bool
+    needs_update: bool
+    # Names of the packs needing a Signal update, read by the needs_update filter
+    stale: list[str]
+
 class StickerSearchResult(TypedDict):
     pack_name: str
     pack_title: str
@@ -30,6 +59,12 @@ class StickerSearchResult(TypedDict):
     file_path: str
     display_order: int
 
+class PackSearchDocument(TypedDict):
+    name: str
+    title: str
+    artist: str
+    last_update: int
+
 class CustomPackSticker(TypedDict):
     pack_name: str
     pack_title: str
@@ -43,22 +78,491 @@ class CustomPackRecord(TypedDict):
     title: str
     signal_url: str | None
     signal_uploaded_at: int | None
+    signal_fingerprint: str | None
     last_modified: int
+    # Bumped by every change, checked by patch_custom_pack
+    version: int
+
+class CustomPackListing(CustomPackRecord):
+    sticker_count: int
+    thumbnails: list[CustomPackSticker]
+
+class JobRecord(TypedDict):
+    id: str
+    kind: str
+    target: str | None
+    status: str
+    total: int
+    completed: int
+    failed: int
+    results: dict[str, bool]
+    result: dict[str, object] | None
+    error: str | None
+    created_at: int
+    started_at: int | None
+    finished_at: int | None
+
+class CustomPackConflict(Exception):
+    # Raised by patch_custom_pack when the pack changed since the version the edits were made against
+    def __init__(self, name: str, version: int) -> None:
+        super().__init__(f"Custom pack {name} is at version {version}")
+        self.version: int = version
+
+# Connection tuning, applied to every pooled connection
+BUSY_TIMEOUT_SECONDS: float = 30.0
+CACHE_SIZE_KIB: int = 64 * 1024
+MMAP_SIZE_BYTES: int = 256 * 1024 * 1024
+# Idle connections kept open for reuse, extra connections are closed when released
+POOL_SIZE: int = 8
+# Results of the read methods marked with _cached_read kept per process
+QUERY_CACHE_SIZE: int = 256
+QUERY_CACHE_TTL_SECONDS: float = 60.0
+# Spacing of custom pack display_order keys, a sticker moved between two others takes the midpoint
+CUSTOM_PACK_ORDER_GAP: int = 1024
+CUSTOM_PACK_EDIT_OPS: tuple[str, ...] = ('add', 'remove', 'move')
+
+# Names of sticker packs with at least one sticker in a custom pack
+_USED_PACKS_CTE: str = """
+    used_packs AS (
+        SELECT DISTINCT s.pack_name FROM custom_pack_stickers cps
+        JOIN stickers s ON s.file_unique_id = cps.file_unique_id
+    )
+"""
+
+def _fts_phrase(query: str) -> str | None:
+    # The trigram tokenizer needs at least three characters to use the index
+    if len(query) < 3:
+        return None
+    return '"' + query.replace('"', '""') + '"'
+
+# Keep the full-text tables in sync with the rows they index, which share their rowid
+_SEARCH_FTS_TRIGGERS: str = """
+        CREATE TRIGGER IF NOT EXISTS sticker_packs_fts_insert AFTER INSERT ON sticker_packs BEGIN
+            INSERT INTO sticker_packs_fts (rowid, name, title, artist)
+            VALUES (new.rowid, new.name, new.title, new.artist);
+        END;
+        CREATE TRIGGER IF NOT EXISTS sticker_packs_fts_delete AFTER DELETE ON sticker_packs BEGIN
+            DELETE FROM sticker_packs_fts WHERE rowid = old.rowid;
+        END;
+        CREATE TRIGGER IF NOT EXISTS sticker_packs_fts_update AFTER UPDATE OF name, title, artist ON sticker_packs
+        WHEN old.name IS NOT new.name OR old.title IS NOT new.title OR old.artist IS NOT new.artist BEGIN
+            UPDATE sticker_packs_fts SET name = new.name, title = new.title, artist = new.artist
+            WHERE rowid = old.rowid;
+        END;
+        CREATE TRIGGER IF NOT EXISTS stickers_fts_insert AFTER INSERT ON stickers BEGIN
+            INSERT INTO stickers_fts (rowid, emoji) VALUES (new.rowid, new.emoji);
+        END;
+        CREATE TRIGGER IF NOT EXISTS stickers_fts_delete AFTER DELETE ON stickers BEGIN
+            DELETE FROM stickers_fts WHERE rowid = old.rowid;
+        END;
+        CREATE TRIGGER IF NOT EXISTS stickers_fts_update AFTER UPDATE OF emoji ON stickers
+        WHEN old.emoji IS NOT new.emoji BEGIN
+            UPDATE stickers_fts SET emoji = new.emoji WHERE rowid = old.rowid;
+        END;
+"""
+
+def _rebuild_search_fts(conn: sqlite3.Connection) -> None:
+    _ = conn.execute("DELETE FROM sticker_packs_fts")
+    _ = conn.execute("DELETE FROM stickers_fts")
+    _ = conn.execute("""
+        INSERT INTO sticker_packs_fts (rowid, name, title, artist)
+        SELECT rowid, name, title, artist FROM sticker_packs
+    """)
+    _ = conn.execute("INSERT INTO stickers_fts (rowid, emoji) SELECT rowid, emoji FROM stickers")
+
+def _migrate_search_fts(conn: sqlite3.Connection) -> None:
+    # Trigram full-text tables for pack name/title/artist and sticker emoji
+    _ = conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS sticker_packs_fts
+        USING fts5(name, title, artist, tokenize='trigram')
+    """)
+    _ = conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS stickers_fts
+        USING fts5(emoji, tokenize='trigram')
+    """)
+    _ = conn.executescript(_SEARCH_FTS_TRIGGERS)
+    # Build the index for rows that existed before the migration
+    _rebuild_search_fts(conn)
+
+def _migrate_pack_update_progress(conn: sqlite3.Connection) -> None:
+    # One row per pack of the current (or interrupted) bulk update run
+    _ = conn.execute("""
+        CREATE TABLE IF NOT EXISTS pack_update_progress (
+            pack_name TEXT PRIMARY KEY,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            updated_at INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+def _migrate_jobs(conn: sqlite3.Connection) -> None:
+    # History of background jobs run by the web app, with their live progress
+    _ = conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            target TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            total INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            results TEXT NOT NULL DEFAULT '{}',
+            result TEXT,
+            error TEXT,
+            created_at INTEGER NOT NULL,
+            started_at INTEGER,
+            finished_at INTEGER
+        )
+    """)
+    _ = conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs(created_at DESC)")
+
+def _migrate_sticker_checksums(conn: sqlite3.Connection) -> None:
+    # Size and SHA-256 of the downloaded file, NULL for stickers downloaded before this migration
+    _ = conn.execute("ALTER TABLE stickers ADD COLUMN file_size INTEGER")
+    _ = conn.execute("ALTER TABLE stickers ADD COLUMN sha256 TEXT")
+
+def _migrate_file_blobs(conn: sqlite3.Connection) -> None:
+    # Content hash of every file_unique_id ever downloaded. Rows outlive their stickers, so a
+    # sticker seen again (a re-added pack or a fork) is linked from the blob store without downloading.
+    _ = conn.execute("""
+        CREATE TABLE IF NOT EXISTS file_blobs (
+            file_unique_id TEXT PRIMARY KEY,
+            sha256 TEXT NOT NULL,
+            file_size INTEGER NOT NULL
+        )
+    """)
+    _ = conn.execute("""
+        INSERT OR IGNORE INTO file_blobs (file_unique_id, sha256, file_size)
+        SELECT file_unique_id, sha256, file_size FROM stickers
+        WHERE sha256 IS NOT NULL AND file_size IS NOT NULL
+    """)
+
+def _migrate_data_generation(conn: sqlite3.Connection) -> None:
+    # Bumped by every transaction that writes, so each process can tell its cached reads are stale
+    _ = conn.execute("""
+        CREATE TABLE IF NOT EXISTS data_generation (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            generation INTEGER NOT NULL
+        )
+    """)
+    _ = conn.execute("INSERT OR IGNORE INTO data_generation (id, generation) VALUES (0, 0)")
+
+def _migrate_custom_pack_versions(conn: sqlite3.Connection) -> None:
+    _ = conn.execute("ALTER TABLE custom_packs ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    # Spread the existing 0, 1, 2... orders apart so stickers can be moved between them
+    _ = conn.execute(
+        "UPDATE custom_pack_stickers SET display_order = (display_order + 1) * ?", (CUSTOM_PACK_ORDER_GAP,)
+    )
+
+def _migrate_sticker_order_indexes(conn: sqlite3.Connection) -> None:
+    # Replaced by indexes ending in file_unique_id, which serve the keyset pages ordered by
+    # (display_order, file_unique_id) as well as plain lookups by pack
+    for index in ('idx_stickers_pack', 'idx_stickers_order', 'idx_custom_pack_stickers_pack', 'idx_custom_pack_stickers_order'):
+        _ = conn.execute(f"DROP INDEX IF EXISTS {index}")
+
+def _migrate_pack_listing_index(conn: sqlite3.Connection) -> None:
+    # Replaced by idx_sticker_packs_last_update_name, which also orders packs updated at the same time
+    _ = conn.execute("DROP INDEX IF EXISTS idx_sticker_packs_last_update")
+
+def _migrate_signal_fingerprints(conn: sqlite3.Connection) -> None:
+    # Packs uploaded before this keep a NULL fingerprint and are compared by timestamp until re-uploaded
+    _ = conn.execute("ALTER TABLE sticker_packs ADD COLUMN signal_fingerprint TEXT")
+    _ = conn.execute("ALTER TABLE custom_packs ADD COLUMN signal_fingerprint TEXT")
+
+def _migrate_stable_rowids(conn: sqlite3.Connection) -> None:
+    # The full-text tables are keyed by the rowid of sticker_packs and stickers, which VACUUM may
+    # renumber in tables without an INTEGER PRIMARY KEY. Both are rebuilt with an id column aliasing
+    # the rowid, keeping the current values, and the full-text tables are rebuilt to match.
+    conn.commit()
+    # Dropping the old tables must not cascade to the rows referencing them; the pragma has no
+    # effect inside a transaction
+    _ = conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        _ = conn.executescript(f"""
+            BEGIN;
+            CREATE TABLE sticker_packs_new (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE,
+                title TEXT NOT NULL,
+                artist TEXT NOT NULL,
+                last_update INTEGER NOT NULL,
+                sticker_count INTEGER NOT NULL,
+                signal_url TEXT,
+                signal_uploaded_at INTEGER,
+                signal_fingerprint TEXT
+            );
+            INSERT INTO sticker_packs_new (id, name, title, artist, last_update, sticker_count,
+                                           signal_url, signal_uploaded_at, signal_fingerprint)
+            SELECT rowid, name, title, artist, last_update, sticker_count,
+                   signal_url, signal_uploaded_at, signal_fingerprint
+            FROM sticker_packs;
+            CREATE TABLE stickers_new (
+                id INTEGER PRIMARY KEY,
+                pack_name TEXT NOT NULL,
+                file_id TEXT NOT NULL,
+                file_unique_id TEXT NOT NULL UNIQUE,
+                emoji TEXT,
+                file_path TEXT NOT NULL,
+                display_order INTEGER NOT NULL,
+                file_size INTEGER,
+                sha256 TEXT,
+                FOREIGN KEY (pack_name) REFERENCES sticker_packs(name) ON DELETE CASCADE
+            );
+            INSERT INTO stickers_new (id, pack_name, file_id, file_unique_id, emoji, file_path, display_order,
+                                      file_size, sha256)
+            SELECT rowid, pack_name, file_id, file_unique_id, emoji, file_path, display_order, file_size, sha256
+            FROM stickers;
+            DROP TABLE stickers;
+            DROP TABLE sticker_packs;
+            ALTER TABLE sticker_packs_new RENAME TO sticker_packs;
+            ALTER TABLE stickers_new RENAME TO stickers;
+            CREATE INDEX idx_stickers_emoji ON stickers(emoji);
+            CREATE INDEX idx_stickers_pack_order ON stickers(pack_name, display_order, file_unique_id);
+            CREATE INDEX idx_sticker_packs_last_update_name ON sticker_packs(last_update DESC, name);
+            {_SEARCH_FTS_TRIGGERS}
+            COMMIT;
+        """)
+        _rebuild_search_fts(conn)
+        conn.commit()
+    finally:
+        _ = conn.execute("PRAGMA foreign_keys = ON")
+
+def _migrate_pack_sort_indexes(conn: sqlite3.Connection) -> None:
+    # One index per sort of the search listings, walked forwards or backwards for either direction
+    _ = conn.executescript("""
+        CREATE INDEX IF NOT EXISTS idx_sticker_packs_last_update_asc ON sticker_packs(last_update, name DESC);
+        CREATE INDEX IF NOT EXISTS idx_sticker_packs_title ON sticker_packs(title COLLATE NOCASE, last_update DESC, name);
+        CREATE INDEX IF NOT EXISTS idx_sticker_packs_name_nocase ON sticker_packs(name COLLATE NOCASE, name);
+        CREATE INDEX IF NOT EXISTS idx_sticker_packs_artist ON sticker_packs(artist COLLATE NOCASE, last_update DESC, name);
+        CREATE INDEX IF NOT EXISTS idx_sticker_packs_count ON sticker_packs(sticker_count DESC, last_update DESC, name);
+    """)
+
+# Applied in order; PRAGMA user_version records how many have run
+MIGRATIONS: list[Callable[[sqlite3.Connection], None]] = [
+    _migrate_search_fts,
+    _migrate_pack_update_progress,
+    _migrate_jobs,
+    _migrate_sticker_checksums,
+    _migrate_file_blobs,
+    _migrate_data_generation,
+    _migrate_custom_pack_versions,
+    _migrate_sticker_order_indexes,
+    _migrate_pack_listing_index,
+    _migrate_signal_fingerprints,
+    _migrate_stable_rowids,
+    _migrate_pack_sort_indexes,
+]
+
+# Sort columns of the keyset listings, (column, descending)
+PACK_LISTING_ORDER: list[tuple[str, bool]] = [('p.last_update', True), ('p.name', False)]
+STICKER_SEARCH_ORDER: list[tuple[str, bool]] = [
+    ('p.last_update', True), ('p.name', False), ('s.display_order', False), ('s.file_unique_id', False)
+]
+# Position in the ranked matches of a search, joined as json_each(?) r
+RANKED_ORDER: list[tuple[str, bool]] = [('r.key', False)]
+# Sorts of the pack search, each served by one of the indexes of _migrate_pack_sort_indexes. Text is
+# compared case-insensitively; a descending sort lists its ties in reverse so the index is walked backwards.
+PACK_SORT_ORDERS: dict[str, list[tuple[str, bool]]] = {
+    'last_update_desc': PACK_LISTING_ORDER,
+    'last_update_asc': [('p.last_update', False), ('p.name', True)],
+    'title_asc': [('p.title COLLATE NOCASE', False), ('p.last_update', True), ('p.name', False)],
+    'title_desc': [('p.title COLLATE NOCASE', True), ('p.last_update', False), ('p.name', True)],
+    'name_asc': [('p.name COLLATE NOCASE', False), ('p.name', False)],
+    'name_desc': [('p.name COLLATE NOCASE', True), ('p.name', True)],
+    'artist_asc': [('p.artist COLLATE NOCASE', False), ('p.last_update', True), ('p.name', False)],
+    'artist_desc': [('p.artist COLLATE NOCASE', True), ('p.last_update', False), ('p.name', True)],
+    'count_desc': [('p.sticker_count', True), ('p.last_update', True), ('p.name', False)],
+    'count_asc': [('p.sticker_count', False), ('p.last_update', False), ('p.name', True)],
+}
+# Sorts of the sticker search, by the pack sort of the same name with the stickers of a pack in order
+STICKER_SORT_ORDERS: dict[str, list[tuple[str, bool]]] = {
+    sort: [*PACK_SORT_ORDERS[pack_sort], ('s.display_order', False), ('s.file_unique_id', False)]
+    for sort, pack_sort in [
+        ('pack_update_desc', 'last_update_desc'), ('pack_update_asc', 'last_update_asc'),
+        ('pack_name_asc', 'name_asc'), ('pack_name_desc', 'name_desc'),
+        ('pack_title_asc', 'title_asc'), ('pack_title_desc', 'title_desc'),
+        ('artist_asc', 'artist_asc'), ('artist_desc', 'artist_desc'),
+    ]
+}
+
+def _keyset_page(rows: list[T], limit: int, scope: str, key: Callable[[T], list[Any]], total: int | None) -> Page[T]:
+    # rows holds up to limit + 1 items, the extra one only tells that another page follows
+    items: list[T] = rows[:limit]
+    return Page(
+        items=items,
+        next=encode_token(scope, key(items[-1])) if len(rows) > limit else None,
+        total=total
+    )
+
+def _listing_order(sorts: dict[str, list[tuple[str, bool]]], sort: str, default: list[tuple[str, bool]],
+                   ranked: list[str] | None) -> list[tuple[str, bool]]:
+    # Sort columns of a search listing. Ranked matches sorted by a column keep their rank among ties,
+    # without a (known) sort they stay in rank order.
+    if ranked is None:
+        return sorts.get(sort, default)
+    return [sorts[sort][0], *RANKED_ORDER] if sort in sorts else RANKED_ORDER
+
+def _order_by(order: list[tuple[str, bool]]) -> str:
+    return ', '.join(f"{column}{' DESC' if descending else ''}" for column, descending in order)
+
+def _pack_filter_conditions(filters: PackFilters) -> tuple[list[str], list[Any]]:
+    # WHERE conditions of the pack filters, for a query joining used_packs
+    conditions: list[str] = []
+    params: list[Any] = []
+    checks: list[tuple[str, str]] = [
+        ('on_signal', "IFNULL(p.signal_url, '') != ''"),
+        ('in_custom_packs', "used_packs.pack_name IS NOT NULL"),
+        ('needs_update', "p.name IN (SELECT value FROM json_each(?))"),
+    ]
+    for name, condition in checks:
+        keep: bool | None = filters.get(name)
+        if keep is None:
+            continue
+        conditions.append(condition if keep else f"NOT ({condition})")
+        if name == 'needs_update':
+            params.append(json.dumps(filters.get('stale', [])))
+    return conditions, params
+
+def _sort_columns(order: list[tuple[str, bool]]) -> str:
+    # Sort columns selected as sort_<idx>, so a page's next token is read from its last row
+    return ', '.join(f"{column} AS sort_{idx}" for idx, (column, _) in enumerate(order))
+
+def _sort_key(row: sqlite3.Row, order: list[tuple[str, bool]]) -> list[Any]:
+    return [row[f"sort_{idx}"] for idx in range(len(order))]
+
+def _signal_fingerprints(rows: Iterable[sqlite3.Row]) -> dict[str, str]:
+    # One signal_fingerprint per pack from (name, title, author, content, emoji) rows in sticker order.
+    # The file_unique_id identifies the content: it is known from the moment a sticker is stored,
+    # where a sha256 backfilled later would change the fingerprint of an unchanged pack.
+    fingerprints: dict[str, str] = {}
+    for name, group in itertools.groupby(rows, key=lambda row: row['name']):
+        pack_rows: list[sqlite3.Row] = list(group)
+        fingerprints[name] = signal_fingerprint(
+            pack_rows[0]['title'], pack_rows[0]['author'],
+            [(row['content'], row['emoji']) for row in pack_rows if row['content'] is not None]
+        )
+    return fingerprints
+
+def _cached_read(method: Callable[Concatenate['Database', P], R]) -> Callable[Concatenate['Database', P], R]:
+    # Serves repeated calls from the query cache until any process writes to the database. Every
+    # caller gets its own copy of the result, so changing it does not change the cached one.
+    @functools.wraps(method)
+    def wrapper(self: 'Database', *args: P.args, **kwargs: P.kwargs) -> R:
+        key: Hashable = (method.__name__, freeze(args), freeze(kwargs))
+        # Read before the query, so a write committed meanwhile makes the stored result stale
+        generation: int = self._data_generation()
+        hit, value = self._query_cache.get(key, generation)
+        if hit:
+            return detach(value)
+        result: R = method(self, *args, **kwargs)
+        self._query_cache.put(key, generation, result)
+        return detach(result)
+    return wrapper
 
 class Database:
     def __init__(self, db_path: Path) -> None:
         self.db_path: Path = db_path
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._change_listeners: list[Callable[[str], None]] = []
+        self._pool: list[sqlite3.Connection] = []
+        self._pool_lock: threading.Lock = threading.Lock()
+        self._query_cache: QueryCache = QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL_SECONDS)
+        # Connection kept for _data_generation only, with the data_version and generation it last saw
+        self._watch_lock: threading.Lock = threading.Lock()
+        self._watch_conn: sqlite3.Connection | None = None
+        self._watched_version: int | None = None
+        self._generation: int = 0
+        # Off until the migrations have created the data_generation table
+        self._track_writes: bool = False
         self._init_database()
+        self._track_writes = True
+
+    def add_change_listener(self, listener: Callable[[str], None]) -> None:
+        # Listeners are called with the pack name whenever a pack or one of its stickers is written
+        self._change_listeners.append(listener)
 
-    def _connect(self) -> sqlite3.Connection:
-        conn: sqlite3.Connection = sqlite3.connect(str(self.db_path))
+    def _notify_pack_changed(self, pack_name: str) -> None:
+        for listener in self._change_listeners:
+            listener(pack_name)
+
+    def _open_connection(self) -> sqlite3.Connection:
+        # Pooled connections move between threads, but only one thread uses a connection at a time
+        conn: sqlite3.Connection = sqlite3.connect(
+            str(self.db_path),
+            timeout=BUSY_TIMEOUT_SECONDS,
+            check_same_thread=False
+        )
         conn.row_factory = sqlite3.Row
         _ = conn.execute("PRAGMA foreign_keys = ON")
+        _ = conn.execute("PRAGMA synchronous = NORMAL")
+        _ = conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+        _ = conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE_BYTES}")
+        _ = conn.execute("PRAGMA temp_store = MEMORY")
         return conn
 
+    @contextmanager
+    def _connect(self, invalidates: bool = True) -> Iterator[sqlite3.Connection]:
+        # Borrow a pooled connection for the duration of one transaction. Writes only to tables no
+        # cached read depends on (jobs, pack_update_progress) pass invalidates=False, so polling
+        # their progress does not flush the query cache.
+        with self._pool_lock:
+            conn: sqlite3.Connection | None = self._pool.pop() if self._pool else None
+        if conn is None:
+            conn = self._open_connection()
+        try:
+            changes: int = conn.total_changes
+            with conn:
+                yield conn
+                if invalidates and self._track_writes and conn.total_changes != changes:
+                    # Committed with the writes when the block exits, invalidating the query cache of every
+                    # process. Methods must not commit inside the block, or the data would land first.
+                    _ = conn.execute("UPDATE data_generation SET generation = generation + 1")
+        finally:
+            with self._pool_lock:
+                if len(self._pool) < POOL_SIZE:
+                    self._pool.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    def _data_generation(self) -> int:
+        # PRAGMA data_version of a connection that never writes changes with every commit made by any
+        # other connection, in this process or another one. The generation row is only read again
+        # when it did, so a cache hit costs no table read.
+        with self._watch_lock:
+            if self._watch_conn is None:
+                self._watch_conn = self._open_connection()
+            version: int = self._watch_conn.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._watched_version:
+                self._generation = self._watch_conn.execute("SELECT generation FROM data_generation").fetchone()[0]
+                self._watched_version = version
+            return self._generation
+
+    def backup_to(self, target: Path) -> None:
+        # Consistent snapshot of the live database through the sqlite3 backup API
+        with self._connect() as conn:
+            destination: sqlite3.Connection = sqlite3.connect(str(target))
+            try:
+                conn.backup(destination)
+            finally:
+                destination.close()
+
+    def close(self) -> None:
+        with self._pool_lock:
+            pool, self._pool = self._pool, []
+        for conn in pool:
+            conn.close()
+        with self._watch_lock:
+            if self._watch_conn is not None:
+                self._watch_conn.close()
+                self._watch_conn = None
+                self._watched_version = None
+
     def _init_database(self) -> None:
         with self._connect() as conn:
+            # WAL lets the web process read while the bot writes; the mode is stored in the file
+            _ = conn.execute("PRAGMA journal_mode = WAL")
             # Sticker packs table
             _ = conn.execute("""
                 CREATE TABLE IF NOT EXISTS sticker_packs (
@@ -106,45 +610,36 @@ class Database:
                 )
             """)
             # Create indices for better search performance
-            _ = conn.execute("CREATE INDEX IF NOT EXISTS idx_stickers_pack ON stickers(pack_name)")
             _ = conn.execute("CREATE INDEX IF NOT EXISTS idx_stickers_emoji ON stickers(emoji)")
-            _ = conn.execute("CREATE INDEX IF NOT EXISTS idx_stickers_order ON stickers(pack_name, display_order)")
-            _ = conn.execute("CREATE INDEX IF NOT EXISTS idx_custom_pack_stickers_pack ON custom_pack_stickers(custom_pack_name)")
-            _ = conn.execute("CREATE INDEX IF NOT EXISTS idx_sticker_packs_last_update ON sticker_packs(last_update DESC)")
+            _ = conn.execute("CREATE INDEX IF NOT EXISTS idx_stickers_pack_order ON stickers(pack_name, display_order, file_unique_id)")
+            _ = conn.execute("CREATE INDEX IF NOT EXISTS idx_sticker_packs_last_update_name ON sticker_packs(last_update DESC, name)")
             _ = conn.execute("CREATE INDEX IF NOT EXISTS idx_custom_pack_stickers_unique_id ON custom_pack_stickers(file_unique_id)")
-            _ = conn.execute("CREATE INDEX IF NOT EXISTS idx_custom_pack_stickers_order ON custom_pack_stickers(custom_pack_name, display_order)")
+            _ = conn.execute("CREATE INDEX IF NOT EXISTS idx_custom_pack_stickers_order_id ON custom_pack_stickers(custom_pack_name, display_order, file_unique_id)")
             conn.commit()
+            self._migrate(conn)
 
-    # Sticker Pack Operations
-    def upsert_sticker_pack(self, pack: StickerPackRecord) -> None:
-        with self._connect() as conn:
-            _ = conn.execute("""
-                INSERT INTO sticker_packs (name, title, artist, last_update, sticker_count)
-                VALUES (?, ?, ?, ?, ?)
-                ON CONFLICT(name) DO UPDATE SET
-                    title = excluded.title,
-                    artist = excluded.artist,
-                    last_update = excluded.last_update,
-                    sticker_count = excluded.sticker_count
-            """, (pack['name'], pack['title'], pack['artist'], pack['last_update'], pack['sticker_count']))
+    def _migrate(self, conn: sqlite3.Connection) -> None:
+        version: int = conn.execute("PRAGMA user_version").fetchone()[0]
+        for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            migration(conn)
+            _ = conn.execute(f"PRAGMA user_version = {target}")
             conn.commit()
 
+    # Sticker Pack Operations
+    @_cached_read
     def get_sticker_pack(self, pack_name: str) -> StickerPackRecord | None:
         with self._connect() as conn:
-            cursor: sqlite3.Cursor = conn.execute(
-                """SELECT name, title, artist, last_update, sticker_count, 
-                   signal_url, signal_uploaded_at FROM sticker_packs WHERE name = ?""",
-                (pack_name,)
-            )
+            cursor: sqlite3.Cursor = conn.execute("""
+                SELECT name, title, artist, last_update, sticker_count, signal_url, signal_uploaded_at, signal_fingerprint,
+                       EXISTS (
+                           SELECT 1 FROM stickers s
+                           JOIN custom_pack_stickers cps ON cps.file_unique_id = s.file_unique_id
+                           WHERE s.pack_name = sticker_packs.name
+                       ) AS used_in_custom_packs
+                FROM sticker_packs WHERE name = ?
+            """, (pack_name,))
             row = cursor.fetchone()
             if row:
-                # Check if pack is used in custom packs
-                used_cursor: sqlite3.Cursor = conn.execute("""
-                    SELECT COUNT(DISTINCT custom_pack_name) FROM custom_pack_stickers
-                    JOIN stickers ON custom_pack_stickers.file_unique_id = stickers.file_unique_id
-                    WHERE stickers.pack_name = ?
-                """, (pack_name,))
-                used_in_custom: bool = used_cursor.fetchone()[0] > 0
                 return StickerPackRecord(
                     name=row['name'],
                     title=row['title'],
@@ -153,95 +648,174 @@ class Database:
                     sticker_count=row['sticker_count'],
                     signal_url=row['signal_url'],
                     signal_uploaded_at=row['signal_uploaded_at'],
-                    used_in_custom_packs=used_in_custom
+                    signal_fingerprint=row['signal_fingerprint'],
+                    used_in_custom_packs=bool(row['used_in_custom_packs'])
                 )
             return None
 
-    def search_sticker_packs(self, query: str, page: int = 1, per_page: int = 50) -> tuple[list[StickerPackRecord], int]:
-        with self._connect() as conn:
-            offset: int = (page - 1) * per_page
-            if not query:
-                # Get total count
-                cursor: sqlite3.Cursor = conn.execute("SELECT COUNT(*) FROM sticker_packs")
-                total: int = cursor.fetchone()[0]
-                # Get paginated results
-                cursor: sqlite3.Cursor = conn.execute("""
-                    SELECT name, title, artist, last_update, sticker_count,
-                           signal_url, signal_uploaded_at
-                    FROM sticker_packs 
-                    ORDER BY last_update DESC
-                    LIMIT ? OFFSET ?
-                """, (per_page, offset))
-            else:
-                query_pattern: str = f"%{query}%"
-                # Get total count
-                cursor = conn.execute("""
-                    SELECT COUNT(*) FROM sticker_packs
-                    WHERE name LIKE ? COLLATE NOCASE
-                       OR title LIKE ? COLLATE NOCASE
-                       OR artist LIKE ? COLLATE NOCASE
-                """, (query_pattern, query_pattern, query_pattern))
-                total = cursor.fetchone()[0]
-                # Get paginated results
-                cursor = conn.execute("""
-                    SELECT name, title, artist, last_update, sticker_count,
-                           signal_url, signal_uploaded_at
-                    FROM sticker_packs
-                    WHERE name LIKE ? COLLATE NOCASE
-                       OR title LIKE ? COLLATE NOCASE
-                       OR artist LIKE ? COLLATE NOCASE
-                    ORDER BY last_update DESC
-                    LIMIT ? OFFSET ?
-                """, (query_pattern, query_pattern, query_pattern, per_page, offset))
-            packs = []
+    @_cached_read
+    def match_sticker_packs(self, query: str, limit: int) -> list[str] | None:
+        # Names of up to limit packs containing query, best full-text match first; None when the
+        # query is too short for the trigram index
+        phrase: str | None = _fts_phrase(query)
+        if phrase is None:
+            return None
+        with self._connect() as conn:
+            cursor: sqlite3.Cursor = conn.execute("""
+                SELECT p.name FROM sticker_packs_fts f
+                JOIN sticker_packs p ON p.rowid = f.rowid
+                WHERE sticker_packs_fts MATCH ?
+                ORDER BY f.rank
+                LIMIT ?
+            """, (phrase, limit))
+            return [row['name'] for row in cursor.fetchall()]
+
+    @staticmethod
+    def _pack_search_source(ranked: list[str] | None, filters: PackFilters | None) -> tuple[str, list[str], list[Any]]:
+        # FROM clause and WHERE conditions of the pack search, every pack or the ranked ones, filtered
+        source: str = "sticker_packs p" if ranked is None else "json_each(?) r JOIN sticker_packs p ON p.name = r.value"
+        params: list[Any] = [] if ranked is None else [json.dumps(ranked)]
+        conditions, filter_params = _pack_filter_conditions(filters or {})
+        return f"FROM {source} LEFT JOIN used_packs ON used_packs.pack_name = p.name", conditions, [*params, *filter_params]
+
+    @_cached_read
+    def search_sticker_packs(self, query: str = "", after: str | None = None, limit: int = 50,
+                             ranked: list[str] | None = None, sort: str = "", filters: PackFilters | None = None,
+                             with_total: bool = False) -> Page[StickerPackRecord]:
+        # Every pack, most recently updated first, or when ranked is given the packs of those names in
+        # that order, sorted by one of PACK_SORT_ORDERS and filtered. The query only names the listing
+        # its page tokens belong to; after is the next token of the previous page, raises ValueError
+        # for a token of another listing.
+        shown: dict[str, bool] = {name: keep for name, keep in (filters or {}).items() if isinstance(keep, bool)}
+        scope: str = f"sticker_packs:{query}:{sort}:{json.dumps(shown, sort_keys=True)}"
+        order: list[tuple[str, bool]] = _listing_order(PACK_SORT_ORDERS, sort, PACK_LISTING_ORDER, ranked)
+        source, conditions, params = self._pack_search_source(ranked, filters)
+        if after:
+            seek, seek_params = seek_condition(order, decode_token(after, scope, len(order)))
+            conditions.append(seek)
+            params.extend(seek_params)
+        with self._connect() as conn:
+            cursor: sqlite3.Cursor = conn.execute(f"""
+                WITH {_USED_PACKS_CTE}
+                SELECT p.name, p.title, p.artist, p.last_update, p.sticker_count, p.signal_url, p.signal_uploaded_at,
+                       p.signal_fingerprint, used_packs.pack_name IS NOT NULL AS used_in_custom_packs, {_sort_columns(order)}
+                {source}
+                {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+                ORDER BY {_order_by(order)}
+                LIMIT ?
+            """, (*params, limit + 1))
+            rows: list[sqlite3.Row] = cursor.fetchall()
+        packs = [
+            StickerPackRecord(
+                name=row['name'],
+                title=row['title'],
+                artist=row['artist'],
+                last_update=row['last_update'],
+                sticker_count=row['sticker_count'],
+                signal_url=row['signal_url'],
+                signal_uploaded_at=row['signal_uploaded_at'],
+                signal_fingerprint=row['signal_fingerprint'],
+                used_in_custom_packs=bool(row['used_in_custom_packs'])
+            )
+            for row in rows
+        ]
+        keys: dict[str, list[Any]] = {row['name']: _sort_key(row, order) for row in rows}
+        total: int | None = self.count_sticker_packs(ranked, filters) if with_total else None
+        return _keyset_page(packs, limit, scope, lambda p: keys[p['name']], total)
+
+    @_cached_read
+    def count_sticker_packs(self, ranked: list[str] | None = None, filters: PackFilters | None = None) -> int:
+        source, conditions, params = self._pack_search_source(ranked, filters)
+        with self._connect() as conn:
+            return conn.execute(f"""
+                WITH {_USED_PACKS_CTE}
+                SELECT COUNT(*) {source}
+                {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+            """, params).fetchone()[0]
+
+    @_cached_read
+    def list_sticker_packs(self, pack_names: list[str] | None = None, thumbnail_limit: int = 4) -> list[StickerPackListing]:
+        # Packs (all of them, or the given names) with their custom pack flag and first
+        # thumbnail_limit stickers, fetched in one query
+        with self._connect() as conn:
+            pack_filter: str = ""
+            sticker_filter: str = ""
+            params: tuple[str, ...] = ()
+            if pack_names is not None:
+                if not pack_names:
+                    return []
+                placeholders: str = ', '.join('?' * len(pack_names))
+                pack_filter = f"WHERE p.name IN ({placeholders})"
+                sticker_filter = f"WHERE pack_name IN ({placeholders})"
+                params = tuple(pack_names)
+            cursor: sqlite3.Cursor = conn.execute(f"""
+                WITH {_USED_PACKS_CTE},
+                thumbnails AS (
+                    SELECT pack_name, file_id, file_unique_id, emoji, file_path, display_order,
+                           ROW_NUMBER() OVER (
+                               PARTITION BY pack_name ORDER BY display_order, file_unique_id
+                           ) AS thumbnail_rank
+                    FROM stickers
+                    {sticker_filter}
+                )
+                SELECT p.name, p.title, p.artist, p.last_update, p.sticker_count,
+                       p.signal_url, p.signal_uploaded_at, p.signal_fingerprint,
+                       used_packs.pack_name IS NOT NULL AS used_in_custom_packs,
+                       t.file_id, t.file_unique_id, t.emoji, t.file_path, t.display_order
+                FROM sticker_packs p
+                LEFT JOIN used_packs ON used_packs.pack_name = p.name
+                LEFT JOIN thumbnails t ON t.pack_name = p.name AND t.thumbnail_rank <= ?
+                {pack_filter}
+                ORDER BY p.last_update DESC, p.name, t.thumbnail_rank
+            """, (*params, thumbnail_limit, *params))
+            packs: dict[str, StickerPackListing] = {}
             for row in cursor.fetchall():
-                # Check if pack is used in custom packs
-                used_cursor = conn.execute("""
-                    SELECT COUNT(DISTINCT custom_pack_name) FROM custom_pack_stickers
-                    JOIN stickers ON custom_pack_stickers.file_unique_id = stickers.file_unique_id
-                    WHERE stickers.pack_name = ?
-                """, (row['name'],))
-                used_in_custom: bool = used_cursor.fetchone()[0] > 0
-                packs.append(StickerPackRecord(
-                    name=row['name'],
-                    title=row['title'],
-                    artist=row['artist'],
-                    last_update=row['last_update'],
-                    sticker_count=row['sticker_count'],
-                    signal_url=row['signal_url'],
-                    signal_uploaded_at=row['signal_uploaded_at'],
-                    used_in_custom_packs=used_in_custom
-                ))
-            return packs, total
+                pack: StickerPackListing | None = packs.get(row['name'])
+                if pack is None:
+                    pack = packs[row['name']] = StickerPackListing(
+                        name=row['name'],
+                        title=row['title'],
+                        artist=row['artist'],
+                        last_update=row['last_update'],
+                        sticker_count=row['sticker_count'],
+                        signal_url=row['signal_url'],
+                        signal_uploaded_at=row['signal_uploaded_at'],
+                        signal_fingerprint=row['signal_fingerprint'],
+                        used_in_custom_packs=bool(row['used_in_custom_packs']),
+                        thumbnails=[]
+                    )
+                if row['file_unique_id'] is not None:
+                    pack['thumbnails'].append(StickerRecord(
+                        file_id=row['file_id'],
+                        file_unique_id=row['file_unique_id'],
+                        emoji=row['emoji'],
+                        file_path=row['file_path'],
+                        display_order=row['display_order']
+                    ))
+            return list(packs.values())
 
-    def update_pack_signal_url(self, pack_name: str, signal_url: str, uploaded_at: int) -> bool:
+    def update_pack_signal_url(self, pack_name: str, signal_url: str, uploaded_at: int, fingerprint: str) -> bool:
         with self._connect() as conn:
             cursor: sqlite3.Cursor = conn.execute(
-                "UPDATE sticker_packs SET signal_url = ?, signal_uploaded_at = ? WHERE name = ?",
-                (signal_url, uploaded_at, pack_name)
+                "UPDATE sticker_packs SET signal_url = ?, signal_uploaded_at = ?, signal_fingerprint = ? WHERE name = ?",
+                (signal_url, uploaded_at, fingerprint, pack_name)
             )
-            conn.commit()
             return cursor.rowcount > 0
 
-    def get_pack_thumbnail_stickers(self, pack_name: str, limit: int = 4) -> list[StickerRecord]:
+    @_cached_read
+    def get_pack_signal_fingerprints(self, pack_names: list[str] | None = None) -> dict[str, str]:
+        # signal_fingerprint of the current content of the given packs, or of every pack on Signal
+        if pack_names is not None and not pack_names:
+            return {}
         with self._connect() as conn:
-            cursor: sqlite3.Cursor = conn.execute("""
-                SELECT file_id, file_unique_id, emoji, file_path, display_order
-                FROM stickers
-                WHERE pack_name = ?
-                ORDER BY display_order
-                LIMIT ?
-            """, (pack_name, limit))
-            return [
-                StickerRecord(
-                    file_id=row['file_id'],
-                    file_unique_id=row['file_unique_id'],
-                    emoji=row['emoji'],
-                    file_path=row['file_path'],
-                    display_order=row['display_order']
-                )
-                for row in cursor.fetchall()
-            ]
+            cursor: sqlite3.Cursor = conn.execute(f"""
+                SELECT p.name, p.title, p.artist AS author, s.file_unique_id AS content, s.emoji
+                FROM sticker_packs p
+                LEFT JOIN stickers s ON s.pack_name = p.name
+                WHERE {f"p.name IN ({', '.join('?' * len(pack_names))})" if pack_names is not None else "p.signal_url IS NOT NULL"}
+                ORDER BY p.name, s.display_order, s.file_unique_id
+            """, pack_names or ())
+            return _signal_fingerprints(cursor)
 
     def update_pack_artist(self, pack_name: str, artist: str) -> bool:
         with self._connect() as conn:
@@ -249,67 +823,94 @@ class Database:
                 "UPDATE sticker_packs SET artist = ? WHERE name = ?",
                 (artist, pack_name)
             )
-            conn.commit()
-            return cursor.rowcount > 0
+        self._notify_pack_changed(pack_name)
+        return cursor.rowcount > 0
 
     def delete_sticker_pack(self, pack_name: str) -> bool:
         try:
             with self._connect() as conn:
                 cursor: sqlite3.Cursor = conn.execute("DELETE FROM sticker_packs WHERE name = ?", (pack_name,))
-                conn.commit()
-                return cursor.rowcount > 0
         except Exception:
             return False
+        self._notify_pack_changed(pack_name)
+        return cursor.rowcount > 0
 
     # Sticker Operations
-    def upsert_sticker(self, pack_name: str, sticker: StickerRecord) -> None:
+    def upsert_pack_stickers(self, pack: StickerPackRecord, stickers: list[StickerRecord], reorders: dict[str, int]) -> None:
+        # Writes a whole pack update in one transaction: the pack row (an existing artist is kept),
+        # the given sticker rows and new display_order values for the file_unique_ids in reorders
         with self._connect() as conn:
             _ = conn.execute("""
-                INSERT INTO stickers (pack_name, file_id, file_unique_id, emoji, file_path, display_order)
-                VALUES (?, ?, ?, ?, ?, ?)
+                INSERT INTO sticker_packs (name, title, artist, last_update, sticker_count)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET
+                    title = excluded.title,
+                    last_update = excluded.last_update,
+                    sticker_count = excluded.sticker_count
+            """, (pack['name'], pack['title'], pack['artist'], pack['last_update'], pack['sticker_count']))
+            _ = conn.executemany("""
+                INSERT INTO stickers (pack_name, file_id, file_unique_id, emoji, file_path, display_order, file_size, sha256)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                 ON CONFLICT(file_unique_id) DO UPDATE SET
                     file_id = excluded.file_id,
                     emoji = excluded.emoji,
                     file_path = excluded.file_path,
-                    display_order = excluded.display_order
-            """, (
-                pack_name,
-                sticker['file_id'],
-                sticker['file_unique_id'],
-                sticker['emoji'],
-                sticker['file_path'],
-                sticker['display_order']
-            ))
-            conn.commit()
+                    display_order = excluded.display_order,
+                    file_size = COALESCE(excluded.file_size, stickers.file_size),
+                    sha256 = COALESCE(excluded.sha256, stickers.sha256)
+            """, [
+                (
+                    pack['name'], s['file_id'], s['file_unique_id'], s['emoji'], s['file_path'], s['display_order'],
+                    s.get('file_size'), s.get('sha256')
+                )
+                for s in stickers
+            ])
+            _ = conn.executemany(
+                "UPDATE stickers SET display_order = ? WHERE pack_name = ? AND file_unique_id = ?",
+                [(order, pack['name'], unique_id) for unique_id, order in reorders.items()]
+            )
+            self._record_file_blobs(conn, stickers)
+        self._notify_pack_changed(pack['name'])
 
-    def get_pack_stickers(self, pack_name: str, page: int = 1, per_page: int = 100) -> tuple[list[StickerRecord], int]:
-        with self._connect() as conn:
-            offset: int = (page - 1) * per_page
-            # Get total count
-            cursor: sqlite3.Cursor = conn.execute(
-                "SELECT COUNT(*) FROM stickers WHERE pack_name = ?",
-                (pack_name,)
+    @_cached_read
+    def get_pack_stickers(self, pack_name: str, after: str | None = None, limit: int = 100,
+                          with_total: bool = False) -> Page[StickerRecord]:
+        # Keyset page in (display_order, file_unique_id) order: each page seeks the index to the last
+        # sticker of the previous one, so deep pages cost the same as the first
+        scope: str = f"pack_stickers:{pack_name}"
+        seek: str = ""
+        seek_params: list[Any] = []
+        if after:
+            seek, seek_params = seek_condition(
+                [('display_order', False), ('file_unique_id', False)], decode_token(after, scope, 2)
             )
-            total: int = cursor.fetchone()[0]
-            # Get paginated results ordered by display_order
-            cursor = conn.execute("""
-                SELECT file_id, file_unique_id, emoji, file_path, display_order
+        with self._connect() as conn:
+            cursor: sqlite3.Cursor = conn.execute(f"""
+                SELECT file_id, file_unique_id, emoji, file_path, display_order, file_size, sha256
                 FROM stickers
-                WHERE pack_name = ?
-                ORDER BY display_order
-                LIMIT ? OFFSET ?
-            """, (pack_name, per_page, offset))
+                WHERE pack_name = ?{' AND ' + seek if seek else ''}
+                ORDER BY display_order, file_unique_id
+                LIMIT ?
+            """, (pack_name, *seek_params, limit + 1))
             stickers = [
                 StickerRecord(
                     file_id=row['file_id'],
                     file_unique_id=row['file_unique_id'],
                     emoji=row['emoji'],
                     file_path=row['file_path'],
-                    display_order=row['display_order']
+                    display_order=row['display_order'],
+                    file_size=row['file_size'],
+                    sha256=row['sha256']
                 )
                 for row in cursor.fetchall()
             ]
-            return stickers, total
+        total: int | None = self.count_pack_stickers(pack_name) if with_total else None
+        return _keyset_page(stickers, limit, scope, lambda s: [s['display_order'], s['file_unique_id']], total)
+
+    @_cached_read
+    def count_pack_stickers(self, pack_name: str) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM stickers WHERE pack_name = ?", (pack_name,)).fetchone()[0]
 
     def get_sticker_unique_ids_with_order(self, pack_name: str) -> dict[str, int]:
         with self._connect() as conn:
@@ -319,14 +920,6 @@ class Database:
             )
             return {row['file_unique_id']: row['display_order'] for row in cursor.fetchall()}
 
-    def get_sticker_unique_ids(self, pack_name: str) -> set[str]:
-        with self._connect() as conn:
-            cursor: sqlite3.Cursor = conn.execute(
-                "SELECT file_unique_id FROM stickers WHERE pack_name = ?",
-                (pack_name,)
-            )
-            return {row['file_unique_id'] for row in cursor.fetchall()}
-
     def update_sticker_emoji(self, pack_name: str, file_unique_id: str, emoji: str) -> bool:
         with self._connect() as conn:
             cursor: sqlite3.Cursor = conn.execute("""
@@ -334,51 +927,180 @@ class Database:
                 SET emoji = ?
                 WHERE pack_name = ? AND file_unique_id = ?
             """, (emoji, pack_name, file_unique_id))
-            conn.commit()
-            return cursor.rowcount > 0
+        self._notify_pack_changed(pack_name)
+        return cursor.rowcount > 0
+
+    @_cached_read
+    def match_sticker_emojis(self, query: str, limit: int) -> list[str] | None:
+        # file_unique_ids of up to limit stickers whose emoji contain query, best full-text match first;
+        # None when the query is too short for the trigram index
+        phrase: str | None = _fts_phrase(query)
+        if phrase is None:
+            return None
+        with self._connect() as conn:
+            cursor: sqlite3.Cursor = conn.execute("""
+                SELECT s.file_unique_id FROM stickers_fts f
+                JOIN stickers s ON s.rowid = f.rowid
+                WHERE stickers_fts MATCH ?
+                ORDER BY f.rank
+                LIMIT ?
+            """, (phrase, limit))
+            return [row['file_unique_id'] for row in cursor.fetchall()]
+
+    @_cached_read
+    def search_stickers(self, query: str = "", after: str | None = None, limit: int = 100,
+                        ranked: list[str] | None = None, sort: str = "",
+                        with_total: bool = False) -> Page[StickerSearchResult]:
+        # Every sticker grouped by pack with the most recently updated packs first, or when ranked is
+        # given the stickers of those file_unique_ids in that order, sorted by one of STICKER_SORT_ORDERS;
+        # see search_sticker_packs. For every sticker, CROSS JOIN keeps the packs as the outer loop, walked
+        # in the order of the index of the sort with the stickers of each read from idx_stickers_pack_order,
+        # so a page only sorts within one pack.
+        scope: str = f"stickers:{query}:{sort}"
+        order: list[tuple[str, bool]] = _listing_order(STICKER_SORT_ORDERS, sort, STICKER_SEARCH_ORDER, ranked)
+        source: str = (
+            "sticker_packs p CROSS JOIN stickers s ON s.pack_name = p.name" if ranked is None
+            else "json_each(?) r JOIN stickers s ON s.file_unique_id = r.value JOIN sticker_packs p ON p.name = s.pack_name"
+        )
+        source_params: list[Any] = [] if ranked is None else [json.dumps(ranked)]
+        seek: str = ""
+        seek_params: list[Any] = []
+        if after:
+            seek, seek_params = seek_condition(order, decode_token(after, scope, len(order)))
+        with self._connect() as conn:
+            cursor: sqlite3.Cursor = conn.execute(f"""
+                SELECT s.pack_name, p.title, p.artist, s.file_unique_id, s.emoji, s.file_path, s.display_order,
+                       {_sort_columns(order)}
+                FROM {source}
+                {'WHERE ' + seek if seek else ''}
+                ORDER BY {_order_by(order)}
+                LIMIT ?
+            """, (*source_params, *seek_params, limit + 1))
+            rows: list[sqlite3.Row] = cursor.fetchall()
+        stickers = [
+            StickerSearchResult(
+                pack_name=row['pack_name'],
+                pack_title=row['title'],
+                artist=row['artist'],
+                file_unique_id=row['file_unique_id'],
+                emoji=row['emoji'] or "",
+                file_path=row['file_path'],
+                display_order=row['display_order']
+            )
+            for row in rows
+        ]
+        keys: dict[str, list[Any]] = {row['file_unique_id']: _sort_key(row, order) for row in rows}
+        total: int | None = self.count_stickers(ranked) if with_total else None
+        return _keyset_page(stickers, limit, scope, lambda s: keys[s['file_unique_id']], total)
+
+    @_cached_read
+    def count_stickers(self, ranked: list[str] | None = None) -> int:
+        with self._connect() as conn:
+            if ranked is None:
+                return conn.execute("SELECT COUNT(*) FROM stickers").fetchone()[0]
+            return conn.execute(
+                "SELECT COUNT(*) FROM json_each(?) r JOIN stickers s ON s.file_unique_id = r.value", (json.dumps(ranked),)
+            ).fetchone()[0]
+
+    # Blob Store Operations
+    @staticmethod
+    def _record_file_blobs(conn: sqlite3.Connection, stickers: list[StickerRecord]) -> None:
+        _ = conn.executemany(
+            "INSERT OR REPLACE INTO file_blobs (file_unique_id, sha256, file_size) VALUES (?, ?, ?)",
+            [
+                (s['file_unique_id'], s['sha256'], s['file_size'])
+                for s in stickers
+                if s.get('sha256') and s.get('file_size') is not None
+            ]
+        )
+
+    def get_file_blobs(self, file_unique_ids: list[str]) -> dict[str, tuple[str, int]]:
+        # Known (sha256, file_size) of the given files
+        if not file_unique_ids:
+            return {}
+        with self._connect() as conn:
+            placeholders: str = ', '.join('?' * len(file_unique_ids))
+            cursor: sqlite3.Cursor = conn.execute(
+                f"SELECT file_unique_id, sha256, file_size FROM file_blobs WHERE file_unique_id IN ({placeholders})",
+                file_unique_ids
+            )
+            return {row['file_unique_id']: (row['sha256'], row['file_size']) for row in cursor.fetchall()}
+
+    def get_pack_sha256s(self, pack_name: str) -> list[str]:
+        with self._connect() as conn:
+            cursor: sqlite3.Cursor = conn.execute(
+                "SELECT DISTINCT sha256 FROM stickers WHERE pack_name = ? AND sha256 IS NOT NULL",
+                (pack_name,)
+            )
+            return [row['sha256'] for row in cursor.fetchall()]
+
+    def get_sticker_files(self) -> list[tuple[str, str, str]]:
+        # (pack_name, file_unique_id, file_path) of every sticker
+        with self._connect() as conn:
+            cursor: sqlite3.Cursor = conn.execute(
+                "SELECT pack_name, file_unique_id, file_path FROM stickers ORDER BY pack_name, display_order"
+            )
+            return [(row['pack_name'], row['file_unique_id'], row['file_path']) for row in cursor.fetchall()]
 
-    def search_stickers(self, query: str, page: int = 1, per_page: int = 100) -> tuple[list[StickerSearchResult], int]:
-        with self._connect() as conn:
-            offset: int = (page - 1) * per_page
-            if not query:
-                # Get total count
-                cursor: sqlite3.Cursor = conn.execute("""
-                    SELECT COUNT(*) FROM stickers s
-                    JOIN sticker_packs p ON s.pack_name = p.name
-                """)
-                total: int = cursor.fetchone()[0]
-                # Get paginated results
-                cursor = conn.execute("""
-                    SELECT s.pack_name, p.title, p.artist, s.file_unique_id, s.emoji, s.file_path, s.display_order
-                    FROM stickers s
-                    JOIN sticker_packs p ON s.pack_name = p.name
-                    ORDER BY p.last_update DESC, s.display_order
-                    LIMIT ? OFFSET ?
-                """, (per_page, offset))
-            else:
-                query_pattern: str = f"%{query}%"
-                # Get total count
-                cursor = conn.execute("""
-                    SELECT COUNT(*) FROM stickers s
-                    JOIN sticker_packs p ON s.pack_name = p.name
-                    WHERE s.pack_name LIKE ? COLLATE NOCASE
-                       OR p.title LIKE ? COLLATE NOCASE
-                       OR p.artist LIKE ? COLLATE NOCASE
-                       OR s.emoji LIKE ? COLLATE NOCASE
-                """, (query_pattern, query_pattern, query_pattern, query_pattern))
-                total = cursor.fetchone()[0]
-                # Get paginated results
-                cursor = conn.execute("""
-                    SELECT s.pack_name, p.title, p.artist, s.file_unique_id, s.emoji, s.file_path, s.display_order
-                    FROM stickers s
-                    JOIN sticker_packs p ON s.pack_name = p.name
-                    WHERE s.pack_name LIKE ? COLLATE NOCASE
-                       OR p.title LIKE ? COLLATE NOCASE
-                       OR p.artist LIKE ? COLLATE NOCASE
-                       OR s.emoji LIKE ? COLLATE NOCASE
-                    ORDER BY p.last_update DESC, s.display_order
-                    LIMIT ? OFFSET ?
-                """, (query_pattern, query_pattern, query_pattern, query_pattern, per_page, offset))
+    def record_sticker_checksums(self, checksums: list[tuple[str, int, str]]) -> None:
+        # (file_unique_id, file_size, sha256) of files hashed outside of a download
+        with self._connect() as conn:
+            _ = conn.executemany(
+                "UPDATE stickers SET file_size = ?, sha256 = ? WHERE file_unique_id = ?",
+                [(size, sha256, unique_id) for unique_id, size, sha256 in checksums]
+            )
+            _ = conn.executemany(
+                "INSERT OR REPLACE INTO file_blobs (file_unique_id, sha256, file_size) VALUES (?, ?, ?)",
+                [(unique_id, sha256, size) for unique_id, size, sha256 in checksums]
+            )
+
+    # Search Index Operations
+    def get_pack_change_marker(self) -> tuple[int, int]:
+        # Cheap (pack count, newest last_update) pair used to detect writes made by other processes
+        with self._connect() as conn:
+            row = conn.execute("SELECT COUNT(*), COALESCE(MAX(last_update), 0) FROM sticker_packs").fetchone()
+            return row[0], row[1]
+
+    def get_pack_names_updated_since(self, timestamp: int) -> list[str]:
+        with self._connect() as conn:
+            cursor: sqlite3.Cursor = conn.execute(
+                "SELECT name FROM sticker_packs WHERE last_update >= ?",
+                (timestamp,)
+            )
+            return [row['name'] for row in cursor.fetchall()]
+
+    def get_search_documents(self, pack_names: list[str] | None = None) -> tuple[list[PackSearchDocument], list[StickerSearchResult]]:
+        # Returns the searchable columns of the given packs (or all packs) and their stickers
+        with self._connect() as conn:
+            pack_filter: str = ""
+            sticker_filter: str = ""
+            params: tuple[str, ...] = ()
+            if pack_names is not None:
+                if not pack_names:
+                    return [], []
+                placeholders: str = ', '.join('?' * len(pack_names))
+                pack_filter = f"WHERE name IN ({placeholders})"
+                sticker_filter = f"WHERE s.pack_name IN ({placeholders})"
+                params = tuple(pack_names)
+            cursor: sqlite3.Cursor = conn.execute(f"""
+                SELECT name, title, artist, last_update FROM sticker_packs {pack_filter}
+            """, params)
+            packs = [
+                PackSearchDocument(
+                    name=row['name'],
+                    title=row['title'],
+                    artist=row['artist'],
+                    last_update=row['last_update']
+                )
+                for row in cursor.fetchall()
+            ]
+            cursor = conn.execute(f"""
+                SELECT s.pack_name, p.title, p.artist, s.file_unique_id, s.emoji, s.file_path, s.display_order
+                FROM stickers s
+                JOIN sticker_packs p ON s.pack_name = p.name
+                {sticker_filter}
+                ORDER BY s.pack_name, s.display_order, s.file_unique_id
+            """, params)
             stickers = [
                 StickerSearchResult(
                     pack_name=row['pack_name'],
@@ -391,7 +1113,117 @@ class Database:
                 )
                 for row in cursor.fetchall()
             ]
-            return stickers, total
+            return packs, stickers
+
+    # Bulk Update Progress Operations
+    def begin_pack_update_run(self, pack_names: list[str]) -> list[str]:
+        # Resumes an interrupted run if one left pending packs, otherwise starts a new run over pack_names
+        with self._connect(invalidates=False) as conn:
+            cursor: sqlite3.Cursor = conn.execute(
+                "SELECT pack_name FROM pack_update_progress WHERE status = 'pending' ORDER BY pack_name"
+            )
+            pending: list[str] = [row['pack_name'] for row in cursor.fetchall()]
+            if pending:
+                return pending
+            _ = conn.execute("DELETE FROM pack_update_progress")
+            now: int = int(time.time())
+            _ = conn.executemany(
+                "INSERT INTO pack_update_progress (pack_name, updated_at) VALUES (?, ?)",
+                [(name, now) for name in pack_names]
+            )
+            return list(pack_names)
+
+    def record_pack_update(self, pack_name: str, status: str, attempts: int, error: str | None = None) -> None:
+        with self._connect(invalidates=False) as conn:
+            _ = conn.execute("""
+                UPDATE pack_update_progress SET status = ?, attempts = ?, error = ?, updated_at = ?
+                WHERE pack_name = ?
+            """, (status, attempts, error, int(time.time()), pack_name))
+
+    def finish_pack_update_run(self) -> None:
+        with self._connect(invalidates=False) as conn:
+            _ = conn.execute("DELETE FROM pack_update_progress")
+
+    # Job Operations
+    @staticmethod
+    def _job_from_row(row: sqlite3.Row) -> JobRecord:
+        return JobRecord(
+            id=row['id'],
+            kind=row['kind'],
+            target=row['target'],
+            status=row['status'],
+            total=row['total'],
+            completed=row['completed'],
+            failed=row['failed'],
+            results=json.loads(row['results']),
+            result=json.loads(row['result']) if row['result'] else None,
+            error=row['error'],
+            created_at=row['created_at'],
+            started_at=row['started_at'],
+            finished_at=row['finished_at']
+        )
+
+    def create_job(self, job_id: str, kind: str, target: str | None) -> None:
+        with self._connect(invalidates=False) as conn:
+            _ = conn.execute(
+                "INSERT INTO jobs (id, kind, target, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, kind, target, int(time.time()))
+            )
+
+    def start_job(self, job_id: str) -> None:
+        with self._connect(invalidates=False) as conn:
+            _ = conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?",
+                (int(time.time()), job_id)
+            )
+
+    def update_job_progress(self, job_id: str, results: dict[str, bool], total: int) -> None:
+        with self._connect(invalidates=False) as conn:
+            _ = conn.execute("""
+                UPDATE jobs SET total = ?, completed = ?, failed = ?, results = ?
+                WHERE id = ?
+            """, (
+                total,
+                len(results),
+                sum(not success for success in results.values()),
+                json.dumps(results, ensure_ascii=False),
+                job_id
+            ))
+
+    def finish_job(self, job_id: str, status: str, result: dict[str, object] | None = None, error: str | None = None) -> None:
+        with self._connect(invalidates=False) as conn:
+            _ = conn.execute("""
+                UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?
+                WHERE id = ?
+            """, (
+                status,
+                json.dumps(result, ensure_ascii=False) if result is not None else None,
+                error,
+                int(time.time()),
+                job_id
+            ))
+
+    def interrupt_unfinished_jobs(self) -> int:
+        # Jobs left queued or running by a previous process will never finish
+        with self._connect(invalidates=False) as conn:
+            cursor: sqlite3.Cursor = conn.execute("""
+                UPDATE jobs SET status = 'interrupted', finished_at = ?
+                WHERE status IN ('queued', 'running')
+            """, (int(time.time()),))
+            return cursor.rowcount
+
+    def get_job(self, job_id: str) -> JobRecord | None:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return self._job_from_row(row) if row else None
+
+    def get_jobs(self, limit: int = 50) -> list[JobRecord]:
+        with self._connect() as conn:
+            cursor: sqlite3.Cursor = conn.execute(
+                "SELECT * FROM jobs ORDER BY created_at DESC, rowid DESC LIMIT ?",
+                (limit,)
+            )
+            return [self._job_from_row(row) for row in cursor.fetchall()]
 
     # Custom Pack Operations
     def create_custom_pack(self, name: str, title: str) -> bool:
@@ -401,15 +1233,15 @@ class Database:
                     "INSERT INTO custom_packs (name, title, last_modified) VALUES (?, ?, ?)",
                     (name, title, int(time.time()))
                 )
-                conn.commit()
                 return True
         except sqlite3.IntegrityError:
             return False
 
+    @_cached_read
     def get_custom_pack(self, name: str) -> CustomPackRecord | None:
         with self._connect() as conn:
             cursor: sqlite3.Cursor = conn.execute(
-                """SELECT name, title, signal_url, signal_uploaded_at, last_modified 
+                """SELECT name, title, signal_url, signal_uploaded_at, signal_fingerprint, last_modified, version
                    FROM custom_packs WHERE name = ?""",
                 (name,)
             )
@@ -420,98 +1252,254 @@ class Database:
                     title=row['title'],
                     signal_url=row['signal_url'],
                     signal_uploaded_at=row['signal_uploaded_at'],
-                    last_modified=row['last_modified']
+                    signal_fingerprint=row['signal_fingerprint'],
+                    last_modified=row['last_modified'],
+                    version=row['version']
                 )
             return None
 
-    def get_all_custom_packs(self, page: int = 1, per_page: int = 50) -> tuple[list[tuple[CustomPackRecord, int]], int]:
-        with self._connect() as conn:
-            offset: int = (page - 1) * per_page
-            # Get total count
-            cursor: sqlite3.Cursor = conn.execute("SELECT COUNT(*) FROM custom_packs")
-            total: int = cursor.fetchone()[0]
-            # Get paginated results
-            cursor = conn.execute("""
-                SELECT cp.name, cp.title, cp.signal_url, cp.signal_uploaded_at, 
-                       cp.last_modified, COUNT(cps.id) as sticker_count
-                FROM custom_packs cp
-                LEFT JOIN custom_pack_stickers cps ON cp.name = cps.custom_pack_name
-                GROUP BY cp.name, cp.title, cp.signal_url, cp.signal_uploaded_at, cp.last_modified
-                ORDER BY cp.name
-                LIMIT ? OFFSET ?
-            """, (per_page, offset))
-            packs = [
-                (CustomPackRecord(
-                    name=row['name'],
-                    title=row['title'],
-                    signal_url=row['signal_url'],
-                    signal_uploaded_at=row['signal_uploaded_at'],
-                    last_modified=row['last_modified']
-                ), row['sticker_count'])
-                for row in cursor.fetchall()
-            ]
-            return packs, total
+    @_cached_read
+    def get_all_custom_packs(self, after: str | None = None, limit: int = 50, thumbnail_limit: int = 2,
+                             with_total: bool = False) -> Page[CustomPackListing]:
+        # Custom packs by name with their sticker counts and first thumbnail_limit stickers, keyset
+        # paginated on the primary key and fetched in one query
+        scope: str = "custom_packs"
+        seek_params: list[Any] = decode_token(after, scope, 1) if after else []
+        with self._connect() as conn:
+            # Counted per pack from the (custom_pack_name, ...) index instead of grouping a join
+            cursor: sqlite3.Cursor = conn.execute(f"""
+                WITH page AS (
+                    SELECT cp.name, cp.title, cp.signal_url, cp.signal_uploaded_at, cp.signal_fingerprint, cp.last_modified, cp.version,
+                           (SELECT COUNT(*) FROM custom_pack_stickers cps WHERE cps.custom_pack_name = cp.name) AS sticker_count
+                    FROM custom_packs cp
+                    {'WHERE cp.name > ?' if after else ''}
+                    ORDER BY cp.name
+                    LIMIT ?
+                ),
+                thumbnails AS (
+                    SELECT cps.custom_pack_name, cps.pack_name, p.title AS pack_title, s.file_unique_id, s.file_path, s.emoji,
+                           cps.display_order,
+                           ROW_NUMBER() OVER (
+                               PARTITION BY cps.custom_pack_name ORDER BY cps.display_order, cps.file_unique_id
+                           ) AS thumbnail_rank
+                    FROM custom_pack_stickers cps
+                    JOIN stickers s ON cps.file_unique_id = s.file_unique_id
+                    JOIN sticker_packs p ON cps.pack_name = p.name
+                    WHERE cps.custom_pack_name IN (SELECT name FROM page)
+                )
+                SELECT page.*, t.pack_name, t.pack_title, t.file_unique_id, t.file_path, t.emoji, t.display_order
+                FROM page
+                LEFT JOIN thumbnails t ON t.custom_pack_name = page.name AND t.thumbnail_rank <= ?
+                ORDER BY page.name, t.thumbnail_rank
+            """, (*seek_params, limit + 1, thumbnail_limit))
+            packs: dict[str, CustomPackListing] = {}
+            for row in cursor.fetchall():
+                pack: CustomPackListing | None = packs.get(row['name'])
+                if pack is None:
+                    pack = packs[row['name']] = CustomPackListing(
+                        name=row['name'],
+                        title=row['title'],
+                        signal_url=row['signal_url'],
+                        signal_uploaded_at=row['signal_uploaded_at'],
+                        signal_fingerprint=row['signal_fingerprint'],
+                        last_modified=row['last_modified'],
+                        version=row['version'],
+                        sticker_count=row['sticker_count'],
+                        thumbnails=[]
+                    )
+                if row['file_unique_id'] is not None:
+                    pack['thumbnails'].append(CustomPackSticker(
+                        pack_name=row['pack_name'],
+                        pack_title=row['pack_title'],
+                        file_unique_id=row['file_unique_id'],
+                        file_path=row['file_path'],
+                        emoji=row['emoji'] or "",
+                        display_order=row['display_order']
+                    ))
+        total: int | None = self.count_custom_packs() if with_total else None
+        return _keyset_page(list(packs.values()), limit, scope, lambda p: [p['name']], total)
+
+    @_cached_read
+    def count_custom_packs(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM custom_packs").fetchone()[0]
 
     def update_custom_pack(self, name: str, title: str, stickers: list[CustomPackSticker]) -> bool:
-        try:
-            with self._connect() as conn:
-                # Update title and last_modified
-                _ = conn.execute(
-                    "UPDATE custom_packs SET title = ?, last_modified = ? WHERE name = ?",
-                    (title, int(time.time()), name)
-                )
-                # Delete existing stickers
-                _ = conn.execute("DELETE FROM custom_pack_stickers WHERE custom_pack_name = ?", (name,))
-                # Insert new stickers in batch with their order preserved
-                if stickers:
-                    _ = conn.executemany("""
-                        INSERT INTO custom_pack_stickers
-                        (custom_pack_name, pack_name, file_unique_id, display_order)
-                        VALUES (?, ?, ?, ?)
-                    """, [(name, s['pack_name'], s['file_unique_id'], idx) for idx, s in enumerate(stickers)])
-                conn.commit()
-                return True
-        except Exception as e:
-            print(f"Error updating custom pack: {e}")
-            return False
+        # Replaces the title and sticker list; False when the pack does not exist, database errors propagate
+        with self._connect() as conn:
+            # Update title and last_modified
+            cursor: sqlite3.Cursor = conn.execute(
+                "UPDATE custom_packs SET title = ?, last_modified = ?, version = version + 1 WHERE name = ?",
+                (title, int(time.time()), name)
+            )
+            if cursor.rowcount == 0:
+                return False
+            # Delete existing stickers
+            _ = conn.execute("DELETE FROM custom_pack_stickers WHERE custom_pack_name = ?", (name,))
+            # Insert new stickers in batch with their order preserved
+            if stickers:
+                _ = conn.executemany("""
+                    INSERT INTO custom_pack_stickers
+                    (custom_pack_name, pack_name, file_unique_id, display_order)
+                    VALUES (?, ?, ?, ?)
+                """, [
+                    (name, s['pack_name'], s['file_unique_id'], (idx + 1) * CUSTOM_PACK_ORDER_GAP)
+                    for idx, s in enumerate(stickers)
+                ])
+            return True
 
-    def update_custom_pack_signal_url(self, pack_name: str, signal_url: str, uploaded_at: int) -> bool:
+    def patch_custom_pack(self, name: str, version: int, ops: list[dict[str, Any]], title: str | None = None) -> int:
+        # Applies add, remove and move edits in order, touching only the rows they name, and returns the
+        # new version. Raises CustomPackConflict when the pack is no longer at version, KeyError when it
+        # does not exist and ValueError for an invalid edit; nothing is written in either case.
         with self._connect() as conn:
+            # Checking and bumping the version in one statement takes the write lock before anything is read
             cursor: sqlite3.Cursor = conn.execute(
-                "UPDATE custom_packs SET signal_url = ?, signal_uploaded_at = ? WHERE name = ?",
-                (signal_url, uploaded_at, pack_name)
+                """UPDATE custom_packs SET title = COALESCE(?, title), last_modified = ?, version = version + 1
+                   WHERE name = ? AND version = ?""",
+                (title, int(time.time()), name, version)
+            )
+            if cursor.rowcount == 0:
+                row = conn.execute("SELECT version FROM custom_packs WHERE name = ?", (name,)).fetchone()
+                if row is None:
+                    raise KeyError(name)
+                raise CustomPackConflict(name, row['version'])
+            for idx, op in enumerate(ops):
+                self._apply_custom_pack_op(conn, name, idx, op)
+            return version + 1
+
+    def _apply_custom_pack_op(self, conn: sqlite3.Connection, name: str, idx: int, op: dict[str, Any]) -> None:
+        kind: Any = op.get('op') if isinstance(op, dict) else None
+        file_unique_id: Any = op.get('file_unique_id') if isinstance(op, dict) else None
+        if kind not in CUSTOM_PACK_EDIT_OPS or not isinstance(file_unique_id, str):
+            raise ValueError(f"Edit {idx} needs an op of {', '.join(CUSTOM_PACK_EDIT_OPS)} and a file_unique_id")
+        if kind == 'remove':
+            cursor: sqlite3.Cursor = conn.execute(
+                "DELETE FROM custom_pack_stickers WHERE custom_pack_name = ? AND file_unique_id = ?",
+                (name, file_unique_id)
+            )
+            if cursor.rowcount == 0:
+                raise ValueError(f"Edit {idx}: {file_unique_id} is not in the pack")
+            return
+        before: Any = op.get('before')
+        if before is not None and not isinstance(before, str):
+            raise ValueError(f"Edit {idx}: before must be a file_unique_id or null")
+        order: int = self._order_key_before(conn, name, before, file_unique_id, idx)
+        if kind == 'move':
+            cursor = conn.execute(
+                "UPDATE custom_pack_stickers SET display_order = ? WHERE custom_pack_name = ? AND file_unique_id = ?",
+                (order, name, file_unique_id)
+            )
+            if cursor.rowcount == 0:
+                raise ValueError(f"Edit {idx}: {file_unique_id} is not in the pack")
+            return
+        row = conn.execute("SELECT pack_name FROM stickers WHERE file_unique_id = ?", (file_unique_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"Edit {idx}: sticker {file_unique_id} does not exist")
+        if conn.execute(
+            "SELECT 1 FROM custom_pack_stickers WHERE custom_pack_name = ? AND file_unique_id = ?",
+            (name, file_unique_id)
+        ).fetchone():
+            raise ValueError(f"Edit {idx}: {file_unique_id} is already in the pack")
+        _ = conn.execute("""
+            INSERT INTO custom_pack_stickers (custom_pack_name, pack_name, file_unique_id, display_order)
+            VALUES (?, ?, ?, ?)
+        """, (name, row['pack_name'], file_unique_id, order))
+
+    def _order_key_before(self, conn: sqlite3.Connection, name: str, before: str | None, moving: str, idx: int) -> int:
+        # display_order for a sticker placed right before another one, or at the end when before is None.
+        # Only when two neighbours have no free key left between them is the pack respaced.
+        if before is None:
+            row = conn.execute(
+                "SELECT MAX(display_order) FROM custom_pack_stickers WHERE custom_pack_name = ? AND file_unique_id != ?",
+                (name, moving)
+            ).fetchone()
+            return (row[0] if row[0] is not None else 0) + CUSTOM_PACK_ORDER_GAP
+        if before == moving:
+            raise ValueError(f"Edit {idx}: a sticker cannot be placed before itself")
+        lower, upper = self._neighbour_orders(conn, name, before, moving, idx)
+        if upper - lower < 2:
+            self._respace_custom_pack(conn, name)
+            lower, upper = self._neighbour_orders(conn, name, before, moving, idx)
+        return (lower + upper) // 2
+
+    def _neighbour_orders(self, conn: sqlite3.Connection, name: str, before: str, moving: str, idx: int) -> tuple[int, int]:
+        # display_order of before and of the sticker preceding it, ignoring the sticker being moved
+        row = conn.execute(
+            "SELECT display_order FROM custom_pack_stickers WHERE custom_pack_name = ? AND file_unique_id = ?",
+            (name, before)
+        ).fetchone()
+        if row is None:
+            raise ValueError(f"Edit {idx}: {before} is not in the pack")
+        upper: int = row[0]
+        row = conn.execute("""
+            SELECT MAX(display_order) FROM custom_pack_stickers
+            WHERE custom_pack_name = ? AND display_order < ? AND file_unique_id != ?
+        """, (name, upper, moving)).fetchone()
+        return (row[0] if row[0] is not None else upper - 2 * CUSTOM_PACK_ORDER_GAP), upper
+
+    def _respace_custom_pack(self, conn: sqlite3.Connection, name: str) -> None:
+        cursor: sqlite3.Cursor = conn.execute(
+            "SELECT id FROM custom_pack_stickers WHERE custom_pack_name = ? ORDER BY display_order, id", (name,)
+        )
+        _ = conn.executemany(
+            "UPDATE custom_pack_stickers SET display_order = ? WHERE id = ?",
+            [((idx + 1) * CUSTOM_PACK_ORDER_GAP, row['id']) for idx, row in enumerate(cursor.fetchall())]
+        )
+
+    def update_custom_pack_signal_url(self, pack_name: str, signal_url: str, uploaded_at: int, fingerprint: str) -> bool:
+        with self._connect() as conn:
+            cursor: sqlite3.Cursor = conn.execute(
+                "UPDATE custom_packs SET signal_url = ?, signal_uploaded_at = ?, signal_fingerprint = ? WHERE name = ?",
+                (signal_url, uploaded_at, fingerprint, pack_name)
             )
-            conn.commit()
             return cursor.rowcount > 0
 
+    @_cached_read
+    def get_custom_pack_signal_fingerprints(self, pack_names: list[str] | None = None) -> dict[str, str]:
+        # Same as get_pack_signal_fingerprints, for custom packs
+        if pack_names is not None and not pack_names:
+            return {}
+        with self._connect() as conn:
+            cursor: sqlite3.Cursor = conn.execute(f"""
+                SELECT c.name, c.title, ? AS author, s.file_unique_id AS content, s.emoji
+                FROM custom_packs c
+                LEFT JOIN custom_pack_stickers cps ON cps.custom_pack_name = c.name
+                LEFT JOIN stickers s ON s.file_unique_id = cps.file_unique_id
+                WHERE {f"c.name IN ({', '.join('?' * len(pack_names))})" if pack_names is not None else "c.signal_url IS NOT NULL"}
+                ORDER BY c.name, cps.display_order, cps.file_unique_id
+            """, (CUSTOM_PACK_SIGNAL_AUTHOR, *(pack_names or ())))
+            return _signal_fingerprints(cursor)
+
     def delete_custom_pack(self, name: str) -> bool:
         try:
             with self._connect() as conn:
                 cursor: sqlite3.Cursor = conn.execute("DELETE FROM custom_packs WHERE name = ?", (name,))
-                conn.commit()
                 return cursor.rowcount > 0
         except Exception:
             return False
 
-    def get_custom_pack_stickers(self, pack_name: str, page: int = 1, per_page: int = 100) -> tuple[list[CustomPackSticker], int]:
+    @_cached_read
+    def get_custom_pack_stickers(self, pack_name: str, after: str | None = None, limit: int = 100,
+                                 with_total: bool = False) -> Page[CustomPackSticker]:
+        # Keyset page in (display_order, file_unique_id) order, see get_pack_stickers
+        scope: str = f"custom_pack_stickers:{pack_name}"
+        seek: str = ""
+        seek_params: list[Any] = []
+        if after:
+            seek, seek_params = seek_condition(
+                [('cps.display_order', False), ('cps.file_unique_id', False)], decode_token(after, scope, 2)
+            )
         with self._connect() as conn:
-            offset: int = (page - 1) * per_page
-            # Get total count
-            cursor: sqlite3.Cursor = conn.execute("""
-                SELECT COUNT(*) FROM custom_pack_stickers
-                WHERE custom_pack_name = ?
-            """, (pack_name,))
-            total: int = cursor.fetchone()[0]
-            # Get paginated results ordered by display_order
-            cursor = conn.execute("""
+            cursor: sqlite3.Cursor = conn.execute(f"""
                 SELECT cps.pack_name, p.title, s.file_unique_id, s.file_path, s.emoji, cps.display_order
                 FROM custom_pack_stickers cps
                 JOIN stickers s ON cps.file_unique_id = s.file_unique_id
                 JOIN sticker_packs p ON cps.pack_name = p.name
-                WHERE cps.custom_pack_name = ?
-                ORDER BY cps.display_order
-                LIMIT ? OFFSET ?
-            """, (pack_name, per_page, offset))
+                WHERE cps.custom_pack_name = ?{' AND ' + seek if seek else ''}
+                ORDER BY cps.display_order, cps.file_unique_id
+                LIMIT ?
+            """, (pack_name, *seek_params, limit + 1))
             stickers = [
                 CustomPackSticker(
                     pack_name=row['pack_name'],
@@ -523,73 +1511,90 @@ class Database:
                 )
                 for row in cursor.fetchall()
             ]
-            return stickers, total
+        total: int | None = self.count_custom_pack_stickers(pack_name) if with_total else None
+        return _keyset_page(stickers, limit, scope, lambda s: [s['display_order'], s['file_unique_id']], total)
+
+    @_cached_read
+    def count_custom_pack_stickers(self, pack_name: str) -> int:
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM custom_pack_stickers WHERE custom_pack_name = ?", (pack_name,)
+            ).fetchone()[0]
+
+    @_cached_read
+    def get_custom_pack_members(self, pack_name: str) -> dict[str, str]:
+        # file_unique_id -> source pack of every sticker of a custom pack, without the sticker details
+        with self._connect() as conn:
+            cursor: sqlite3.Cursor = conn.execute(
+                "SELECT file_unique_id, pack_name FROM custom_pack_stickers WHERE custom_pack_name = ?",
+                (pack_name,)
+            )
+            return {row['file_unique_id']: row['pack_name'] for row in cursor.fetchall()}
 
+    @_cached_read
     def get_all_pack_names(self) -> list[str]:
         with self._connect() as conn:
             cursor: sqlite3.Cursor = conn.execute("SELECT name FROM sticker_packs ORDER BY name")
             return [row['name'] for row in cursor.fetchall()]
 
+    @_cached_read
     def get_all_custom_pack_names(self) -> list[str]:
         with self._connect() as conn:
             cursor: sqlite3.Cursor = conn.execute("SELECT name FROM custom_packs ORDER BY name")
             return [row['name'] for row in cursor.fetchall()]
 
     # Export Operations
-    def export_single_pack_to_json(self, pack_name: str) -> str:
+    def iter_pack_exports(self, pack_names: list[str] | None = None) -> Iterator[dict[str, Any]]:
+        # Export documents of the given packs or of every pack in name order, read with a single
+        # ordered cursor and yielded one pack at a time so memory does not grow with the library
+        if pack_names is not None and not pack_names:
+            return
         with self._connect() as conn:
-            # Get pack metadata
-            cursor: sqlite3.Cursor = conn.execute("""
-                SELECT name, title, artist, last_update, sticker_count,
-                       signal_url, signal_uploaded_at
-                FROM sticker_packs WHERE name = ?
-            """, (pack_name,))
-            pack_row = cursor.fetchone()
-            if not pack_row:
-                return json.dumps({"error": "Pack not found"}, ensure_ascii=False, indent=2)
-            # Get all stickers for this pack
-            cursor = conn.execute("""
-                SELECT file_id, file_unique_id, emoji, file_path, display_order
-                FROM stickers
-                WHERE pack_name = ?
-                ORDER BY display_order
-            """, (pack_name,))
-            stickers = [
-                {
-                    'file_id': row['file_id'],
-                    'file_unique_id': row['file_unique_id'],
-                    'emoji': row['emoji'],
-                    'file_path': row['file_path'],
-                    'display_order': row['display_order']
-                }
-                for row in cursor.fetchall()
-            ]
-            pack_data = {
-                'name': pack_row['name'],
-                'title': pack_row['title'],
-                'artist': pack_row['artist'],
-                'last_update': pack_row['last_update'],
-                'sticker_count': pack_row['sticker_count'],
-                'telegram_url': f"https://t.me/addstickers/{pack_row['name']}",
-                'signal_url': pack_row['signal_url'],
-                'signal_uploaded_at': pack_row['signal_uploaded_at'],
-                'stickers': stickers
-            }
-            return json.dumps(pack_data, ensure_ascii=False, indent=2)
+            cursor: sqlite3.Cursor = conn.execute(f"""
+                SELECT p.name, p.title, p.artist, p.last_update, p.sticker_count,
+                       p.signal_url, p.signal_uploaded_at, p.signal_fingerprint,
+                       s.file_id, s.file_unique_id, s.emoji, s.file_path, s.display_order
+                FROM sticker_packs p
+                LEFT JOIN stickers s ON s.pack_name = p.name
+                {f"WHERE p.name IN ({', '.join('?' * len(pack_names))})" if pack_names is not None else ""}
+                ORDER BY p.name, s.display_order
+            """, pack_names or ())
+            pack_data: dict[str, Any] | None = None
+            for row in cursor:
+                if pack_data is None or pack_data['name'] != row['name']:
+                    if pack_data is not None:
+                        yield pack_data
+                    pack_data = {
+                        'name': row['name'],
+                        'title': row['title'],
+                        'artist': row['artist'],
+                        'last_update': row['last_update'],
+                        'sticker_count': row['sticker_count'],
+                        'telegram_url': f"https://t.me/addstickers/{row['name']}",
+                        'signal_url': row['signal_url'],
+                        'signal_uploaded_at': row['signal_uploaded_at'],
+                        'signal_fingerprint': row['signal_fingerprint'],
+                        'stickers': []
+                    }
+                if row['file_unique_id'] is not None:
+                    pack_data['stickers'].append({
+                        'file_id': row['file_id'],
+                        'file_unique_id': row['file_unique_id'],
+                        'emoji': row['emoji'],
+                        'file_path': row['file_path'],
+                        'display_order': row['display_order']
+                    })
+            if pack_data is not None:
+                yield pack_data
 
-    def export_single_custom_pack_to_json(self, pack_name: str) -> str:
+    def iter_custom_pack_exports(self, pack_names: list[str] | None = None) -> Iterator[dict[str, Any]]:
+        # Same as iter_pack_exports, for custom packs
+        if pack_names is not None and not pack_names:
+            return
         with self._connect() as conn:
-            # Get custom pack metadata
-            cursor: sqlite3.Cursor = conn.execute("""
-                SELECT name, title, signal_url, signal_uploaded_at, last_modified
-                FROM custom_packs WHERE name = ?
-            """, (pack_name,))
-            pack_row = cursor.fetchone()
-            if not pack_row:
-                return json.dumps({"error": "Custom pack not found"}, ensure_ascii=False, indent=2)
-            # Get all stickers for this custom pack with full details
-            cursor = conn.execute("""
+            cursor: sqlite3.Cursor = conn.execute(f"""
                 SELECT
+                    c.name, c.title, c.signal_url, c.signal_uploaded_at, c.signal_fingerprint, c.last_modified,
                     cps.display_order,
                     cps.pack_name as source_pack_name,
                     p.title as source_pack_title,
@@ -597,31 +1602,146 @@ class Database:
                     s.file_path,
                     s.emoji,
                     s.file_id
-                FROM custom_pack_stickers cps
-                JOIN stickers s ON cps.file_unique_id = s.file_unique_id
-                JOIN sticker_packs p ON cps.pack_name = p.name
-                WHERE cps.custom_pack_name = ?
-                ORDER BY cps.display_order
-            """, (pack_name,))
-            stickers = [
-                {
-                    'display_order': row['display_order'],
-                    'source_pack_name': row['source_pack_name'],
-                    'source_pack_title': row['source_pack_title'],
-                    'file_unique_id': row['file_unique_id'],
-                    'file_id': row['file_id'],
-                    'file_path': row['file_path'],
-                    'emoji': row['emoji']
-                }
-                for row in cursor.fetchall()
-            ]
-            pack_data = {
-                'name': pack_row['name'],
-                'title': pack_row['title'],
-                'signal_url': pack_row['signal_url'],
-                'signal_uploaded_at': pack_row['signal_uploaded_at'],
-                'last_modified': pack_row['last_modified'],
-                'sticker_count': len(stickers),
-                'stickers': stickers
-            }
+                FROM custom_packs c
+                LEFT JOIN custom_pack_stickers cps ON cps.custom_pack_name = c.name
+                LEFT JOIN stickers s ON cps.file_unique_id = s.file_unique_id
+                LEFT JOIN sticker_packs p ON cps.pack_name = p.name
+                {f"WHERE c.name IN ({', '.join('?' * len(pack_names))})" if pack_names is not None else ""}
+                ORDER BY c.name, cps.display_order
+            """, pack_names or ())
+            pack_data: dict[str, Any] | None = None
+            for row in cursor:
+                if pack_data is None or pack_data['name'] != row['name']:
+                    if pack_data is not None:
+                        pack_data['sticker_count'] = len(pack_data['stickers'])
+                        yield pack_data
+                    pack_data = {
+                        'name': row['name'],
+                        'title': row['title'],
+                        'signal_url': row['signal_url'],
+                        'signal_uploaded_at': row['signal_uploaded_at'],
+                        'signal_fingerprint': row['signal_fingerprint'],
+                        'last_modified': row['last_modified'],
+                        'sticker_count': 0,
+                        'stickers': []
+                    }
+                if row['file_unique_id'] is not None and row['source_pack_title'] is not None:
+                    pack_data['stickers'].append({
+                        'display_order': row['display_order'],
+                        'source_pack_name': row['source_pack_name'],
+                        'source_pack_title': row['source_pack_title'],
+                        'file_unique_id': row['file_unique_id'],
+                        'file_id': row['file_id'],
+                        'file_path': row['file_path'],
+                        'emoji': row['emoji']
+                    })
+            if pack_data is not None:
+                pack_data['sticker_count'] = len(pack_data['stickers'])
+                yield pack_data
+
+    def export_single_pack_to_json(self, pack_name: str) -> str:
+        for pack_data in self.iter_pack_exports([pack_name]):
+            return json.dumps(pack_data, ensure_ascii=False, indent=2)
+        return json.dumps({"error": "Pack not found"}, ensure_ascii=False, indent=2)
+
+    def export_single_custom_pack_to_json(self, pack_name: str) -> str:
+        for pack_data in self.iter_custom_pack_exports([pack_name]):
             return json.dumps(pack_data, ensure_ascii=False, indent=2)
+        return json.dumps({"error": "Custom pack not found"}, ensure_ascii=False, indent=2)
+
+    # Import Operations
+    def import_pack_exports(self, packs: list[dict[str, Any]]) -> None:
+        # Writes a batch of pack export documents in one transaction. Each document is authoritative
+        # for its pack: stickers of the pack missing from the document are removed.
+        with self._connect() as conn:
+            _ = conn.executemany("""
+                INSERT INTO sticker_packs (name, title, artist, last_update, sticker_count, signal_url, signal_uploaded_at, signal_fingerprint)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET
+                    title = excluded.title,
+                    artist = excluded.artist,
+                    last_update = excluded.last_update,
+                    sticker_count = excluded.sticker_count,
+                    signal_url = excluded.signal_url,
+                    signal_uploaded_at = excluded.signal_uploaded_at,
+                    signal_fingerprint = excluded.signal_fingerprint
+            """, [
+                (
+                    p['name'], p['title'], p['artist'], p['last_update'], p['sticker_count'],
+                    p.get('signal_url'), p.get('signal_uploaded_at'), p.get('signal_fingerprint')
+                )
+                for p in packs
+            ])
+            _ = conn.executemany("""
+                INSERT INTO stickers (pack_name, file_id, file_unique_id, emoji, file_path, display_order)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(file_unique_id) DO UPDATE SET
+                    file_id = excluded.file_id,
+                    emoji = excluded.emoji,
+                    file_path = excluded.file_path,
+                    display_order = excluded.display_order
+            """, [
+                (p['name'], s['file_id'], s['file_unique_id'], s['emoji'], s['file_path'], s['display_order'])
+                for p in packs
+                for s in p['stickers']
+            ])
+            for p in packs:
+                unique_ids: list[str] = [s['file_unique_id'] for s in p['stickers']]
+                _ = conn.execute(f"""
+                    DELETE FROM stickers
+                    WHERE pack_name = ? AND file_unique_id NOT IN ({', '.join('?' * len(unique_ids))})
+                """, [p['name'], *unique_ids])
+        for p in packs:
+            self._notify_pack_changed(p['name'])
+
+    def import_custom_pack_exports(self, packs: list[dict[str, Any]]) -> dict[str, int]:
+        # Writes a batch of custom pack export documents in one transaction, replacing the sticker list
+        # of each pack. Stickers not in the library are skipped; returns how many per pack.
+        skipped: dict[str, int] = {}
+        with self._connect() as conn:
+            unique_ids: list[str] = sorted({s['file_unique_id'] for p in packs for s in p['stickers']})
+            # Stickers of the library, by file_unique_id, with the pack they belong to
+            known: dict[str, str] = {}
+            # Stay below SQLite's bound parameter limit
+            for start in range(0, len(unique_ids), 500):
+                chunk: list[str] = unique_ids[start:start + 500]
+                cursor: sqlite3.Cursor = conn.execute(
+                    f"SELECT file_unique_id, pack_name FROM stickers WHERE file_unique_id IN ({', '.join('?' * len(chunk))})",
+                    chunk
+                )
+                known.update((row['file_unique_id'], row['pack_name']) for row in cursor.fetchall())
+            _ = conn.executemany("""
+                INSERT INTO custom_packs (name, title, signal_url, signal_uploaded_at, signal_fingerprint, last_modified)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET
+                    title = excluded.title,
+                    signal_url = excluded.signal_url,
+                    signal_uploaded_at = excluded.signal_uploaded_at,
+                    signal_fingerprint = excluded.signal_fingerprint,
+                    last_modified = excluded.last_modified,
+                    version = custom_packs.version + 1
+            """, [
+                (
+                    p['name'], p['title'], p.get('signal_url'), p.get('signal_uploaded_at'), p.get('signal_fingerprint'),
+                    p.get('last_modified') or int(time.time())
+                )
+                for p in packs
+            ])
+            _ = conn.executemany(
+                "DELETE FROM custom_pack_stickers WHERE custom_pack_name = ?",
+                [(p['name'],) for p in packs]
+            )
+            rows: list[tuple[str, str, str, int]] = []
+            for p in packs:
+                stickers: list[dict[str, Any]] = sorted(p['stickers'], key=lambda s: s['display_order'])
+                kept: list[dict[str, Any]] = [s for s in stickers if s['file_unique_id'] in known]
+                skipped[p['name']] = len(stickers) - len(kept)
+                rows.extend(
+                    (p['name'], known[s['file_unique_id']], s['file_unique_id'], (idx + 1) * CUSTOM_PACK_ORDER_GAP)
+                    for idx, s in enumerate(kept)
+                )
+            _ = conn.executemany("""
+                INSERT INTO custom_pack_stickers (custom_pack_name, pack_name, file_unique_id, display_order)
+                VALUES (?, ?, ?, ?)
+            """, rows)
+        return skipped
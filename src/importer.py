@@ -0,0 +1,291 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import Any, BinaryIO, TypedDict
+
+from src.config import BLOB_DIR, DATABASE_FILE, DOWNLOAD_DIR
+from src.database import Database
+from src.storage import BlobStore, fsync_dir
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Packs written per transaction
+IMPORT_BATCH_SIZE: int = 200
+COPY_CHUNK_SIZE: int = 64 * 1024
+# Compared to tell whether an imported document changes a pack
+PACK_FIELDS: tuple[str, ...] = ('title', 'artist', 'last_update', 'signal_url', 'signal_uploaded_at', 'signal_fingerprint')
+CUSTOM_PACK_FIELDS: tuple[str, ...] = ('title', 'signal_url', 'signal_uploaded_at', 'signal_fingerprint')
+# Keys a document and each of its stickers must have, with the types their values may take
+PACK_KEYS: dict[str, tuple[type, ...]] = {'artist': (str,), 'last_update': (int,)}
+CUSTOM_PACK_KEYS: dict[str, tuple[type, ...]] = {'last_modified': (int, type(None))}
+PACK_STICKER_KEYS: dict[str, tuple[type, ...]] = {
+    'file_id': (str,), 'file_unique_id': (str,), 'file_path': (str,), 'emoji': (str, type(None)), 'display_order': (int,),
+}
+CUSTOM_PACK_STICKER_KEYS: dict[str, tuple[type, ...]] = {
+    'source_pack_name': (str,), 'file_unique_id': (str,), 'display_order': (int,),
+}
+
+class PackDiff(TypedDict):
+    name: str
+    # 'pack' or 'custom_pack'
+    kind: str
+    # 'new', 'changed' or 'unchanged'
+    status: str
+    changed_fields: list[str]
+    stickers_added: int
+    stickers_removed: int
+
+class ImportReport(TypedDict):
+    dry_run: bool
+    packs: list[PackDiff]
+    media_files: int
+    # Custom pack stickers left out because their sticker is not in the library
+    skipped_stickers: dict[str, int]
+    errors: list[str]
+
+def _document_kind(doc: Any) -> str | None:
+    # Export documents of custom packs carry last_modified, those of Telegram packs an artist
+    if not isinstance(doc, dict) or not isinstance(doc.get('name'), str) or not isinstance(doc.get('stickers'), list):
+        return None
+    if 'last_modified' in doc:
+        return 'custom_pack'
+    if 'artist' in doc:
+        return 'pack'
+    return None
+
+def _check_keys(values: dict[str, Any], keys: dict[str, tuple[type, ...]]) -> str | None:
+    missing: list[str] = [key for key in keys if key not in values]
+    if missing:
+        return f"is missing {', '.join(missing)}"
+    # bool is an int to isinstance, but never a valid order or timestamp
+    invalid: list[str] = [
+        key for key, types in keys.items()
+        if isinstance(values[key], bool) or not isinstance(values[key], types)
+    ]
+    if invalid:
+        return f"has an invalid {', '.join(invalid)}"
+    return None
+
+def _check_document(doc: dict[str, Any], kind: str) -> str | None:
+    # Checked before anything is written, so a bad document is reported instead of failing its batch
+    error: str | None = _check_keys(doc, PACK_KEYS if kind == 'pack' else CUSTOM_PACK_KEYS)
+    if error:
+        return f"{kind.replace('_', ' ')} {error}"
+    keys: dict[str, tuple[type, ...]] = PACK_STICKER_KEYS if kind == 'pack' else CUSTOM_PACK_STICKER_KEYS
+    for idx, sticker in enumerate(doc['stickers']):
+        if not isinstance(sticker, dict):
+            return f"sticker {idx} is not an object"
+        error = _check_keys(sticker, keys)
+        if error:
+            return f"sticker {idx} {error}"
+    return None
+
+def _diff(kind: str, doc: dict[str, Any], current: dict[str, Any] | None, fields: tuple[str, ...]) -> PackDiff:
+    imported_ids: set[str] = {s['file_unique_id'] for s in doc['stickers']}
+    if current is None:
+        return {
+            'name': doc['name'], 'kind': kind, 'status': 'new', 'changed_fields': [],
+            'stickers_added': len(imported_ids), 'stickers_removed': 0,
+        }
+    current_ids: set[str] = {s['file_unique_id'] for s in current['stickers']}
+    changed_fields: list[str] = [field for field in fields if doc.get(field) != current.get(field)]
+    order = lambda stickers: [s['file_unique_id'] for s in sorted(stickers, key=lambda s: s['display_order'])]
+    if order(doc['stickers']) != order(current['stickers']):
+        changed_fields.append('stickers')
+    return {
+        'name': doc['name'],
+        'kind': kind,
+        'status': 'changed' if changed_fields else 'unchanged',
+        'changed_fields': changed_fields,
+        'stickers_added': len(imported_ids - current_ids),
+        'stickers_removed': len(current_ids - imported_ids),
+    }
+
+class PackImporter:
+    # Loads export documents, single JSON files or the ZIP bundles of the export endpoints, and
+    # writes them in batched transactions. Custom packs are written last, once the stickers they
+    # reference are in. With dry_run nothing is written and the report only holds the diff.
+    def __init__(self, db: Database, store: BlobStore, download_dir: Path, dry_run: bool = False,
+                 batch_size: int = IMPORT_BATCH_SIZE) -> None:
+        self.db: Database = db
+        self.store: BlobStore = store
+        self.download_dir: Path = download_dir
+        self.dry_run: bool = dry_run
+        self.batch_size: int = batch_size
+        self._packs: list[dict[str, Any]] = []
+        self._custom_packs: list[dict[str, Any]] = []
+        # Sticker files of the imported custom packs, (custom pack, file_path) -> source pack
+        self._custom_sources: dict[tuple[str, str], str] = {}
+        self._checksums: list[tuple[str, int, str]] = []
+        self._media_paths: set[Path] = set()
+        self.report: ImportReport = {
+            'dry_run': dry_run, 'packs': [], 'media_files': 0, 'skipped_stickers': {}, 'errors': []
+        }
+
+    def import_file(self, stream: BinaryIO, filename: str) -> None:
+        # ZIP bundles are read member by member, so only one document is in memory at a time
+        if zipfile.is_zipfile(stream):
+            _ = stream.seek(0)
+            with zipfile.ZipFile(stream) as archive:
+                for info in archive.infolist():
+                    if info.is_dir():
+                        continue
+                    with archive.open(info) as member:
+                        if '/' not in info.filename and info.filename.endswith('.json'):
+                            self._add_document(member, f"{filename}:{info.filename}")
+                        else:
+                            self._add_media(member, info.filename)
+            return
+        _ = stream.seek(0)
+        self._add_document(stream, filename)
+
+    def _add_document(self, stream: BinaryIO, source: str) -> None:
+        try:
+            doc: Any = json.load(stream)
+        except (ValueError, UnicodeDecodeError) as e:
+            self.report['errors'].append(f"{source}: not valid JSON ({e})")
+            return
+        kind: str | None = _document_kind(doc)
+        if kind is None:
+            self.report['errors'].append(f"{source}: not a pack export")
+            return
+        error: str | None = _check_document(doc, kind)
+        if error:
+            self.report['errors'].append(f"{source}: {error}")
+            return
+        doc['title'] = doc.get('title') or doc['name']
+        if kind == 'pack':
+            doc['sticker_count'] = len(doc['stickers'])
+            self._packs.append(doc)
+            if len(self._packs) >= self.batch_size:
+                self._flush_packs()
+        else:
+            self._custom_packs.append(doc)
+            for sticker in doc['stickers']:
+                if sticker.get('file_path'):
+                    self._custom_sources[(doc['name'], sticker['file_path'])] = sticker['source_pack_name']
+
+    def _media_target(self, name: str) -> tuple[Path, str] | None:
+        # Pack media is stored as <pack>/<file>, custom pack media as <custom pack>_custom/<file>
+        parts: tuple[str, ...] = PurePosixPath(name).parts
+        if len(parts) != 2 or any(part in ('', '.', '..') or part.startswith('.') for part in parts):
+            return None
+        directory, file_path = parts
+        if directory.endswith('_custom'):
+            source_pack: str | None = self._custom_sources.get((directory.removesuffix('_custom'), file_path))
+            if source_pack is None:
+                return None
+            return self.download_dir / source_pack / file_path, Path(file_path).stem
+        return self.download_dir / directory / file_path, Path(file_path).stem
+
+    def _add_media(self, stream: BinaryIO, name: str) -> None:
+        target: tuple[Path, str] | None = self._media_target(name)
+        if target is None:
+            logger.warning(f"Skipped unexpected archive member {name}")
+            return
+        path, file_unique_id = target
+        # Files already in the registry are kept, the same file can come with several packs
+        if path in self._media_paths or path.exists():
+            return
+        self._media_paths.add(path)
+        self.report['media_files'] += 1
+        if self.dry_run:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp: Path = path.with_name(f".{path.name}.part")
+        digest = hashlib.sha256()
+        size: int = 0
+        with temp.open('wb') as f:
+            while chunk := stream.read(COPY_CHUNK_SIZE):
+                digest.update(chunk)
+                size += len(chunk)
+                _ = f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        sha256: str = digest.hexdigest()
+        blob: Path = self.store.add(temp, sha256)
+        self.store.link(sha256, path)
+        fsync_dir(blob.parent)
+        fsync_dir(path.parent)
+        self._checksums.append((file_unique_id, size, sha256))
+
+    def _flush_packs(self) -> None:
+        if not self._packs:
+            return
+        batch: list[dict[str, Any]] = self._packs
+        self._packs = []
+        current: dict[str, dict[str, Any]] = {
+            pack['name']: pack for pack in self.db.iter_pack_exports([doc['name'] for doc in batch])
+        }
+        self.report['packs'].extend(_diff('pack', doc, current.get(doc['name']), PACK_FIELDS) for doc in batch)
+        if not self.dry_run:
+            self.db.import_pack_exports(batch)
+            logger.info(f"Imported {len(batch)} packs")
+
+    def _flush_custom_packs(self) -> None:
+        if not self._custom_packs:
+            return
+        batch: list[dict[str, Any]] = self._custom_packs
+        self._custom_packs = []
+        current: dict[str, dict[str, Any]] = {
+            pack['name']: pack for pack in self.db.iter_custom_pack_exports([doc['name'] for doc in batch])
+        }
+        self.report['packs'].extend(
+            _diff('custom_pack', doc, current.get(doc['name']), CUSTOM_PACK_FIELDS) for doc in batch
+        )
+        if not self.dry_run:
+            skipped: dict[str, int] = self.db.import_custom_pack_exports(batch)
+            self.report['skipped_stickers'].update({name: count for name, count in skipped.items() if count})
+            logger.info(f"Imported {len(batch)} custom packs")
+
+    def finish(self) -> ImportReport:
+        self._flush_packs()
+        while self._custom_packs:
+            pending: list[dict[str, Any]] = self._custom_packs[self.batch_size:]
+            self._custom_packs = self._custom_packs[:self.batch_size]
+            self._flush_custom_packs()
+            self._custom_packs = pending
+        # Stickers only exist once their pack batch is written
+        if self._checksums:
+            self.db.record_sticker_checksums(self._checksums)
+            self._checksums = []
+        return self.report
+
+def main() -> None:
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(prog="python -m src.importer", description="Import exported sticker packs")
+    _ = parser.add_argument('files', nargs='+', help="pack JSON files or ZIP bundles from the export endpoints")
+    _ = parser.add_argument('--dry-run', action='store_true', help="only report what the import would change")
+    args = parser.parse_args()
+    importer: PackImporter = PackImporter(
+        Database(DATABASE_FILE), BlobStore(BLOB_DIR), DOWNLOAD_DIR, dry_run=args.dry_run
+    )
+    for filename in args.files:
+        with open(filename, 'rb') as stream:
+            importer.import_file(stream, Path(filename).name)
+    report: ImportReport = importer.finish()
+    for diff in report['packs']:
+        if diff['status'] != 'unchanged':
+            details: str = ', '.join(diff['changed_fields'])
+            print(
+                f"{diff['status']:>9} {diff['kind']} {diff['name']}"
+                f" (+{diff['stickers_added']} -{diff['stickers_removed']}{'; ' + details if details else ''})"
+            )
+    for error in report['errors']:
+        print(f"    error {error}")
+    statuses: list[str] = [diff['status'] for diff in report['packs']]
+    print(
+        f"{'Would import' if args.dry_run else 'Imported'} {len(statuses)} packs:"
+        f" {statuses.count('new')} new, {statuses.count('changed')} changed,"
+        f" {statuses.count('unchanged')} unchanged, {report['media_files']} media files"
+    )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import base64
+import hashlib
+import json
+from collections.abc import Callable, Sequence
+from typing import Any, Generic, TypedDict, TypeVar
+
+T = TypeVar('T')
+
+class Page(TypedDict, Generic[T]):
+    items: list[T]
+    # Continuation token of the following page, None on the last page
+    next: str | None
+    # Only counted when asked for
+    total: int | None
+
+def _scope_digest(scope: str) -> str:
+    return hashlib.blake2s(scope.encode(), digest_size=4).hexdigest()
+
+def encode_token(scope: str, key: Sequence[Any]) -> str:
+    # Opaque token holding the sort key of the last row of a page. The scope names the listing and
+    # its arguments, so a token cannot be replayed against another query.
+    payload: bytes = json.dumps([_scope_digest(scope), *key], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+def decode_token(token: str, scope: str, size: int) -> list[Any]:
+    # Sort key of a token made by encode_token for the same scope; raises ValueError otherwise
+    try:
+        payload: Any = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except ValueError:
+        raise ValueError("Malformed page token") from None
+    if not isinstance(payload, list) or len(payload) != size + 1 or payload[0] != _scope_digest(scope):
+        raise ValueError("Page token does not belong to this listing")
+    # The digest is no signature, the key is bound as query parameters and must hold plain values
+    if any(isinstance(value, (list, dict)) for value in payload[1:]):
+        raise ValueError("Malformed page token")
+    return payload[1:]
+
+def seek_condition(columns: Sequence[tuple[str, bool]], key: Sequence[Any]) -> tuple[str, list[Any]]:
+    # WHERE condition and parameters selecting the rows sorted after key, for (column, descending)
+    # sort columns. A single direction is one row value comparison; mixed directions expand to
+    # a disjunction behind a bound on the first column, so SQLite still seeks the index to the key.
+    directions: set[bool] = {descending for _, descending in columns}
+    if len(directions) == 1:
+        names: str = ', '.join(column for column, _ in columns)
+        placeholders: str = ', '.join('?' * len(columns))
+        return f"({names}) {'<' if directions.pop() else '>'} ({placeholders})", list(key)
+    terms: list[str] = []
+    params: list[Any] = [key[0]]
+    for idx, (column, descending) in enumerate(columns):
+        equal: list[str] = [f"{previous} = ?" for previous, _ in columns[:idx]]
+        terms.append(' AND '.join([*equal, f"{column} {'<' if descending else '>'} ?"]))
+        params.extend(key[:idx + 1])
+    first, descending = columns[0]
+    return f"{first} {'<=' if descending else '>='} ? AND ({' OR '.join(f'({term})' for term in terms)})", params
+
+def collect(fetch: Callable[[str | None], Page[T]]) -> list[T]:
+    # Every item of a listing, following the tokens from the first page to the last
+    items: list[T] = []
+    after: str | None = None
+    while True:
+        page: Page[T] = fetch(after)
+        items.extend(page['items'])
+        after = page['next']
+        if after is None:
+            return items
@@ -0,0 +1,67 @@
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+from typing import Any
+
+def freeze(value: Any) -> Hashable:
+    # Hashable form of method arguments, lists and dicts included
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return frozenset(value)
+    return value
+
+def detach(value: Any) -> Any:
+    # Copy of a cached result that the caller may change, only the containers are copied
+    if isinstance(value, list):
+        return [detach(item) for item in value]
+    if isinstance(value, dict):
+        return {key: detach(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return tuple(detach(item) for item in value)
+    if isinstance(value, set):
+        return set(value)
+    return value
+
+class QueryCache:
+    # Bounded LRU of query results, valid for one data generation. A lookup at another generation
+    # drops every entry, and results read at a generation other than the current one are not stored.
+    # The TTL bounds how long a result survives writes that did not bump the generation, e.g. ones
+    # made with the sqlite3 shell.
+    def __init__(self, max_entries: int, ttl_seconds: float) -> None:
+        self.max_entries: int = max_entries
+        self.ttl_seconds: float = ttl_seconds
+        self._lock: threading.Lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._generation: int = -1
+
+    def get(self, key: Hashable, generation: int) -> tuple[bool, Any]:
+        with self._lock:
+            if generation != self._generation:
+                # Not only newer: a restored backup can go back to an older generation
+                self._entries.clear()
+                self._generation = generation
+            entry: tuple[float, Any] | None = self._entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, entry[1]
+
+    def put(self, key: Hashable, generation: int, value: Any) -> None:
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                _ = self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,219 @@
+import asyncio
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+from src.config import SIGNAL_MEDIA_WORKERS
+
+# Pillow is optional, without it only files Signal already accepts are uploaded
+try:
+    from PIL import Image, ImageSequence
+except ImportError:
+    Image = None
+    ImageSequence = None
+# Renders the frames of animated (.tgs) stickers when installed
+try:
+    from rlottie_python import LottieAnimation  # pyright: ignore[reportMissingImports]
+except ImportError:
+    LottieAnimation = None
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Signal's limits for a single sticker and a pack
+SIGNAL_MAX_STICKER_BYTES: int = 300 * 1024
+SIGNAL_STICKER_SIZE: int = 512
+SIGNAL_MAX_STICKERS: int = 200
+SIGNAL_MAX_TEXT_LENGTH: int = 30
+SIGNAL_DEFAULT_EMOJI: str = '📷'
+# Signal author of the custom packs, which have no artist of their own
+CUSTOM_PACK_SIGNAL_AUTHOR: str = "Custom Pack"
+# Static stickers are sent as WebP, animated ones as APNG
+SIGNAL_STATIC_SUFFIXES: tuple[str, ...] = ('.webp', '.png')
+# Encoder settings tried in order until a sticker fits SIGNAL_MAX_STICKER_BYTES
+STATIC_QUALITIES: tuple[int, ...] = (90, 75, 60, 45, 30)
+# (frames per second, edge in pixels) of animated stickers
+ANIMATED_ATTEMPTS: tuple[tuple[int, int], ...] = ((20, 512), (15, 384), (10, 320), (8, 256), (5, 192))
+FFMPEG: str | None = shutil.which("ffmpeg")
+FFMPEG_TIMEOUT_SECONDS: int = 60
+
+def signal_text(text: str) -> str:
+    return text[:SIGNAL_MAX_TEXT_LENGTH]
+
+def signal_emoji(emoji: str | None) -> str:
+    # Signal takes a single emoji per sticker
+    return emoji[0] if emoji else SIGNAL_DEFAULT_EMOJI
+
+def signal_fingerprint(title: str, author: str, stickers: Iterable[tuple[str, str | None]]) -> str:
+    # Digest of what a pack looks like on Signal, from its title, author and the (content id, emoji)
+    # of its stickers in order, so a pack is only uploaded again when one of them changed
+    content: list[Any] = [
+        signal_text(title), signal_text(author),
+        [[content, signal_emoji(emoji)] for content, emoji in itertools.islice(stickers, SIGNAL_MAX_STICKERS)]
+    ]
+    return hashlib.sha256(json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode()).hexdigest()
+
+def _static_dimensions(data: bytes) -> tuple[int, int, bool] | None:
+    # Width, height and whether the image is animated, None when Pillow cannot tell
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return image.width, image.height, getattr(image, 'is_animated', False)
+    except Exception:
+        return None
+
+def signal_accepts(source: Path, data: bytes) -> bool:
+    # Whether the sticker file can be sent to Signal as it is
+    if source.suffix.lower() not in SIGNAL_STATIC_SUFFIXES or len(data) > SIGNAL_MAX_STICKER_BYTES:
+        return False
+    info: tuple[int, int, bool] | None = _static_dimensions(data)
+    if info is None:
+        # Telegram static stickers are 512 pixels at most, trust them when Pillow is missing
+        return Image is None
+    width, height, animated = info
+    # Signal plays APNG but not animated WebP
+    return width <= SIGNAL_STICKER_SIZE and height <= SIGNAL_STICKER_SIZE and not (animated and source.suffix.lower() == '.webp')
+
+def _fit(frame: Any, edge: int) -> Any:
+    frame = frame.convert('RGBA')
+    frame.thumbnail((edge, edge))
+    return frame
+
+def _encode_static(image: Any) -> bytes | None:
+    frame = _fit(image, SIGNAL_STICKER_SIZE)
+    for quality in STATIC_QUALITIES:
+        buffer: io.BytesIO = io.BytesIO()
+        frame.save(buffer, 'WEBP', quality=quality, method=6)
+        if buffer.tell() <= SIGNAL_MAX_STICKER_BYTES:
+            return buffer.getvalue()
+    return None
+
+def _encode_apng(frames: list[Any], fps: int, edge: int) -> bytes:
+    fitted: list[Any] = [_fit(frame, edge) for frame in frames]
+    buffer: io.BytesIO = io.BytesIO()
+    fitted[0].save(buffer, 'PNG', save_all=True, append_images=fitted[1:], duration=1000 // fps, loop=0, optimize=True)
+    return buffer.getvalue()
+
+def _pillow_frames(image: Any, fps: int) -> list[Any]:
+    # Frames of an animated image resampled to fps
+    frames: list[Any] = []
+    elapsed: float = 0.0
+    next_frame: float = 0.0
+    for frame in ImageSequence.Iterator(image):
+        if elapsed >= next_frame:
+            frames.append(frame.copy())
+            next_frame += 1000 / fps
+        elapsed += frame.info.get('duration', 100)
+    return frames
+
+def _lottie_frames(source: Path, fps: int) -> list[Any]:
+    with gzip.open(source, 'rt', encoding='utf-8') as f:
+        animation = LottieAnimation.from_data(f.read())
+    total: int = animation.lottie_animation_get_totalframe()
+    step: float = max(1.0, animation.lottie_animation_get_framerate() / fps)
+    return [animation.render_pillow_frame(frame_num=int(idx * step)) for idx in range(int(total / step))]
+
+def _ffmpeg_apng(source: Path, fps: int, edge: int) -> bytes:
+    # libvpx-vp9 keeps the alpha channel the native decoder drops
+    with tempfile.TemporaryDirectory() as temp_dir:
+        target: Path = Path(temp_dir) / "sticker.png"
+        _ = subprocess.run(
+            [FFMPEG, '-v', 'error', '-c:v', 'libvpx-vp9', '-i', str(source),
+             '-vf', f"fps={fps},scale={edge}:{edge}:force_original_aspect_ratio=decrease",
+             '-plays', '0', '-f', 'apng', str(target)],
+            capture_output=True, timeout=FFMPEG_TIMEOUT_SECONDS, check=True
+        )
+        return target.read_bytes()
+
+def _convert_animated(render: Callable[[int, int], bytes]) -> bytes | None:
+    for fps, edge in ANIMATED_ATTEMPTS:
+        data: bytes = render(fps, edge)
+        if len(data) <= SIGNAL_MAX_STICKER_BYTES:
+            return data
+    return None
+
+def convert_sticker(source: Path) -> bytes | None:
+    # A version of source within Signal's limits, None when no converter for its format is available
+    suffix: str = source.suffix.lower()
+    if suffix == '.webm':
+        if FFMPEG is None:
+            return None
+        return _convert_animated(lambda fps, edge: _ffmpeg_apng(source, fps, edge))
+    if Image is None:
+        return None
+    if suffix == '.tgs':
+        if LottieAnimation is None:
+            return None
+        return _convert_animated(lambda fps, edge: _encode_apng(_lottie_frames(source, fps), fps, edge))
+    with Image.open(source) as image:
+        if getattr(image, 'is_animated', False):
+            return _convert_animated(lambda fps, edge: _encode_apng(_pillow_frames(image, fps), fps, edge))
+        return _encode_static(image)
+
+class SignalMediaCache:
+    # Stickers prepared for Signal. Files Signal accepts are read as they are, the others are
+    # converted once and stored under <root>/<aa>/<file_unique_id>.<webp|png>, as sticker content
+    # never changes for a file_unique_id. Reads and conversions run on a thread pool shared by
+    # every upload, sized apart from the thumbnail pool so an upload does not stall the grid views.
+    def __init__(self, root: Path, workers: int = SIGNAL_MEDIA_WORKERS) -> None:
+        self.root: Path = root
+        self.workers: int = workers
+        self._executor: ThreadPoolExecutor | None = None
+
+    def path(self, source: Path) -> Path:
+        # Animated stickers become APNG, static ones WebP
+        suffix: str = '.webp' if source.suffix.lower() in SIGNAL_STATIC_SUFFIXES else '.png'
+        return self.root / source.stem[:2] / f"{source.stem}{suffix}"
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="signal-media")
+        return self._executor
+
+    def _prepare(self, source: Path) -> bytes | None:
+        cached: Path = self.path(source)
+        if cached.is_file():
+            return cached.read_bytes()
+        try:
+            data: bytes = source.read_bytes()
+        except OSError as e:
+            logger.warning(f"Could not read {source}: {e}")
+            return None
+        if signal_accepts(source, data):
+            return data
+        try:
+            converted: bytes | None = convert_sticker(source)
+        except Exception as e:
+            logger.warning(f"Could not convert {source} for Signal: {e}")
+            return None
+        if converted is None:
+            logger.warning(f"{source} does not fit Signal's sticker limits and cannot be converted")
+            return None
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        temp: Path = cached.with_name(f".{cached.name}.{os.getpid()}.part")
+        _ = temp.write_bytes(converted)
+        os.replace(temp, cached)
+        return converted
+
+    async def prepare_many(self, sources: Iterable[Path]) -> list[bytes | None]:
+        # Sticker data ready for Signal in the order of sources, None for the ones that cannot be sent
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        return list(await asyncio.gather(
+            *(loop.run_in_executor(self._pool(), self._prepare, source) for source in sources)
+        ))
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,133 @@
+import hashlib
+import logging
+import os
+import shutil
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+from src.config import BLOB_DIR, DATABASE_FILE, DOWNLOAD_DIR
+from src.database import Database
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE: int = 64 * 1024
+
+def hash_file(path: Path) -> tuple[int, str]:
+    # Size and SHA-256 of a file, read in chunks
+    digest = hashlib.sha256()
+    size: int = 0
+    with path.open('rb') as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+    return size, digest.hexdigest()
+
+def fsync_dir(directory: Path) -> None:
+    fd: int = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class BlobStore:
+    # Sticker files stored once by SHA-256 under <root>/<aa>/<bb>/<sha256>. Pack directories hold
+    # hard links to the blobs, so paths built from pack_name keep working and identical files
+    # shared by several packs use the disk only once. A blob whose link count drops to one is
+    # referenced by no pack and can be collected.
+    def __init__(self, root: Path) -> None:
+        self.root: Path = root
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, sha256: str) -> Path:
+        return self.root / sha256[:2] / sha256[2:4] / sha256
+
+    def has(self, sha256: str) -> bool:
+        return self.path(sha256).is_file()
+
+    def add(self, source: Path, sha256: str) -> Path:
+        # Moves source into the store; when the content is already stored, source is discarded
+        blob: Path = self.path(sha256)
+        if blob.is_file():
+            source.unlink()
+            return blob
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(source, blob)
+        return blob
+
+    def adopt(self, source: Path, sha256: str) -> Path:
+        # Like add, but source stays in place as a link to the blob
+        blob: Path = self.path(sha256)
+        if blob.is_file():
+            if not blob.samefile(source):
+                self.link(sha256, source)
+            return blob
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(source, blob)
+        except OSError:
+            _ = shutil.copyfile(source, blob)
+        return blob
+
+    def link(self, sha256: str, target: Path) -> None:
+        # Atomically points target at the blob; falls back to a copy where hard links are not supported
+        temp: Path = target.with_name(f".{target.name}.link")
+        temp.unlink(missing_ok=True)
+        try:
+            os.link(self.path(sha256), temp)
+        except OSError:
+            _ = shutil.copyfile(self.path(sha256), temp)
+        os.replace(temp, target)
+
+    def collect_garbage(self, sha256s: Iterable[str] | None = None) -> int:
+        # Removes blobs no pack links to anymore, either the given ones or the whole store
+        candidates: Iterable[Path] = (
+            (self.path(sha256) for sha256 in sha256s) if sha256s is not None else self._all_blobs()
+        )
+        removed: int = 0
+        for blob in candidates:
+            try:
+                if blob.stat().st_nlink == 1:
+                    blob.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        if removed:
+            logger.info(f"Removed {removed} unreferenced blobs")
+        return removed
+
+    def _all_blobs(self) -> Iterator[Path]:
+        return (path for path in self.root.glob("*/*/*") if path.is_file())
+
+def migrate_pack_dirs(db: Database, store: BlobStore, download_dir: Path) -> int:
+    # Moves files downloaded before the blob store existed into it, leaving links in the pack
+    # directories, and records their size and checksum. Safe to run again, adopted files are skipped.
+    migrated: int = 0
+    checksums: list[tuple[str, int, str]] = []
+    for pack_name, file_unique_id, file_path in db.get_sticker_files():
+        path: Path = download_dir / pack_name / file_path
+        if not path.is_file() or path.stat().st_nlink > 1:
+            continue
+        size, sha256 = hash_file(path)
+        _ = store.adopt(path, sha256)
+        checksums.append((file_unique_id, size, sha256))
+        migrated += 1
+        if len(checksums) >= 500:
+            db.record_sticker_checksums(checksums)
+            checksums = []
+    if checksums:
+        db.record_sticker_checksums(checksums)
+    return migrated
+
+def main() -> None:
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO
+    )
+    db: Database = Database(DATABASE_FILE)
+    store: BlobStore = BlobStore(BLOB_DIR)
+    migrated: int = migrate_pack_dirs(db, store, DOWNLOAD_DIR)
+    logger.info(f"Moved {migrated} sticker files into the blob store")
+    _ = store.collect_garbage()
+
+if __name__ == '__main__':
+    main()
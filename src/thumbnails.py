@@ -0,0 +1,207 @@
+import asyncio
+import gzip
+import io
+import logging
+import os
+import shutil
+import subprocess
+from collections.abc import Iterable
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+from src.config import DATABASE_FILE, DOWNLOAD_DIR, THUMBNAIL_DIR, THUMBNAIL_SIZE, THUMBNAIL_WORKERS
+from src.database import Database
+
+# Pillow is optional, without it the grids fall back to the original files
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+# Renders the first frame of animated (.tgs) stickers when installed
+try:
+    from rlottie_python import LottieAnimation  # pyright: ignore[reportMissingImports]
+except ImportError:
+    LottieAnimation = None
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+THUMBNAIL_QUALITY: int = 75
+# Pack sprite sheets hold the first thumbnails of a pack in a grid this many tiles wide
+SPRITE_COLUMNS: int = 2
+SPRITE_TILES: int = 4
+FFMPEG: str | None = shutil.which("ffmpeg")
+FFMPEG_TIMEOUT_SECONDS: int = 20
+
+def _first_frame(source: Path) -> Any:
+    # First frame of a sticker as a Pillow image, or None when no decoder for its format is available
+    suffix: str = source.suffix.lower()
+    if suffix == '.webm':
+        if FFMPEG is None:
+            return None
+        # libvpx-vp9 keeps the alpha channel the native decoder drops
+        result = subprocess.run(
+            [FFMPEG, '-v', 'error', '-c:v', 'libvpx-vp9', '-i', str(source), '-frames:v', '1',
+             '-f', 'image2pipe', '-c:v', 'png', '-'],
+            capture_output=True, timeout=FFMPEG_TIMEOUT_SECONDS, check=True
+        )
+        return Image.open(io.BytesIO(result.stdout))
+    if suffix == '.tgs':
+        if LottieAnimation is None:
+            return None
+        with gzip.open(source, 'rt', encoding='utf-8') as f:
+            animation = LottieAnimation.from_data(f.read())
+        return animation.render_pillow_frame(frame_num=0)
+    image = Image.open(source)
+    # Animated WebP opens on its first frame
+    image.seek(0)
+    return image
+
+def generate_thumbnail(source: Path, target: Path) -> bool:
+    # Writes a small static WebP preview of source to target
+    if Image is None:
+        return False
+    try:
+        image = _first_frame(source)
+    except Exception as e:
+        logger.warning(f"Could not decode {source}: {e}")
+        return False
+    if image is None:
+        return False
+    with image:
+        frame = image.convert('RGBA')
+    frame.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    target.parent.mkdir(parents=True, exist_ok=True)
+    temp: Path = target.with_name(f".{target.name}.{os.getpid()}.part")
+    frame.save(temp, 'WEBP', quality=THUMBNAIL_QUALITY, method=4)
+    os.replace(temp, target)
+    return True
+
+def sprite_layout(count: int) -> tuple[int, int, list[tuple[int, int]]]:
+    # Width, height and top-left offset of every tile of a sprite sheet holding count thumbnails
+    columns: int = min(count, SPRITE_COLUMNS)
+    rows: int = -(-count // SPRITE_COLUMNS)
+    offsets: list[tuple[int, int]] = [
+        (idx % SPRITE_COLUMNS * THUMBNAIL_SIZE, idx // SPRITE_COLUMNS * THUMBNAIL_SIZE) for idx in range(count)
+    ]
+    return columns * THUMBNAIL_SIZE, rows * THUMBNAIL_SIZE, offsets
+
+class ThumbnailCache:
+    # Thumbnails stored under <root>/<aa>/<file_unique_id>.webp. Sticker content never changes for a
+    # file_unique_id, so a thumbnail is generated once, either right after a download or on its first
+    # request. Pillow and ffmpeg decode and encode without holding the GIL, so a thread pool keeps
+    # several cores busy without the worker processes re-importing the web app.
+    def __init__(self, root: Path, workers: int = THUMBNAIL_WORKERS) -> None:
+        self.root: Path = root
+        self.workers: int = workers
+        self._executor: ThreadPoolExecutor | None = None
+        # Sources that could not be decoded, not retried by this process
+        self._unsupported: set[Path] = set()
+
+    @property
+    def available(self) -> bool:
+        return Image is not None
+
+    def path(self, file_unique_id: str) -> Path:
+        return self.root / file_unique_id[:2] / f"{file_unique_id}.webp"
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="thumbnail")
+        return self._executor
+
+    def _submit(self, source: Path) -> Future[bool]:
+        return self._pool().submit(generate_thumbnail, source, self.path(source.stem))
+
+    def get(self, source: Path) -> Path | None:
+        # Cached thumbnail of source, generated when missing; None when it cannot be made
+        thumbnail: Path = self.path(source.stem)
+        if thumbnail.is_file():
+            return thumbnail
+        if not self.available or source in self._unsupported:
+            return None
+        if self._submit(source).result():
+            return thumbnail
+        self._unsupported.add(source)
+        return None
+
+    async def generate_many(self, sources: Iterable[Path]) -> int:
+        # Generates the missing thumbnails of sources concurrently on the pool, returns how many were made
+        if not self.available:
+            return 0
+        missing: list[Path] = [source for source in sources if not self.path(source.stem).is_file()]
+        if not missing:
+            return 0
+        results: list[bool | BaseException] = await asyncio.gather(
+            *(asyncio.wrap_future(self._submit(source)) for source in missing), return_exceptions=True
+        )
+        return sum(result is True for result in results)
+
+    def remove(self, file_unique_ids: Iterable[str]) -> None:
+        for file_unique_id in file_unique_ids:
+            self.path(file_unique_id).unlink(missing_ok=True)
+
+    def sprite_path(self, pack_name: str, version: int) -> Path:
+        # version is the pack's last_update, so a changed pack gets a new URL
+        return self.root / "sprites" / f"{pack_name}.{version}.webp"
+
+    def get_sprite(self, pack_name: str, version: int, sources: list[Path]) -> Path | None:
+        sprite: Path = self.sprite_path(pack_name, version)
+        if sprite.is_file():
+            return sprite
+        return self.build_sprite(pack_name, version, sources)
+
+    def build_sprite(self, pack_name: str, version: int, sources: list[Path]) -> Path | None:
+        # Combines the thumbnails of sources (the first stickers of the pack) into one sheet laid out
+        # by sprite_layout and removes the sheets of older versions. None when a thumbnail is missing.
+        if not self.available or not sources:
+            return None
+        tiles: list[Path | None] = [self.get(source) for source in sources[:SPRITE_TILES]]
+        if None in tiles:
+            return None
+        width, height, offsets = sprite_layout(len(tiles))
+        sheet = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+        for tile, (x, y) in zip(tiles, offsets):
+            with Image.open(tile) as image:
+                # Thumbnails keep their aspect ratio, center them in their tile
+                sheet.paste(image, (x + (THUMBNAIL_SIZE - image.width) // 2, y + (THUMBNAIL_SIZE - image.height) // 2))
+        sprite: Path = self.sprite_path(pack_name, version)
+        sprite.parent.mkdir(parents=True, exist_ok=True)
+        temp: Path = sprite.with_name(f".{sprite.name}.{os.getpid()}.part")
+        sheet.save(temp, 'WEBP', quality=THUMBNAIL_QUALITY, method=4)
+        os.replace(temp, sprite)
+        self.remove_sprites(pack_name, keep=sprite)
+        return sprite
+
+    def remove_sprites(self, pack_name: str, keep: Path | None = None) -> None:
+        for sprite in (self.root / "sprites").glob(f"{pack_name}.*.webp"):
+            if sprite != keep:
+                sprite.unlink(missing_ok=True)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+def main() -> None:
+    # Generates the thumbnails missing for stickers downloaded before thumbnails existed
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO
+    )
+    if Image is None:
+        logger.error("Pillow is not installed, thumbnails cannot be generated")
+        return
+    db: Database = Database(DATABASE_FILE)
+    cache: ThumbnailCache = ThumbnailCache(THUMBNAIL_DIR)
+    sources: list[Path] = [
+        DOWNLOAD_DIR / pack_name / file_path for pack_name, _, file_path in db.get_sticker_files()
+    ]
+    try:
+        generated: int = asyncio.run(cache.generate_many(source for source in sources if source.is_file()))
+    finally:
+        cache.close()
+    logger.info(f"Generated {generated} thumbnails")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import gzip
+
+from flask import Flask, Response, request
+
+# Brotli is optional, gzip is always available
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smaller bodies fit in a packet or two, compressing them costs more than it saves
+COMPRESS_MIN_SIZE: int = 1024
+COMPRESSIBLE_MIMETYPES: frozenset[str] = frozenset({
+    'application/json', 'text/html', 'text/css', 'text/javascript', 'application/javascript'
+})
+# Fast settings, responses are compressed on every request
+GZIP_LEVEL: int = 5
+BROTLI_QUALITY: int = 4
+
+def _supported_encodings() -> list[str]:
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+def compress_response(response: Response) -> Response:
+    # Compresses buffered text responses with the best encoding the client accepts. Files and
+    # streamed responses (sticker files, ZIP exports, backups) are passed through untouched.
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 206, 304)
+        or 'Content-Encoding' in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+    response.vary.add('Accept-Encoding')
+    data: bytes = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    encoding: str | None = request.accept_encodings.best_match(_supported_encodings())
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=BROTLI_QUALITY))
+    elif encoding == 'gzip':
+        response.set_data(gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0))
+    else:
+        return response
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        # The compressed body is a different representation of the same resource
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
+
+def init_compression(app: Flask) -> None:
+    _ = app.after_request(compress_response)
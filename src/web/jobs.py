@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import threading
+import uuid
+from collections.abc import Callable, Coroutine
+from typing import Any
+
+from src.database import Database
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Reports the per-item results so far and the total number of items of a job
+JobProgress = Callable[[dict[str, bool], int], None]
+# Coroutine factory executed on the worker loop; its return value is stored as the job result
+JobRunner = Callable[[JobProgress], Coroutine[Any, Any, dict[str, object] | None]]
+
+class JobQueue:
+    def __init__(self, db: Database) -> None:
+        self.db: Database = db
+        self._lock: threading.Lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        # (kind, target) of queued or running jobs, so a double click does not start the same work twice
+        self._active: dict[tuple[str, str | None], str] = {}
+        # Coroutines run on the worker loop before it stops, to close clients bound to it
+        self._shutdown_hooks: list[Callable[[], Coroutine[Any, Any, None]]] = []
+        # Jobs are only read by start() and the worker thread only started by the first job, so
+        # constructing the queue has no side effects
+        self._started: bool = False
+
+    def start(self) -> None:
+        # Marks the jobs a previous run left unfinished as interrupted; runs once, before the first
+        # request of the app or the first submitted job
+        with self._lock:
+            self._start()
+
+    def _start(self) -> None:
+        # Called with the lock held
+        if self._started:
+            return
+        self._started = True
+        interrupted: int = self.db.interrupt_unfinished_jobs()
+        if interrupted:
+            logger.warning(f"Marked {interrupted} unfinished jobs from a previous run as interrupted")
+
+    def _ensure_worker(self) -> asyncio.AbstractEventLoop:
+        # Called with the lock held; the loop thread is started on the first submitted job
+        if self._loop is None:
+            loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+            self._thread = threading.Thread(
+                target=self._run_loop, args=(loop,), name="job-worker", daemon=True
+            )
+            self._thread.start()
+            self._loop = loop
+        return self._loop
+
+    @staticmethod
+    def _run_loop(loop: asyncio.AbstractEventLoop) -> None:
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    def submit(self, kind: str, target: str | None, runner: JobRunner) -> tuple[str, bool]:
+        # Returns the job id and whether a new job was created rather than an active one reused
+        key: tuple[str, str | None] = (kind, target)
+        with self._lock:
+            self._start()
+            if key in self._active:
+                return self._active[key], False
+            job_id: str = uuid.uuid4().hex
+            self.db.create_job(job_id, kind, target)
+            self._active[key] = job_id
+            loop: asyncio.AbstractEventLoop = self._ensure_worker()
+        _ = asyncio.run_coroutine_threadsafe(self._run(job_id, key, runner), loop)
+        logger.info(f"Queued job {job_id} ({kind} {target or ''})")
+        return job_id, True
+
+    async def _run(self, job_id: str, key: tuple[str, str | None], runner: JobRunner) -> None:
+        def report(results: dict[str, bool], total: int) -> None:
+            self.db.update_job_progress(job_id, results, total)
+
+        self.db.start_job(job_id)
+        try:
+            result: dict[str, object] | None = await runner(report)
+            self.db.finish_job(job_id, 'succeeded', result)
+            logger.info(f"Job {job_id} succeeded")
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}", exc_info=True)
+            self.db.finish_job(job_id, 'failed', error=str(e))
+        finally:
+            with self._lock:
+                _ = self._active.pop(key, None)
+
+    def add_shutdown_hook(self, hook: Callable[[], Coroutine[Any, Any, None]]) -> None:
+        self._shutdown_hooks.append(hook)
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None or thread is None:
+            return
+        for hook in self._shutdown_hooks:
+            try:
+                _ = asyncio.run_coroutine_threadsafe(hook(), loop).result(timeout)
+            except Exception as e:
+                logger.error(f"Job worker shutdown hook failed: {e}")
+        _ = loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
@@ -0,0 +1,36 @@
+from typing import Any
+
+from flask import Flask, Response
+from flask.json.provider import DefaultJSONProvider
+
+# orjson is optional, it serializes several times faster than the standard library
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class OrjsonProvider(DefaultJSONProvider):
+    # Encodes responses straight to bytes with orjson; calls asking for standard library options
+    # such as indent fall back to the default provider
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs or orjson is None:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        if kwargs or orjson is None:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        if orjson is None or self._app.debug:
+            return super().response(*args, **kwargs)
+        obj: Any = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE),
+            mimetype=self.mimetype
+        )
+
+def init_json_provider(app: Flask) -> None:
+    if orjson is not None:
+        app.json = OrjsonProvider(app)
@@ -1,67 +1,153 @@
-import io
-import zipfile
-import asyncio
+import atexit
+import json
+import mimetypes
+import os
 import shutil
 import time
+from collections.abc import Iterator
 from pathlib import Path
+from typing import Any
+from urllib.parse import quote
 
-from flask import Flask, Response, jsonify, make_response, render_template, request, send_from_directory, send_file
-from rapidfuzz import fuzz
+from flask import Flask, Response, abort, jsonify, make_response, redirect, render_template, request, send_file, stream_with_context, url_for
+from werkzeug.security import safe_join
 
-from src.config import DATABASE_FILE, DOWNLOAD_DIR
-from src.database import CustomPackSticker, Database, StickerPackRecord, StickerRecord, StickerSearchResult
+from src.config import (
+    BLOB_DIR,
+    BOT_TOKEN,
+    DATABASE_FILE,
+    DOWNLOAD_DIR,
+    SIGNAL_MEDIA_DIR,
+    STICKER_ACCEL_REDIRECT_PREFIX,
+    STICKER_SENDFILE_MODE,
+    THUMBNAIL_DIR,
+    THUMBNAIL_SIZE,
+)
+from src.database import (
+    CustomPackConflict,
+    CustomPackListing,
+    CustomPackRecord,
+    CustomPackSticker,
+    Database,
+    JobRecord,
+    PackFilters,
+    StickerPackListing,
+    StickerPackRecord,
+    StickerRecord,
+    StickerSearchResult,
+)
+from src.backup import BackupManifest, iter_backup, load_manifest
+from src.bot.clients import TelegramClients
 from src.bot.update_service import UpdateService
-from src.web.signal_uploader import upload_custom_pack_to_signal, upload_telegram_pack_to_signal
+from src.importer import PackImporter
+from src.pagination import Page, collect
+from src.signal_media import SignalMediaCache
+from src.storage import BlobStore
+from src.thumbnails import SPRITE_TILES, ThumbnailCache, sprite_layout
+from src.web.compression import init_compression
+from src.web.jobs import JobProgress, JobQueue
+from src.web.json_provider import init_json_provider
+from src.web.search_index import SearchIndex
+from src.web.signal_uploader import SignalUpload, upload_custom_pack_to_signal, upload_telegram_pack_to_signal
+from src.web.zip_stream import stream_zip
+
+DEFAULT_PER_PAGE: int = 50
+MAX_PER_PAGE: int = 500
+DEFAULT_STICKER_PAGE_SIZE: int = 100
+# Rows read per query by the endpoints that need a whole listing
+LISTING_BATCH_SIZE: int = 1000
+# Sticker file names are derived from file_unique_id, so their content never changes
+STICKER_CACHE_MAX_AGE: int = 365 * 24 * 60 * 60
 
 app: Flask = Flask(__name__)
+app.config['USE_X_SENDFILE'] = STICKER_SENDFILE_MODE == 'x-sendfile'
+init_json_provider(app)
+init_compression(app)
 db: Database = Database(DATABASE_FILE)
+# Jobs run on a single worker loop, so one bot and one download session serve every job
+telegram_clients: TelegramClients = TelegramClients(BOT_TOKEN)
+blob_store: BlobStore = BlobStore(BLOB_DIR)
+thumbnails: ThumbnailCache = ThumbnailCache(THUMBNAIL_DIR)
 update_service: UpdateService = UpdateService(
     download_dir=Path(DOWNLOAD_DIR),
     db=db,
+    clients=telegram_clients,
+    store=blob_store,
+    thumbnails=thumbnails,
 )
+signal_media: SignalMediaCache = SignalMediaCache(SIGNAL_MEDIA_DIR)
+search_index: SearchIndex = SearchIndex(db)
+job_queue: JobQueue = JobQueue(db)
+job_queue.add_shutdown_hook(telegram_clients.close)
+_ = atexit.register(job_queue.shutdown)
+_ = atexit.register(thumbnails.close)
+_ = atexit.register(signal_media.close)
 
-def fuzzy_search_packs(query: str, packs: list[StickerPackRecord]) -> list[StickerPackRecord]:
-    if not query:
-        return packs
-    results: list[tuple[StickerPackRecord, float]] = []
-    for pack in packs:
-        # Search in pack name and title
-        name_score: float = max(
-            fuzz.partial_ratio(query.lower(), pack['name'].lower()),
-            fuzz.partial_ratio(query.lower(), pack['title'].lower())
-        )
-        # Search in artist
-        artist_score: float = fuzz.partial_ratio(query.lower(), pack['artist'].lower())
-        # Take the best score
-        score: float = max(name_score, artist_score)
-        if score > 40:
-            results.append((pack, score))
-    # Sort by score
-    results.sort(key=lambda x: x[1], reverse=True)
-    return [r[0] for r in results]
-
-def fuzzy_search_stickers(query: str, stickers: list[StickerSearchResult]) -> list[StickerSearchResult]:
-    if not query:
-        return stickers
-    results: list[tuple[StickerSearchResult, float]] = []
-    for sticker in stickers:
-        # Calculate scores for different fields
-        pack_score: float = max(
-            fuzz.partial_ratio(query.lower(), sticker['pack_name'].lower()),
-            fuzz.partial_ratio(query.lower(), sticker['pack_title'].lower())
-        )
-        artist_score: float = fuzz.partial_ratio(query.lower(), sticker['artist'].lower())
-        emoji_score: float = (
-            fuzz.partial_ratio(query.lower(), sticker['emoji'].lower())
-            if sticker['emoji'] else 0
-        )
-        # Take the best score
-        score: float = max(pack_score, artist_score, emoji_score)
-        if score > 40:
-            results.append((sticker, score))
-    # Sort by score
-    results.sort(key=lambda x: x[1], reverse=True)
-    return [r[0] for r in results]
+@app.before_request
+def start_job_queue() -> None:
+    # On the first request rather than on import, so importing the module never marks the jobs of a
+    # running server as interrupted
+    job_queue.start()
+
+def needs_signal_update(uploaded_at: int | None, stored: str | None, current: str | None, changed_at: int) -> bool:
+    # A pack on Signal is stale when the fingerprint of its content differs from the uploaded one.
+    # Uploads made before fingerprints were stored fall back to the modification time.
+    if uploaded_at is None:
+        return False
+    if stored is None:
+        return changed_at > uploaded_at
+    return current != stored
+
+def pack_needs_signal_update(pack: StickerPackRecord, fingerprints: dict[str, str]) -> bool:
+    return needs_signal_update(
+        pack['signal_uploaded_at'], pack['signal_fingerprint'], fingerprints.get(pack['name']), pack['last_update']
+    )
+
+def custom_pack_needs_signal_update(pack: CustomPackRecord, fingerprints: dict[str, str]) -> bool:
+    return needs_signal_update(
+        pack['signal_uploaded_at'], pack['signal_fingerprint'], fingerprints.get(pack['name']), pack['last_modified']
+    )
+
+def stale_signal_packs() -> list[str]:
+    # Names of the packs on Signal whose content changed since their upload
+    fingerprints: dict[str, str] = db.get_pack_signal_fingerprints()
+    signal_packs: list[StickerPackRecord] = collect(
+        lambda after: db.search_sticker_packs("", after, limit=LISTING_BATCH_SIZE, filters={'on_signal': True})
+    )
+    return [p['name'] for p in signal_packs if pack_needs_signal_update(p, fingerprints)]
+
+def get_pack_filters() -> PackFilters:
+    # Each filter is 'show' (keep only matching), 'hide' (drop matching) or anything else (disabled)
+    states: dict[str, bool] = {
+        name: request.args.get(name) == 'show'
+        for name in ('on_signal', 'needs_update', 'in_custom_packs')
+        if request.args.get(name) in ('show', 'hide')
+    }
+    filters: PackFilters = PackFilters()
+    if 'on_signal' in states:
+        filters['on_signal'] = states['on_signal']
+    if 'in_custom_packs' in states:
+        filters['in_custom_packs'] = states['in_custom_packs']
+    if 'needs_update' in states:
+        filters['needs_update'] = states['needs_update']
+        filters['stale'] = stale_signal_packs()
+    return filters
+
+def get_keyset_args(default_limit: int = DEFAULT_STICKER_PAGE_SIZE) -> tuple[str | None, int]:
+    # Continuation token of the keyset endpoints (the next of the previous page) and the page size
+    limit: int = request.args.get('limit', default_limit, type=int) or default_limit
+    return request.args.get('after') or None, min(max(1, limit), MAX_PER_PAGE)
+
+def sticker_page(page: Page[Any]) -> dict[str, Any]:
+    return {'stickers': [dict(s) for s in page['items']], 'next': page['next']}
+
+def job_accepted(job_id: str, created: bool) -> tuple[Response, int]:
+    # 202 for a new job, 200 when an identical job was already queued or running
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status_url': f'/api/jobs/{job_id}',
+    }), 202 if created else 200
 
 @app.route('/')
 def index() -> str:
@@ -75,32 +161,59 @@ def stickers_page() -> str:
 def custom_packs_page() -> str:
     return render_template('custom_packs.html')
 
+def sprite_payload(pack: StickerPackListing) -> dict[str, Any] | None:
+    # Where the thumbnails of a pack card sit in its sprite sheet, in the order of pack['thumbnails']
+    if not thumbnails.available or not pack['thumbnails']:
+        return None
+    width, height, offsets = sprite_layout(len(pack['thumbnails']))
+    return {
+        'url': url_for('serve_sprite', pack_name=pack['name'], version=pack['last_update']),
+        'width': width,
+        'height': height,
+        'tile': THUMBNAIL_SIZE,
+        'offsets': offsets,
+    }
+
 @app.route('/api/packs/search')
-def search_packs() -> Response:
+def search_packs() -> tuple[Response, int] | Response:
     query: str = request.args.get('q', '')
-    packs, _ = db.search_sticker_packs(query, page=1, per_page=100000)
-    filtered_packs: list[StickerPackRecord] = fuzzy_search_packs(query, packs)
-    # Get thumbnails for each pack
+    after, limit = get_keyset_args(DEFAULT_PER_PAGE)
+    # The search index ranks the best matches, which the database sorts, filters and pages
+    ranked: list[str] | None = search_index.search_packs(query) if query else None
+    try:
+        page: Page[StickerPackRecord] = db.search_sticker_packs(
+            query, after, limit, ranked=ranked, sort=request.args.get('sort', ''),
+            filters=get_pack_filters(), with_total=True
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # Get thumbnails only for the packs in the requested page, in one query
+    page_names: list[str] = [p['name'] for p in page['items']]
+    listings: dict[str, StickerPackListing] = {
+        p['name']: p for p in db.list_sticker_packs(page_names, thumbnail_limit=SPRITE_TILES)
+    }
+    fingerprints: dict[str, str] = db.get_pack_signal_fingerprints(page_names)
     packs_with_thumbnails = []
-    for pack in filtered_packs:
-        thumbnails: list[StickerRecord] = db.get_pack_thumbnail_stickers(pack['name'], limit=4)
+    for name in page_names:
+        if name not in listings:
+            continue
+        pack: StickerPackListing = listings[name]
         pack_dict = dict(pack)
         pack_dict['thumbnails'] = [
             {
                 'file_path': s['file_path'],
                 'emoji': s['emoji']
             }
-            for s in thumbnails
+            for s in pack['thumbnails']
         ]
+        pack_dict['sprite'] = sprite_payload(pack)
         # Check if pack needs update
-        pack_dict['needs_signal_update'] = (
-            pack.get('signal_uploaded_at') is not None and
-            pack.get('last_update', 0) > pack.get('signal_uploaded_at', 0)
-        )
+        pack_dict['needs_signal_update'] = pack_needs_signal_update(pack, fingerprints)
         packs_with_thumbnails.append(pack_dict)
     return jsonify({
         'packs': packs_with_thumbnails,
-        'total': len(filtered_packs),
+        'next': page['next'],
+        'total': page['total'],
     })
 
 @app.route('/api/packs/<pack_name>')
@@ -108,13 +221,12 @@ def get_pack(pack_name: str) -> tuple[Response, int] | Response:
     pack_info: StickerPackRecord | None = db.get_sticker_pack(pack_name)
     if not pack_info:
         return jsonify({'error': 'Pack not found'}), 404
-    page: int = int(request.args.get('page', 1))
-    per_page: int = int(request.args.get('per_page', 100))
-    stickers, total = db.get_pack_stickers(pack_name, page, per_page)
-    needs_signal_update: bool = (
-        pack_info.get('signal_uploaded_at') is not None and
-        pack_info.get('last_update', 0) > pack_info.get('signal_uploaded_at', 0)
-    )
+    after, limit = get_keyset_args()
+    try:
+        page: Page[StickerRecord] = db.get_pack_stickers(pack_name, after, limit, with_total=True)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    fingerprints: dict[str, str] = db.get_pack_signal_fingerprints([pack_name])
     response_pack = {
         'name': pack_info['name'],
         'title': pack_info['title'],
@@ -123,21 +235,30 @@ def get_pack(pack_name: str) -> tuple[Response, int] | Response:
         'sticker_count': pack_info['sticker_count'],
         'signal_url': pack_info.get('signal_url'),
         'signal_uploaded_at': pack_info.get('signal_uploaded_at'),
-        'needs_signal_update': needs_signal_update,
+        'needs_signal_update': pack_needs_signal_update(pack_info, fingerprints),
         'used_in_custom_packs': pack_info.get('used_in_custom_packs', False),
-        'stickers': [dict(s) for s in stickers],
-        'total': total,
-        'page': page,
-        'per_page': per_page,
-        'total_pages': (total + per_page - 1) // per_page
+        **sticker_page(page),
+        'total': page['total'],
     }
     return jsonify(response_pack)
 
+@app.route('/api/packs/<pack_name>/stickers')
+def get_pack_sticker_page(pack_name: str) -> tuple[Response, int] | Response:
+    if not db.get_sticker_pack(pack_name):
+        return jsonify({'error': 'Pack not found'}), 404
+    after, limit = get_keyset_args()
+    try:
+        return jsonify(sticker_page(db.get_pack_stickers(pack_name, after, limit)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
 @app.route('/api/packs/<pack_name>', methods=['DELETE'])
 def delete_pack(pack_name: str) -> tuple[Response, int] | Response:
     try:
         if not db.get_sticker_pack(pack_name):
             return jsonify({'error': 'Pack not found'}), 404
+        # Blobs only this pack linked to are collected once its directory is gone
+        sha256s: list[str] = db.get_pack_sha256s(pack_name)
         # Delete from database
         success: bool = db.delete_sticker_pack(pack_name)
         if not success:
@@ -145,11 +266,14 @@ def delete_pack(pack_name: str) -> tuple[Response, int] | Response:
         # Delete pack directory and files
         pack_dir: Path = DOWNLOAD_DIR / pack_name
         if pack_dir.exists():
+            thumbnails.remove(path.stem for path in pack_dir.iterdir())
+            thumbnails.remove_sprites(pack_name)
             try:
                 shutil.rmtree(pack_dir)
             except Exception as e:
                 # Pack deleted from DB but files remain
                 app.logger.warning(f"Deleted pack from DB but failed to delete files: {e}")
+        _ = blob_store.collect_garbage(sha256s)
         return jsonify({'success': True})
     except Exception as e:
         app.logger.error(f"Error deleting pack: {e}", exc_info=True)
@@ -187,50 +311,44 @@ def update_sticker_emoji(pack_name: str) -> tuple[Response, int] | Response:
         return jsonify({'error': f'Internal error: {str(e)}'}), 500
 
 @app.route('/api/packs/<pack_name>/upload-signal', methods=['POST'])
-def upload_pack_to_signal(pack_name: str) -> tuple[Response, int] | Response:
+def upload_pack_to_signal(pack_name: str) -> tuple[Response, int]:
     try:
         pack_info: StickerPackRecord | None = db.get_sticker_pack(pack_name)
         if not pack_info:
             return jsonify({'error': 'Pack not found'}), 404
-        # Run async upload
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            signal_url: str | None = loop.run_until_complete(upload_telegram_pack_to_signal(db, pack_name))
-        finally:
-            loop.close()
-        if not signal_url:
-            return jsonify({'error': 'Failed to upload to Signal'}), 500
-        # Update database with Signal URL
-        uploaded_at: int = int(time.time())
-        _ = db.update_pack_signal_url(pack_name, signal_url, uploaded_at)
-        return jsonify({
-            'success': True,
-            'signal_url': signal_url,
-            'uploaded_at': uploaded_at
-        })
-    except ValueError as e:
-        return jsonify({'error': str(e)}), 500
+
+        # ?force=1 uploads again even when Signal already has the current content
+        force: bool = request.args.get('force', 'false').lower() in ('1', 'true', 'yes')
+
+        async def run(progress: JobProgress) -> dict[str, object]:
+            upload: SignalUpload | None = await upload_telegram_pack_to_signal(db, pack_name, signal_media, progress, force)
+            if not upload:
+                raise RuntimeError('Failed to upload to Signal')
+            if not upload['uploaded']:
+                return {'signal_url': upload['signal_url'], 'uploaded_at': pack_info['signal_uploaded_at'], 'uploaded': False}
+            # Update database with Signal URL and the fingerprint of what was uploaded
+            uploaded_at: int = int(time.time())
+            _ = db.update_pack_signal_url(pack_name, upload['signal_url'], uploaded_at, upload['fingerprint'])
+            return {'signal_url': upload['signal_url'], 'uploaded_at': uploaded_at, 'uploaded': True}
+
+        return job_accepted(*job_queue.submit('signal_upload', pack_name, run))
     except Exception as e:
         app.logger.error(f"Error uploading to Signal: {e}", exc_info=True)
         return jsonify({'error': f'Internal error: {str(e)}'}), 500
 
 @app.route('/api/packs/update-all', methods=['POST'])
-def update_all_packs():
+def update_all_packs() -> tuple[Response, int]:
     try:
-        loop = asyncio.new_event_loop()
-        try:
-            results: dict[str, bool] = loop.run_until_complete(
-                update_service.update_all_packs()
+        async def run(progress: JobProgress) -> dict[str, object]:
+            results: dict[str, bool] = await update_service.update_all_packs(
+                on_progress=progress
             )
-        finally:
-            loop.close()
-        return jsonify({
-            'success': True,
-            'results': results,
-            'updated': sum(v for v in results.values()),
-            'failed': sum(not v for v in results.values()),
-        })
+            return {
+                'updated': sum(v for v in results.values()),
+                'failed': sum(not v for v in results.values()),
+            }
+
+        return job_accepted(*job_queue.submit('update_all', None, run))
     except Exception as e:
         app.logger.error("Bulk update failed", exc_info=True)
         return jsonify({
@@ -239,25 +357,17 @@ def update_all_packs():
         }), 500
 
 @app.route('/api/packs/<pack_name>/update', methods=['POST'])
-def update_single_pack(pack_name: str):
+def update_single_pack(pack_name: str) -> tuple[Response, int]:
     try:
-        loop = asyncio.new_event_loop()
-        try:
-            success: bool = loop.run_until_complete(
-                update_service.update_pack(pack_name)
-            )
-        finally:
-            loop.close()
-        if not success:
-            return jsonify({
-                'success': False,
-                'pack': pack_name,
-                'error': 'Update failed',
-            }), 500
-        return jsonify({
-            'success': True,
-            'pack': pack_name,
-        })
+        async def run(progress: JobProgress) -> dict[str, object]:
+            progress({}, 1)
+            success: bool = await update_service.update_pack(pack_name)
+            progress({pack_name: success}, 1)
+            if not success:
+                raise RuntimeError('Update failed')
+            return {'pack': pack_name}
+
+        return job_accepted(*job_queue.submit('update_pack', pack_name, run))
     except Exception as e:
         app.logger.error("Pack update failed", exc_info=True)
         return jsonify({
@@ -265,11 +375,50 @@ def update_single_pack(pack_name: str):
             'error': str(e),
         }), 500
 
+@app.route('/api/jobs')
+def get_jobs() -> Response:
+    limit: int = max(1, min(request.args.get('limit', 50, type=int), MAX_PER_PAGE))
+    return jsonify({'jobs': db.get_jobs(limit)})
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id: str) -> tuple[Response, int] | Response:
+    job: JobRecord | None = db.get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+# Columns of the rows of a compact sticker search response
+COMPACT_STICKER_FIELDS: list[str] = ['pack', 'file_unique_id', 'file_path', 'emoji']
+
+def compact_sticker_results(stickers: list[StickerSearchResult]) -> dict[str, Any]:
+    # Pack metadata is sent once in 'packs' as [name, title, artist] and referenced by index from
+    # each sticker row, laid out as COMPACT_STICKER_FIELDS
+    pack_indexes: dict[str, int] = {}
+    packs: list[list[str]] = []
+    rows: list[list[str | int]] = []
+    for s in stickers:
+        pack_index: int | None = pack_indexes.get(s['pack_name'])
+        if pack_index is None:
+            pack_index = pack_indexes[s['pack_name']] = len(packs)
+            packs.append([s['pack_name'], s['pack_title'], s['artist']])
+        rows.append([pack_index, s['file_unique_id'], s['file_path'], s['emoji']])
+    return {'fields': COMPACT_STICKER_FIELDS, 'packs': packs, 'stickers': rows}
+
 @app.route('/api/stickers/search')
-def search_stickers() -> Response:
+def search_stickers() -> tuple[Response, int] | Response:
     query: str = request.args.get('q', '')
-    stickers, total = db.search_stickers(query, page=1, per_page=100000)
-    filtered_stickers: list[StickerSearchResult] = fuzzy_search_stickers(query, stickers)
+    after, limit = get_keyset_args()
+    # Same as the pack search
+    ranked: list[str] | None = search_index.search_stickers(query) if query else None
+    try:
+        page: Page[StickerSearchResult] = db.search_stickers(
+            query, after, limit, ranked=ranked, sort=request.args.get('sort', ''), with_total=True
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    window: dict[str, Any] = {'next': page['next'], 'total': page['total']}
+    if request.args.get('format') == 'compact':
+        return jsonify({**compact_sticker_results(page['items']), **window})
     results: list[dict[str, str | dict[str, str]]] = [
         {
             'pack_name': s['pack_name'],
@@ -282,44 +431,41 @@ def search_stickers() -> Response:
             },
             'emoji': s['emoji']
         }
-        for s in filtered_stickers
+        for s in page['items']
     ]
     return jsonify({
         'stickers': results,
-        'total': total
+        **window,
     })
 
 @app.route('/api/custom-packs', methods=['GET'])
 def get_custom_packs() -> Response:
-    packs_with_counts, total = db.get_all_custom_packs(page=1, per_page=100000)
+    packs: list[CustomPackListing] = collect(
+        lambda after: db.get_all_custom_packs(after, limit=LISTING_BATCH_SIZE)
+    )
+    fingerprints: dict[str, str] = db.get_custom_pack_signal_fingerprints()
     result = {}
-    for pack, count in packs_with_counts:
-        # Get first 2 stickers as thumbnails
-        thumbnails, _ = db.get_custom_pack_stickers(pack['name'], page=1, per_page=2)
-        # Check if pack needs update
-        needs_signal_update: bool = (
-            pack.get('signal_uploaded_at') is not None and
-            pack.get('last_modified', 0) > pack.get('signal_uploaded_at', 0)
-        )
+    for pack in packs:
         result[pack['name']] = {
             'name': pack['name'],
             'title': pack['title'],
             'signal_url': pack.get('signal_url'),
             'signal_uploaded_at': pack.get('signal_uploaded_at'),
-            'needs_signal_update': needs_signal_update,
-            'sticker_count': count,
+            'needs_signal_update': custom_pack_needs_signal_update(pack, fingerprints),
+            'sticker_count': pack['sticker_count'],
+            # First 2 stickers as thumbnails
             'thumbnails': [
                 {
                     'pack_name': s['pack_name'],
                     'file_path': s['file_path'],
                     'emoji': s['emoji']
                 }
-                for s in thumbnails
+                for s in pack['thumbnails']
             ]
         }
     return jsonify({
         'packs': result,
-        'total': total
+        'total': len(packs)
     })
 
 @app.route('/api/custom-packs', methods=['POST'])
@@ -339,22 +485,33 @@ def get_custom_pack(pack_name: str) -> tuple[Response, int] | Response:
     pack = db.get_custom_pack(pack_name)
     if not pack:
         return jsonify({'error': 'Pack not found'}), 404
-    # Get stickers
-    stickers, total = db.get_custom_pack_stickers(pack_name, page=1, per_page=100000)
-    needs_signal_update: bool = (
-        pack.get('signal_uploaded_at') is not None and
-        pack.get('last_modified', 0) > pack.get('signal_uploaded_at', 0)
-    )
+    # Sticker details are loaded page by page from /stickers, the editor only needs to know
+    # which stickers are in the pack up front
+    members: dict[str, str] = db.get_custom_pack_members(pack_name)
+    fingerprints: dict[str, str] = db.get_custom_pack_signal_fingerprints([pack_name])
     return jsonify({
         'name': pack['name'],
         'title': pack['title'],
         'signal_url': pack.get('signal_url'),
         'signal_uploaded_at': pack.get('signal_uploaded_at'),
-        'needs_signal_update': needs_signal_update,
-        'stickers': [dict(s) for s in stickers],
-        'total': total
+        'needs_signal_update': custom_pack_needs_signal_update(pack, fingerprints),
+        'version': pack['version'],
+        'members': members,
+        'total': len(members)
     })
 
+@app.route('/api/custom-packs/<pack_name>/stickers')
+def get_custom_pack_sticker_page(pack_name: str) -> tuple[Response, int] | Response:
+    pack = db.get_custom_pack(pack_name)
+    if not pack:
+        return jsonify({'error': 'Pack not found'}), 404
+    after, limit = get_keyset_args()
+    try:
+        page: Page[CustomPackSticker] = db.get_custom_pack_stickers(pack_name, after, limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({**sticker_page(page), 'version': pack['version']})
+
 @app.route('/api/custom-packs/<pack_name>', methods=['PUT'])
 def update_custom_pack(pack_name: str) -> tuple[Response, int] | Response:
     try:
@@ -376,41 +533,59 @@ def update_custom_pack(pack_name: str) -> tuple[Response, int] | Response:
             )
             for s in stickers_data
         ]
-        success: bool = db.update_custom_pack(pack_name, title, stickers)
-        if success:
+        if db.update_custom_pack(pack_name, title, stickers):
             return jsonify({'success': True, 'pack': {'name': pack_name, 'title': title}})
-        return jsonify({'error': 'Failed to update pack'}), 500
+        # Deleted since the check above
+        return jsonify({'error': 'Pack not found'}), 404
     except Exception as e:
         app.logger.error(f"Error updating custom pack: {e}", exc_info=True)
         return jsonify({'error': f'Internal error: {str(e)}'}), 500
 
+@app.route('/api/custom-packs/<pack_name>', methods=['PATCH'])
+def patch_custom_pack(pack_name: str) -> tuple[Response, int] | Response:
+    # Body: {"version": int, "title"?: str, "ops": [{"op": "add" | "move", "file_unique_id", "before": id | null},
+    # {"op": "remove", "file_unique_id"}]}. Edits made against an older version are refused with 409.
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('version'), int) or not isinstance(data.get('ops', []), list):
+        return jsonify({'error': 'Invalid request'}), 400
+    title: str | None = data.get('title')
+    if title is not None and (not isinstance(title, str) or not title.strip()):
+        return jsonify({'error': 'Title must not be empty'}), 400
+    try:
+        version: int = db.patch_custom_pack(pack_name, data['version'], data.get('ops', []), title)
+    except KeyError:
+        return jsonify({'error': 'Pack not found'}), 404
+    except CustomPackConflict as e:
+        return jsonify({'error': 'Pack was changed by someone else', 'version': e.version}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"Error patching custom pack: {e}", exc_info=True)
+        return jsonify({'error': f'Internal error: {str(e)}'}), 500
+    return jsonify({'success': True, 'version': version})
+
 @app.route('/api/custom-packs/<pack_name>/upload-signal', methods=['POST'])
-def upload_custom_pack_to_signal_endpoint(pack_name: str) -> tuple[Response, int] | Response:
+def upload_custom_pack_to_signal_endpoint(pack_name: str) -> tuple[Response, int]:
     try:
-        pack_info = db.get_custom_pack(pack_name)
+        pack_info: CustomPackRecord | None = db.get_custom_pack(pack_name)
         if not pack_info:
             return jsonify({'error': 'Pack not found'}), 404
-        # Run async upload
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            signal_url = loop.run_until_complete(
-                upload_custom_pack_to_signal(db, pack_name)
-            )
-        finally:
-            loop.close()
-        if not signal_url:
-            return jsonify({'error': 'Failed to upload to Signal'}), 500
-        # Update database with Signal URL
-        uploaded_at = int(time.time())
-        _ = db.update_custom_pack_signal_url(pack_name, signal_url, uploaded_at)
-        return jsonify({
-            'success': True,
-            'signal_url': signal_url,
-            'uploaded_at': uploaded_at
-        })
-    except ValueError as e:
-        return jsonify({'error': str(e)}), 500
+
+        # ?force=1 uploads again even when Signal already has the current content
+        force: bool = request.args.get('force', 'false').lower() in ('1', 'true', 'yes')
+
+        async def run(progress: JobProgress) -> dict[str, object]:
+            upload: SignalUpload | None = await upload_custom_pack_to_signal(db, pack_name, signal_media, progress, force)
+            if not upload:
+                raise RuntimeError('Failed to upload to Signal')
+            if not upload['uploaded']:
+                return {'signal_url': upload['signal_url'], 'uploaded_at': pack_info['signal_uploaded_at'], 'uploaded': False}
+            # Update database with Signal URL and the fingerprint of what was uploaded
+            uploaded_at: int = int(time.time())
+            _ = db.update_custom_pack_signal_url(pack_name, upload['signal_url'], uploaded_at, upload['fingerprint'])
+            return {'signal_url': upload['signal_url'], 'uploaded_at': uploaded_at, 'uploaded': True}
+
+        return job_accepted(*job_queue.submit('custom_signal_upload', pack_name, run))
     except Exception as e:
         app.logger.error(f"Error uploading custom pack to Signal: {e}", exc_info=True)
         return jsonify({'error': f'Internal error: {str(e)}'}), 500
@@ -439,25 +614,32 @@ def export_pack(pack_name: str) -> tuple[Response, int] | Response:
     response.headers['Content-Disposition'] = f'attachment; filename={pack_name}.json'
     return response
 
-@app.route('/api/export/packs', methods=['GET'])
-def export_all_packs() -> Response:
-    pack_names: list[str] = db.get_all_pack_names()
-    if not pack_names:
-        return jsonify({'error': 'No packs to export'}), 404
-    # Create ZIP file in memory
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for pack_name in pack_names:
-            json_data: str = db.export_single_pack_to_json(pack_name)
-            zip_file.writestr(f'{pack_name}.json', json_data)
-    zip_buffer.seek(0)
-    return send_file(
-        zip_buffer,
+def get_include_media() -> bool:
+    return request.args.get('include_media', 'false').lower() in ('1', 'true', 'yes')
+
+def zip_download(entries: Iterator[tuple[str, str | Path]], download_name: str) -> Response:
+    return Response(
+        stream_with_context(stream_zip(entries)),
         mimetype='application/zip',
-        as_attachment=True,
-        download_name='sticker_packs.zip'
+        headers={'Content-Disposition': f'attachment; filename={download_name}'}
     )
 
+@app.route('/api/export/packs', methods=['GET'])
+def export_all_packs() -> tuple[Response, int] | Response:
+    if not db.get_all_pack_names():
+        return jsonify({'error': 'No packs to export'}), 404
+    include_media: bool = get_include_media()
+
+    def entries() -> Iterator[tuple[str, str | Path]]:
+        for pack_data in db.iter_pack_exports():
+            pack_name: str = pack_data['name']
+            yield f'{pack_name}.json', json.dumps(pack_data, ensure_ascii=False, indent=2)
+            if include_media:
+                for sticker in pack_data['stickers']:
+                    yield f"{pack_name}/{sticker['file_path']}", DOWNLOAD_DIR / pack_name / sticker['file_path']
+
+    return zip_download(entries(), 'sticker_packs.zip')
+
 @app.route('/api/export/custom-pack/<pack_name>', methods=['GET'])
 def export_custom_pack(pack_name: str) -> tuple[Response, int] | Response:
     if not db.get_custom_pack(pack_name):
@@ -469,28 +651,111 @@ def export_custom_pack(pack_name: str) -> tuple[Response, int] | Response:
     return response
 
 @app.route('/api/export/custom-packs', methods=['GET'])
-def export_all_custom_packs() -> Response:
-    pack_names: list[str] = db.get_all_custom_pack_names()
-    if not pack_names:
+def export_all_custom_packs() -> tuple[Response, int] | Response:
+    if not db.get_all_custom_pack_names():
         return jsonify({'error': 'No custom packs to export'}), 404
-    # Create ZIP file in memory
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for pack_name in pack_names:
-            json_data: str = db.export_single_custom_pack_to_json(pack_name)
-            zip_file.writestr(f'{pack_name}_custom.json', json_data)
-    zip_buffer.seek(0)
-    return send_file(
-        zip_buffer,
-        mimetype='application/zip',
-        as_attachment=True,
-        download_name='custom_packs.zip'
+    include_media: bool = get_include_media()
+
+    def entries() -> Iterator[tuple[str, str | Path]]:
+        for pack_data in db.iter_custom_pack_exports():
+            pack_name: str = pack_data['name']
+            yield f'{pack_name}_custom.json', json.dumps(pack_data, ensure_ascii=False, indent=2)
+            if include_media:
+                for sticker in pack_data['stickers']:
+                    yield (
+                        f"{pack_name}_custom/{sticker['file_path']}",
+                        DOWNLOAD_DIR / sticker['source_pack_name'] / sticker['file_path']
+                    )
+
+    return zip_download(entries(), 'custom_packs.zip')
+
+@app.route('/api/import', methods=['POST'])
+def import_packs() -> tuple[Response, int] | Response:
+    # Accepts exported pack JSON files or export ZIP bundles as multipart 'files'; ?dry_run=1 only reports the diff
+    uploads = request.files.getlist('files')
+    if not uploads:
+        return jsonify({'error': 'No files uploaded'}), 400
+    dry_run: bool = request.args.get('dry_run', 'false').lower() in ('1', 'true', 'yes')
+    try:
+        importer: PackImporter = PackImporter(db, blob_store, DOWNLOAD_DIR, dry_run=dry_run)
+        for upload in uploads:
+            importer.import_file(upload.stream, upload.filename or 'upload')
+        return jsonify(importer.finish())
+    except Exception as e:
+        app.logger.error(f"Error importing packs: {e}", exc_info=True)
+        return jsonify({'error': f'Internal error: {str(e)}'}), 500
+
+@app.route('/api/backup', methods=['GET'])
+def download_backup() -> tuple[Response, int] | Response:
+    # Full backup, or an incremental one against ?base=latest or the created_at of an earlier backup
+    base_name: str | None = request.args.get('base')
+    base: BackupManifest | None = None
+    if base_name:
+        # Only saved manifests, never a path on the server
+        if base_name != 'latest' and not base_name.isdigit():
+            return jsonify({'error': "base must be 'latest' or the created_at of a backup"}), 400
+        base = load_manifest(base_name)
+        if base is None:
+            return jsonify({'error': 'Base backup not found'}), 404
+    filename: str = f"sticker_registry_{int(time.time())}{'_incremental' if base else ''}.tar"
+    return Response(
+        stream_with_context(iter_backup(db, base)),
+        mimetype='application/x-tar',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
     )
 
+def cache_forever(response: Response) -> Response:
+    response.cache_control.public = True
+    response.cache_control.max_age = STICKER_CACHE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+def sticker_file_path(pack_name: str, filename: str) -> Path:
+    path: str | None = safe_join(str(DOWNLOAD_DIR), pack_name, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    return Path(path)
+
 @app.route('/sticker_files/<pack_name>/<filename>')
 def serve_sticker(pack_name: str, filename: str) -> Response:
-    pack_dir: Path = DOWNLOAD_DIR / pack_name
-    return send_from_directory(pack_dir, filename)
+    path: Path = sticker_file_path(pack_name, filename)
+    # The content hash makes a strong ETag shared by every pack holding the same file
+    blob: tuple[str, int] | None = db.get_file_blobs([Path(filename).stem]).get(Path(filename).stem)
+    if STICKER_SENDFILE_MODE == 'x-accel-redirect':
+        response: Response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = f"{STICKER_ACCEL_REDIRECT_PREFIX}{quote(pack_name)}/{quote(filename)}"
+        if blob:
+            response.set_etag(blob[0])
+    else:
+        # Handles If-None-Match/If-Modified-Since and Range requests (webm playback seeks)
+        response = send_file(path, etag=blob[0] if blob else True, conditional=True, max_age=STICKER_CACHE_MAX_AGE)
+    return cache_forever(response)
+
+@app.route('/thumbs/<pack_name>/<filename>')
+def serve_thumbnail(pack_name: str, filename: str) -> Response:
+    # Small static WebP of a sticker, made on first request when it was not made on download
+    path: Path = sticker_file_path(pack_name, filename)
+    thumbnail: Path | None = thumbnails.get(path)
+    if thumbnail is None:
+        # No decoder for this format, e.g. ffmpeg missing for webm
+        return redirect(url_for('serve_sticker', pack_name=pack_name, filename=filename))
+    return cache_forever(send_file(thumbnail, mimetype='image/webp', conditional=True, max_age=STICKER_CACHE_MAX_AGE))
+
+@app.route('/sprites/<pack_name>/<int:version>.webp')
+def serve_sprite(pack_name: str, version: int) -> Response:
+    # Sprite sheet of the first stickers of a pack; version is its last_update, so sheets never go stale
+    listings: list[StickerPackListing] = db.list_sticker_packs([pack_name], thumbnail_limit=SPRITE_TILES)
+    if not listings:
+        abort(404)
+    pack: StickerPackListing = listings[0]
+    if pack['last_update'] != version:
+        return redirect(url_for('serve_sprite', pack_name=pack_name, version=pack['last_update']))
+    sources: list[Path] = [DOWNLOAD_DIR / pack_name / s['file_path'] for s in pack['thumbnails']]
+    sprite: Path | None = thumbnails.get_sprite(pack_name, version, sources)
+    if sprite is None:
+        # The page falls back to one thumbnail request per sticker
+        abort(404)
+    return cache_forever(send_file(sprite, mimetype='image/webp', conditional=True, max_age=STICKER_CACHE_MAX_AGE))
 
 def main() -> None:
     app.run(debug=False, host='0.0.0.0', port=5000)
@@ -0,0 +1,214 @@
+import threading
+from dataclasses import dataclass, field
+
+import numpy as np
+from numpy.typing import NDArray
+from rapidfuzz import fuzz, process
+
+from src.database import Database, PackSearchDocument, StickerSearchResult
+
+# Results must score strictly above this to be returned
+SCORE_CUTOFF: int = 40
+# Best full-text matches taken from the database as candidates of a search, and best ranked
+# results a search returns
+SEARCH_CANDIDATE_LIMIT: int = 500
+SEARCH_RESULT_LIMIT: int = 1000
+
+@dataclass
+class _PackEntry:
+    document: PackSearchDocument
+    stickers: list[StickerSearchResult] = field(default_factory=list)
+    # Lower-cased name, title and artist, and emoji of each sticker, made once when the pack is loaded
+    fields: tuple[str, str, str] = ('', '', '')
+    emojis: list[str] = field(default_factory=list)
+
+@dataclass
+class _Columns:
+    # Flattened, lower-cased columns in database order (newest pack first)
+    pack_names: list[str]
+    pack_positions: dict[str, int]
+    # name, title and artist of every pack concatenated, so one cdist call scores all three
+    pack_fields: list[str]
+    stickers: list[StickerSearchResult]
+    sticker_ids: list[str]
+    sticker_positions: dict[str, int]
+    # Emoji strings repeat a lot, so each distinct value is scored once
+    emoji_values: list[str]
+    sticker_emoji_index: NDArray[np.intp]
+    sticker_pack_index: NDArray[np.intp]
+    # Position of the first sticker of each pack, the stickers of a pack are contiguous
+    pack_starts: NDArray[np.intp]
+
+def _score(query: str, choices: list[str]) -> NDArray[np.uint8]:
+    if not choices:
+        return np.zeros(0, dtype=np.uint8)
+    scores = process.cdist(
+        [query], choices,
+        scorer=fuzz.partial_ratio,
+        score_cutoff=SCORE_CUTOFF,
+        dtype=np.uint8,
+        workers=-1,
+    )
+    return scores[0]
+
+def _rank(scores: NDArray[np.uint8]) -> NDArray[np.intp]:
+    # Highest score first, ties keep database order so pagination is stable
+    matches: NDArray[np.intp] = np.flatnonzero(scores > SCORE_CUTOFF)
+    order: NDArray[np.intp] = np.argsort(-scores[matches].astype(np.int16), kind='stable')
+    return matches[order]
+
+class SearchIndex:
+    # Lower-cased search columns of every pack and sticker kept in memory. Queries are scored
+    # against them, either all of them or the candidates the database found, by position.
+    # Queries of three characters or more are narrowed down by the trigram index first; shorter
+    # ones, which it cannot serve, are scored against every entry.
+    def __init__(self, db: Database) -> None:
+        self.db: Database = db
+        self._lock: threading.Lock = threading.Lock()
+        self._entries: dict[str, _PackEntry] | None = None
+        self._columns: _Columns | None = None
+        self._dirty_packs: set[str] = set()
+        self._marker: tuple[int, int] = (0, 0)
+        db.add_change_listener(self._mark_dirty)
+
+    def _mark_dirty(self, pack_name: str) -> None:
+        with self._lock:
+            self._dirty_packs.add(pack_name)
+
+    def _reload_packs(self, pack_names: list[str] | None) -> None:
+        packs, stickers = self.db.get_search_documents(pack_names)
+        if pack_names is None or self._entries is None:
+            self._entries = {}
+        else:
+            for name in pack_names:
+                _ = self._entries.pop(name, None)
+        for document in packs:
+            self._entries[document['name']] = _PackEntry(
+                document, fields=(document['name'].lower(), document['title'].lower(), document['artist'].lower())
+            )
+        for sticker in stickers:
+            entry: _PackEntry = self._entries[sticker['pack_name']]
+            entry.stickers.append(sticker)
+            entry.emojis.append(sticker['emoji'].lower())
+        self._columns = None
+
+    def _refresh(self) -> None:
+        # Writes made through this process' Database arrive as dirty pack names; writes from
+        # other processes (the bot) are detected through the pack count / newest update marker
+        marker: tuple[int, int] = self.db.get_pack_change_marker()
+        if self._entries is None:
+            self._reload_packs(None)
+        else:
+            dirty: set[str] = self._dirty_packs
+            if marker != self._marker:
+                dirty |= set(self.db.get_pack_names_updated_since(self._marker[1]))
+            if dirty:
+                self._reload_packs(sorted(dirty))
+            if len(self._entries) != marker[0]:
+                # Packs were removed by another process, fall back to a full reload
+                self._reload_packs(None)
+        self._dirty_packs = set()
+        self._marker = marker
+        if self._columns is None:
+            self._columns = self._build_columns(self._entries or {})
+
+    @staticmethod
+    def _build_columns(entries: dict[str, _PackEntry]) -> _Columns:
+        # Only the changed packs were read and lower-cased again, this just lays the entries out
+        ordered: list[_PackEntry] = sorted(
+            entries.values(),
+            key=lambda e: (-e.document['last_update'], e.document['name'])
+        )
+        stickers: list[StickerSearchResult] = []
+        pack_index: list[int] = []
+        emoji_ids: dict[str, int] = {}
+        emoji_index: list[int] = []
+        for idx, entry in enumerate(ordered):
+            stickers.extend(entry.stickers)
+            pack_index.extend([idx] * len(entry.stickers))
+            emoji_index.extend(emoji_ids.setdefault(emoji, len(emoji_ids)) for emoji in entry.emojis)
+        pack_names: list[str] = [e.document['name'] for e in ordered]
+        sticker_ids: list[str] = [s['file_unique_id'] for s in stickers]
+        return _Columns(
+            pack_names=pack_names,
+            pack_positions={name: idx for idx, name in enumerate(pack_names)},
+            pack_fields=[e.fields[0] for e in ordered] + [e.fields[1] for e in ordered] + [e.fields[2] for e in ordered],
+            stickers=stickers,
+            sticker_ids=sticker_ids,
+            sticker_positions={unique_id: idx for idx, unique_id in enumerate(sticker_ids)},
+            emoji_values=list(emoji_ids),
+            sticker_emoji_index=np.asarray(emoji_index, dtype=np.intp),
+            sticker_pack_index=np.asarray(pack_index, dtype=np.intp),
+            pack_starts=np.cumsum([0] + [len(e.stickers) for e in ordered], dtype=np.intp),
+        )
+
+    def _current_columns(self) -> _Columns:
+        with self._lock:
+            self._refresh()
+            return self._columns  # pyright: ignore[reportReturnType]
+
+    @staticmethod
+    def _pack_scores(query: str, columns: _Columns, packs: NDArray[np.intp]) -> NDArray[np.uint8]:
+        # Best of the name, title and artist scores of the packs at the given positions
+        count: int = len(columns.pack_names)
+        choices: list[str] = (
+            columns.pack_fields if len(packs) == count
+            else [columns.pack_fields[offset + i] for offset in (0, count, 2 * count) for i in packs]
+        )
+        return _score(query, choices).reshape(3, len(packs)).max(axis=0)
+
+    @staticmethod
+    def _positions(positions: dict[str, int], keys: list[str]) -> NDArray[np.intp]:
+        # Positions of the keys still in the index, in database order
+        return np.unique(np.asarray([positions[key] for key in keys if key in positions], dtype=np.intp))
+
+    def rank_packs(self, query: str, candidates: list[str] | None = None) -> list[str]:
+        # Names of the matching packs, best first, among the candidate names or every pack
+        columns: _Columns = self._current_columns()
+        packs: NDArray[np.intp] = (
+            np.arange(len(columns.pack_names)) if candidates is None
+            else self._positions(columns.pack_positions, candidates)
+        )
+        scores: NDArray[np.uint8] = self._pack_scores(query.lower(), columns, packs)
+        return [columns.pack_names[i] for i in packs[_rank(scores)]]
+
+    def rank_stickers(self, query: str, candidates: list[str] | None = None,
+                      candidate_packs: list[str] | None = None) -> list[str]:
+        # file_unique_ids of the matching stickers, best first, among the candidates and the stickers
+        # of the candidate packs, or every sticker. A sticker scores the best of its pack's fields and its emoji.
+        columns: _Columns = self._current_columns()
+        query = query.lower()
+        # Each pack and distinct emoji is scored once, for the candidates only the ones they use
+        if candidates is None and candidate_packs is None:
+            stickers: NDArray[np.intp] = np.arange(len(columns.sticker_ids))
+            packs: NDArray[np.intp] = np.arange(len(columns.pack_names))
+            emojis: NDArray[np.intp] = np.arange(len(columns.emoji_values))
+            sticker_packs: NDArray[np.intp] = columns.sticker_pack_index
+            sticker_emojis: NDArray[np.intp] = columns.sticker_emoji_index
+        else:
+            pack_stickers: list[NDArray[np.intp]] = [
+                np.arange(columns.pack_starts[i], columns.pack_starts[i + 1])
+                for i in self._positions(columns.pack_positions, candidate_packs or [])
+            ]
+            stickers = np.unique(np.concatenate(
+                [self._positions(columns.sticker_positions, candidates or []), *pack_stickers]
+            ))
+            packs, sticker_packs = np.unique(columns.sticker_pack_index[stickers], return_inverse=True)
+            emojis, sticker_emojis = np.unique(columns.sticker_emoji_index[stickers], return_inverse=True)
+        scores: NDArray[np.uint8] = np.maximum(
+            self._pack_scores(query, columns, packs)[sticker_packs],
+            _score(query, [columns.emoji_values[i] for i in emojis])[sticker_emojis]
+        )
+        return [columns.sticker_ids[i] for i in stickers[_rank(scores)]]
+
+    def search_packs(self, query: str) -> list[str]:
+        candidates: list[str] | None = self.db.match_sticker_packs(query, SEARCH_CANDIDATE_LIMIT)
+        return self.rank_packs(query, candidates)[:SEARCH_RESULT_LIMIT]
+
+    def search_stickers(self, query: str) -> list[str]:
+        # Stickers of the best matching packs and the stickers with the best matching emoji
+        candidate_packs: list[str] | None = self.db.match_sticker_packs(query, SEARCH_CANDIDATE_LIMIT)
+        if candidate_packs is None:
+            return self.rank_stickers(query)[:SEARCH_RESULT_LIMIT]
+        candidates: list[str] | None = self.db.match_sticker_emojis(query, SEARCH_CANDIDATE_LIMIT)
+        return self.rank_stickers(query, candidates, candidate_packs)[:SEARCH_RESULT_LIMIT]
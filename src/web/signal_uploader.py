@@ -1,99 +1,124 @@
+import logging
+from collections.abc import Awaitable, Callable
 from pathlib import Path
+from typing import TypedDict
 
 from signalstickers_client import StickersClient
 from signalstickers_client.models import LocalStickerPack, Sticker
 
 from src.config import DOWNLOAD_DIR, SIGNAL_UUID, SIGNAL_PASSWORD
-from src.database import CustomPackRecord, Database, StickerPackRecord
+from src.database import CustomPackRecord, CustomPackSticker, Database, StickerPackRecord, StickerRecord
+from src.pagination import collect
+from src.signal_media import CUSTOM_PACK_SIGNAL_AUTHOR, SIGNAL_MAX_STICKERS, SignalMediaCache, signal_emoji, signal_text
+from src.web.jobs import JobProgress
 
-async def upload_telegram_pack_to_signal(db: Database, pack_name: str) -> str | None:
-    pack_info: StickerPackRecord | None = db.get_sticker_pack(pack_name)
-    if not pack_info:
-        return None
-    # Get all stickers for this pack
-    stickers_data, _ = db.get_pack_stickers(pack_name, page=1, per_page=10000)
-    if not stickers_data:
-        return None
-    pack_dir: Path = DOWNLOAD_DIR / pack_name
-    if not pack_dir.exists():
-        return None
-    # Create Signal pack
+logger: logging.Logger = logging.getLogger(__name__)
+
+class SignalUpload(TypedDict):
+    signal_url: str
+    # signal_fingerprint of the content on Signal, to store alongside the URL
+    fingerprint: str
+    # False when Signal already had this content and the existing pack was kept
+    uploaded: bool
+
+async def _build_pack(title: str, author: str, stickers: list[tuple[Path, str]], media: SignalMediaCache,
+                      progress: JobProgress | None) -> LocalStickerPack | None:
+    # Signal pack of the (file, emoji) stickers, read and converted to Signal's limits on the media pool
+    if len(stickers) > SIGNAL_MAX_STICKERS:
+        logger.warning(f"Only the first {SIGNAL_MAX_STICKERS} of {len(stickers)} stickers fit a Signal pack")
+        stickers = stickers[:SIGNAL_MAX_STICKERS]
+    prepared: list[bytes | None] = await media.prepare_many(path for path, _ in stickers)
+    if progress is not None:
+        progress({path.stem: data is not None for (path, _), data in zip(stickers, prepared)}, len(stickers))
     pack: LocalStickerPack = LocalStickerPack()
     # Signal has a 30 char limit
-    pack.title = pack_info['title'][:30]
-    pack.author = pack_info['artist'][:30]
-    # Add stickers
-    for sticker_data in stickers_data:
-        sticker_path: Path = pack_dir / sticker_data['file_path']
-        if not sticker_path.exists():
+    pack.title = signal_text(title)
+    pack.author = signal_text(author)
+    for (_, emoji), data in zip(stickers, prepared):
+        if data is None:
             continue
         sticker: Sticker = Sticker()
-        sticker.id = sticker_data['display_order']
-        sticker.emoji = sticker_data['emoji'][0] if sticker_data['emoji'] else '📷'
-        try:
-            with open(sticker_path, 'rb') as f:
-                sticker.image_data = f.read()
-            pack._addsticker(sticker)
-        except Exception:
-            continue
+        # Signal ids are positions in the pack
+        sticker.id = pack.nb_stickers
+        sticker.emoji = signal_emoji(emoji)
+        sticker.image_data = data
+        pack._addsticker(sticker)
     if pack.nb_stickers == 0:
         return None
-    # Set cover image (first sticker)
+    # Cover image (first sticker), bytes are immutable so it shares the sticker's data
     cover: Sticker = Sticker()
     cover.id = pack.nb_stickers
-    cover.image_data = pack.stickers[0].image_data[:]
+    cover.image_data = pack.stickers[0].image_data
     pack.cover = cover
-    # Upload to Signal
+    return pack
+
+async def _upload_pack(pack: LocalStickerPack) -> str | None:
     if not SIGNAL_UUID or not SIGNAL_PASSWORD:
         raise ValueError("SIGNAL_UUID and SIGNAL_PASSWORD must be set in environment")
     try:
         async with StickersClient(SIGNAL_UUID, SIGNAL_PASSWORD) as client:
             pack_id, pack_key = await client.upload_pack(pack)
         return f"https://signal.art/addstickers/#pack_id={pack_id}&pack_key={pack_key}"
-    except Exception:
+    except Exception as e:
+        logger.error(f"Signal upload of {pack.title} failed: {e}")
         return None
 
-async def upload_custom_pack_to_signal(db: Database, pack_name: str) -> str | None:
-    pack_info: CustomPackRecord | None = db.get_custom_pack(pack_name)
-    if not pack_info:
+async def _upload_unless_unchanged(signal_url: str | None, stored: str | None, fingerprint: str, force: bool,
+                                   build: Callable[[], Awaitable[LocalStickerPack | None]]) -> SignalUpload | None:
+    # Keeps the pack already on Signal when its fingerprint matches, unless force is set
+    if signal_url and stored == fingerprint and not force:
+        logger.info(f"Skipping upload of unchanged pack {signal_url}")
+        return SignalUpload(signal_url=signal_url, fingerprint=fingerprint, uploaded=False)
+    pack: LocalStickerPack | None = await build()
+    if pack is None:
         return None
-    # Get all stickers for this custom pack
-    stickers_data, _ = db.get_custom_pack_stickers(pack_name, page=1, per_page=10000)
-    if not stickers_data:
+    uploaded_url: str | None = await _upload_pack(pack)
+    if uploaded_url is None:
         return None
-    # Create Signal pack
-    pack: LocalStickerPack = LocalStickerPack()
-    # Signal has a 30 char limit
-    pack.title = pack_info['title'][:30]
-    pack.author = "Custom Pack"[:30]
-    # Add stickers from various source packs in order
-    for sticker_data in stickers_data:
-        pack_dir: Path = DOWNLOAD_DIR / sticker_data['pack_name']
-        sticker_path: Path = pack_dir / sticker_data['file_path']
-        if not sticker_path.exists():
-            continue
-        sticker: Sticker = Sticker()
-        sticker.id = sticker_data['display_order']
-        sticker.emoji = sticker_data['emoji'][0] if sticker_data['emoji'] else '📷'
-        try:
-            with open(sticker_path, 'rb') as f:
-                sticker.image_data = f.read()
-            pack._addsticker(sticker)
-        except Exception:
-            continue
-    if pack.nb_stickers == 0:
+    return SignalUpload(signal_url=uploaded_url, fingerprint=fingerprint, uploaded=True)
+
+async def upload_telegram_pack_to_signal(db: Database, pack_name: str, media: SignalMediaCache,
+                                         progress: JobProgress | None = None, force: bool = False) -> SignalUpload | None:
+    pack_info: StickerPackRecord | None = db.get_sticker_pack(pack_name)
+    if not pack_info:
         return None
-    # Set cover image (first sticker)
-    cover: Sticker = Sticker()
-    cover.id = pack.nb_stickers
-    cover.image_data = pack.stickers[0].image_data[:]
-    pack.cover = cover
-    # Upload to Signal
-    if not SIGNAL_UUID or not SIGNAL_PASSWORD:
-        raise ValueError("SIGNAL_UUID and SIGNAL_PASSWORD must be set in environment")
-    try:
-        async with StickersClient(SIGNAL_UUID, SIGNAL_PASSWORD) as client:
-            pack_id, pack_key = await client.upload_pack(pack)
-        return f"https://signal.art/addstickers/#pack_id={pack_id}&pack_key={pack_key}"
-    except Exception:
+    # Taken before the stickers are read, so a change made during the upload still flags the pack
+    fingerprint: str = db.get_pack_signal_fingerprints([pack_name])[pack_name]
+
+    async def build() -> LocalStickerPack | None:
+        # Get all stickers for this pack
+        stickers_data: list[StickerRecord] = collect(lambda after: db.get_pack_stickers(pack_name, after, limit=500))
+        pack_dir: Path = DOWNLOAD_DIR / pack_name
+        if not stickers_data or not pack_dir.exists():
+            return None
+        return await _build_pack(
+            pack_info['title'], pack_info['artist'],
+            [(pack_dir / s['file_path'], s['emoji']) for s in stickers_data], media, progress
+        )
+
+    return await _upload_unless_unchanged(
+        pack_info['signal_url'], pack_info['signal_fingerprint'], fingerprint, force, build
+    )
+
+async def upload_custom_pack_to_signal(db: Database, pack_name: str, media: SignalMediaCache,
+                                       progress: JobProgress | None = None, force: bool = False) -> SignalUpload | None:
+    pack_info: CustomPackRecord | None = db.get_custom_pack(pack_name)
+    if not pack_info:
         return None
+    fingerprint: str = db.get_custom_pack_signal_fingerprints([pack_name])[pack_name]
+
+    async def build() -> LocalStickerPack | None:
+        # Get all stickers for this custom pack, in order, from their source packs
+        stickers_data: list[CustomPackSticker] = collect(
+            lambda after: db.get_custom_pack_stickers(pack_name, after, limit=500)
+        )
+        if not stickers_data:
+            return None
+        return await _build_pack(
+            pack_info['title'], CUSTOM_PACK_SIGNAL_AUTHOR,
+            [(DOWNLOAD_DIR / s['pack_name'] / s['file_path'], s['emoji']) for s in stickers_data], media, progress
+        )
+
+    return await _upload_unless_unchanged(
+        pack_info['signal_url'], pack_info['signal_fingerprint'], fingerprint, force, build
+    )
@@ -0,0 +1,20 @@
+// Expands a compact sticker search response (format=compact) into the items of the regular one
+function expandStickerSearch(data) {
+   const column = Object.fromEntries(data.fields.map((field, i) => [field, i]));
+   const packs = data.packs.map(([name, title, artist]) => ({ name, title, artist }));
+   return data.stickers.map(row => {
+      const pack = packs[row[column.pack]];
+      const emoji = row[column.emoji];
+      return {
+         pack_name: pack.name,
+         pack_title: pack.title,
+         artist: pack.artist,
+         sticker: {
+            file_unique_id: row[column.file_unique_id],
+            file_path: row[column.file_path],
+            emoji: emoji,
+         },
+         emoji: emoji,
+      };
+   });
+}
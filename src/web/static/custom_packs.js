@@ -17,19 +17,33 @@ const loadingTemplate = document.getElementById('loadingTemplate');
 const thumbnailTemplate = document.getElementById('thumbnailTemplate');
 
 let currentEditingPack = null;
+let currentPackVersion = 0;
+// Saved stickers of the open pack loaded so far, in pack order, and the cursor of the next page
+let loadedPackStickers = [];
+let packStickersCursor = null;
+let packStickersHasMore = false;
+let isLoadingPackStickers = false;
+const packStickersPageSize = 200;
+// Edits made since the pack was opened, sent to the server as they are on save
+let packEdits = [];
+// Source pack of every sticker in the pack, loaded or not, with the edits applied
+let packMembers = new Map();
+// The loaded stickers with the edits applied, and the stickers placed at the end of the pack
+// while some of it is still unloaded
 let currentPackStickers = [];
-let allPackStickers = new Map();
+let trailingPackStickers = [];
+// Sticker counts of the source packs fetched while adding them
+let packSizes = new Map();
 
 let searchTimeout;
 let isLoadingMore = false;
 
-let stickerSearchPage = 1;
-let stickerSearchHasMore = false;
+// Tokens of the next page of the sticker and pack searches, null on the last page
+let stickerSearchNext = null;
 let stickerSearchQuery = '';
 let isLoadingStickers = false;
 
-let packSearchPage = 1;
-let packSearchHasMore = false;
+let packSearchNext = null;
 let packSearchQuery = '';
 let isLoadingPacks = false;
 
@@ -46,8 +60,7 @@ const itemsPerBatch = 50;
 
 // Drag and drop state
 let draggedElement = null;
-let draggedIndex = null;
-let dragOverElement = null;
+let draggedId = null;
 
 loadCustomPacks();
 
@@ -125,18 +138,27 @@ document.addEventListener('click', async (e) => {
 
 document.getElementById('stickerSearchInput')?.addEventListener('input', (e) => {
    clearTimeout(searchTimeout);
-   stickerSearchPage = 1;
+   stickerSearchNext = null;
    stickerSearchQuery = e.target.value;
    searchTimeout = setTimeout(() => searchStickersToAdd(e.target.value, false), 300);
 });
 
 document.getElementById('packSearchInput')?.addEventListener('input', (e) => {
    clearTimeout(searchTimeout);
-   packSearchPage = 1;
+   packSearchNext = null;
    packSearchQuery = e.target.value;
    searchTimeout = setTimeout(() => searchPacksToAdd(e.target.value, false), 300);
 });
 
+// Add scroll listener for the stickers of the edited pack
+document.getElementById('current-stickers')?.addEventListener('scroll', (e) => {
+   if (isLoadingPackStickers || !packStickersHasMore) return;
+   const container = e.target;
+   if (container.scrollTop + container.clientHeight >= container.scrollHeight - 500) {
+      loadMorePackStickers();
+   }
+});
+
 // Add scroll listener for sticker search results
 document.getElementById('add-stickers')?.addEventListener('scroll', (e) => {
    if (isLoadingStickers) return;
@@ -147,7 +169,7 @@ document.getElementById('add-stickers')?.addEventListener('scroll', (e) => {
    const scrollTop = container.scrollTop;
    const scrollHeight = container.scrollHeight;
    const clientHeight = container.clientHeight;
-   if (scrollTop + clientHeight >= scrollHeight - 500 && stickerSearchHasMore) {
+   if (scrollTop + clientHeight >= scrollHeight - 500 && stickerSearchNext) {
       loadMoreSearchStickers();
    }
 });
@@ -162,7 +184,7 @@ document.getElementById('add-packs')?.addEventListener('scroll', (e) => {
    const scrollTop = container.scrollTop;
    const scrollHeight = container.scrollHeight;
    const clientHeight = container.clientHeight;
-   if (scrollTop + clientHeight >= scrollHeight - 500 && packSearchHasMore) {
+   if (scrollTop + clientHeight >= scrollHeight - 500 && packSearchNext) {
       loadMoreSearchPacks();
    }
 });
@@ -243,11 +265,7 @@ async function loadCustomPacks() {
    try {
       const response = await fetch('/api/custom-packs');
       const data = await response.json();
-      const packArray = Object.values(data.packs);
-      allPacks = packArray.map(pack => ({
-         ...pack,
-         needs_signal_update: pack.signal_uploaded_at && pack.last_modified > pack.signal_uploaded_at
-      }));
+      allPacks = Object.values(data.packs);
       applyFiltersAndSort();
    } catch (error) {
       console.error('Error loading custom packs:', error);
@@ -280,7 +298,7 @@ function createCustomPackCard(pack) {
       pack.thumbnails.forEach(thumb => {
          const imgClone = thumbnailTemplate.content.cloneNode(true);
          const img = imgClone.querySelector('img');
-         img.src = `/sticker_files/${encodeURIComponent(thumb.pack_name)}/${encodeURIComponent(thumb.file_path)}`;
+         img.src = `/thumbs/${encodeURIComponent(thumb.pack_name)}/${encodeURIComponent(thumb.file_path)}`;
          img.alt = thumb.emoji || '';
          thumbnailContainer.appendChild(imgClone);
       });
@@ -358,45 +376,49 @@ async function uploadCustomPackToSignal(packName) {
       return;
    }
    try {
-      const response = await fetch(`/api/custom-packs/${encodeURIComponent(packName)}/upload-signal`, {
-         method: 'POST',
-         headers: { 'Content-Type': 'application/json' }
-      });
-      const data = await response.json();
-      if (response.ok) {
-         alert(`Successfully uploaded to Signal!\n\nURL: ${data.signal_url}`);
-         await loadCustomPacks();
-      } else {
-         alert(`Failed to upload to Signal: ${data.error}`);
+      const url = `/api/custom-packs/${encodeURIComponent(packName)}/upload-signal`;
+      let job = await runJob(url);
+      if (!job.result.uploaded && confirm('Signal already has this version of the pack. Upload it again anyway?')) {
+         job = await runJob(`${url}?force=1`);
       }
+      alert(`Successfully uploaded to Signal!\n\nURL: ${job.result.signal_url}`);
+      await loadCustomPacks();
    } catch (error) {
       console.error('Error uploading to Signal:', error);
-      alert('Failed to upload to Signal');
+      alert(`Failed to upload to Signal: ${error.message}`);
    }
 }
 
 async function openEditModal(pack) {
    currentEditingPack = pack;
-   allPackStickers.clear();
+   loadedPackStickers = [];
+   packStickersCursor = null;
+   packStickersHasMore = false;
+   packEdits = [];
+   packMembers = new Map();
+   packSizes.clear();
    try {
       const response = await fetch(`/api/custom-packs/${encodeURIComponent(pack.name)}`);
       const data = await response.json();
-      currentPackStickers = [...data.stickers];
+      currentPackVersion = data.version;
+      packMembers = new Map(Object.entries(data.members));
+      packStickersHasMore = packMembers.size > 0;
    } catch (error) {
       console.error('Error loading pack stickers:', error);
-      currentPackStickers = [];
    }
+   applyPackEdits();
    document.getElementById('editModalTitle').textContent = pack.name;
    document.getElementById('editPackTitle').value = pack.title;
    renderCurrentStickers();
    editModal.classList.add('active');
+   loadMorePackStickers();
    // Reset sticker search state
-   stickerSearchPage = 1;
+   stickerSearchNext = null;
    stickerSearchQuery = '';
    const stickersGrid = document.getElementById('searchStickersGrid');
    stickersGrid.innerHTML = '<div class="empty-state"><p>Switch to this tab to search stickers</p></div>';
    // Reset pack search state
-   packSearchPage = 1;
+   packSearchNext = null;
    packSearchQuery = '';
    const packsGrid = document.getElementById('searchPacksGrid');
    packsGrid.innerHTML = '<div class="empty-state"><p>Switch to this tab to search packs</p></div>';
@@ -405,7 +427,8 @@ async function openEditModal(pack) {
 function closeEditModal() {
    editModal.classList.remove('active');
    currentEditingPack = null;
-   allPackStickers.clear();
+   loadedPackStickers = [];
+   packEdits = [];
 }
 
 function switchTab(tabName) {
@@ -416,47 +439,138 @@ function switchTab(tabName) {
       content.classList.toggle('active', content.id === tabName);
    });
    // Load data only when switching to the tab
-   if (tabName === 'add-stickers') {
+   if (tabName === 'current-stickers') {
+      loadMorePackStickers();
+   } else if (tabName === 'add-stickers') {
       const grid = document.getElementById('searchStickersGrid');
       // Only load if empty or showing placeholder
       if (grid.querySelector('.empty-state')) {
-         stickerSearchPage = 1;
+         stickerSearchNext = null;
          searchStickersToAdd('', false);
       }
    } else if (tabName === 'add-packs') {
       const grid = document.getElementById('searchPacksGrid');
       // Only load if empty or showing placeholder
       if (grid.querySelector('.empty-state')) {
-         packSearchPage = 1;
+         packSearchNext = null;
          searchPacksToAdd('', false);
       }
    }
 }
 
+async function loadMorePackStickers() {
+   if (!currentEditingPack || !packStickersHasMore || isLoadingPackStickers) return;
+   const packName = currentEditingPack.name;
+   isLoadingPackStickers = true;
+   try {
+      const after = packStickersCursor ? `&after=${encodeURIComponent(packStickersCursor)}` : '';
+      const response = await fetch(`/api/custom-packs/${encodeURIComponent(packName)}/stickers?limit=${packStickersPageSize}${after}`);
+      const page = await response.json();
+      // The modal was closed or switched to another pack meanwhile
+      if (currentEditingPack?.name !== packName) return;
+      loadedPackStickers.push(...page.stickers);
+      packStickersCursor = page.next;
+      packStickersHasMore = page.next !== null;
+      if (packEdits.length === 0) {
+         currentPackStickers = loadedPackStickers;
+         appendCurrentStickers(page.stickers);
+      } else {
+         applyPackEdits();
+         renderCurrentStickers();
+      }
+   } catch (error) {
+      console.error('Error loading pack stickers:', error);
+      packStickersHasMore = false;
+      renderCurrentStickers();
+   } finally {
+      isLoadingPackStickers = false;
+   }
+   // Keep loading until the stickers overflow the tab, so it can be scrolled
+   const container = document.getElementById('current-stickers');
+   if (packStickersHasMore && container.classList.contains('active') &&
+      container.scrollHeight <= container.clientHeight + 500) {
+      await loadMorePackStickers();
+   }
+}
+
+// Replays the edits over the loaded stickers. Stickers placed at the end of the pack go after the
+// unloaded ones, so they are kept apart until the last page is in.
+function applyPackEdits() {
+   const stickers = [...loadedPackStickers];
+   const trailing = [];
+   for (const edit of packEdits) {
+      for (const list of [stickers, trailing]) {
+         const index = list.findIndex(s => s.file_unique_id === edit.file_unique_id);
+         if (index !== -1) list.splice(index, 1);
+      }
+      if (edit.op === 'remove') continue;
+      if (edit.before === null) {
+         (packStickersHasMore ? trailing : stickers).push(edit.sticker);
+         continue;
+      }
+      for (const list of [stickers, trailing]) {
+         const index = list.findIndex(s => s.file_unique_id === edit.before);
+         if (index !== -1) {
+            list.splice(index, 0, edit.sticker);
+            break;
+         }
+      }
+   }
+   currentPackStickers = stickers;
+   trailingPackStickers = trailing;
+}
+
+function recordPackEdit(edit) {
+   packEdits.push(edit);
+   if (edit.op === 'remove') {
+      packMembers.delete(edit.file_unique_id);
+   } else {
+      packMembers.set(edit.file_unique_id, edit.sticker.pack_name);
+   }
+   applyPackEdits();
+}
+
 function renderCurrentStickers() {
    const grid = document.getElementById('currentStickersGrid');
    const empty = document.getElementById('currentEmpty');
    grid.innerHTML = '';
-   if (currentPackStickers.length === 0) {
+   if (currentPackStickers.length === 0 && trailingPackStickers.length === 0 && !packStickersHasMore) {
       empty.style.display = 'block';
       return;
    }
    empty.style.display = 'none';
-   currentPackStickers.forEach((sticker, index) => {
-      grid.appendChild(createEditableSticker(sticker, index));
-   });
+   currentPackStickers.forEach(sticker => grid.appendChild(createEditableSticker(sticker)));
+   if (packStickersHasMore) {
+      grid.appendChild(loadingTemplate.content.cloneNode(true));
+   }
+   trailingPackStickers.forEach(sticker => grid.appendChild(createEditableSticker(sticker)));
 }
 
-function createEditableSticker(sticker, index) {
+function appendCurrentStickers(stickers) {
+   // Adds a page of unedited stickers without rebuilding the grid
+   const grid = document.getElementById('currentStickersGrid');
+   const loadingEl = grid.querySelector('.loading');
+   if (!loadingEl) {
+      renderCurrentStickers();
+      return;
+   }
+   stickers.forEach(sticker => grid.insertBefore(createEditableSticker(sticker), loadingEl));
+   if (!packStickersHasMore) {
+      loadingEl.remove();
+      if (grid.children.length === 0) renderCurrentStickers();
+   }
+}
+
+function createEditableSticker(sticker) {
    const clone = editableStickerTemplate.content.cloneNode(true);
    const card = clone.querySelector('.sticker-card');
    // Make card draggable
    card.draggable = true;
-   card.dataset.index = index;
+   card.dataset.id = sticker.file_unique_id;
    // Drag start
    card.addEventListener('dragstart', (e) => {
       draggedElement = card;
-      draggedIndex = parseInt(card.dataset.index);
+      draggedId = card.dataset.id;
       card.style.opacity = '0.5';
       e.dataTransfer.effectAllowed = 'move';
       e.dataTransfer.setData('text/html', card.innerHTML);
@@ -488,18 +602,15 @@ function createEditableSticker(sticker, index) {
       e.stopPropagation();
       card.style.borderColor = '';
       if (draggedElement && draggedElement !== card) {
-         const targetIndex = parseInt(card.dataset.index);
-         // Perform the reorder in the array
-         const movedSticker = currentPackStickers[draggedIndex];
-         currentPackStickers.splice(draggedIndex, 1);
-         // Adjust target index if we removed an element before it
-         const adjustedTargetIndex = draggedIndex < targetIndex ? targetIndex - 1 : targetIndex;
-         currentPackStickers.splice(adjustedTargetIndex, 0, movedSticker);
+         // The dragged sticker takes the place of the one it was dropped on
+         const movedSticker = [...currentPackStickers, ...trailingPackStickers].find(s => s.file_unique_id === draggedId);
+         if (!movedSticker) return;
+         recordPackEdit({ op: 'move', file_unique_id: draggedId, before: card.dataset.id, sticker: movedSticker });
          // Re-render the entire grid
          renderCurrentStickers();
       }
    });
-   const filePath = `/sticker_files/${encodeURIComponent(sticker.pack_name)}/${encodeURIComponent(sticker.file_path)}`;
+   const filePath = `/thumbs/${encodeURIComponent(sticker.pack_name)}/${encodeURIComponent(sticker.file_path)}`;
    clone.querySelector('[data-field="image"]').src = filePath;
    const emojiDiv = clone.querySelector('[data-field="emoji"]');
    if (sticker.emoji) {
@@ -510,7 +621,7 @@ function createEditableSticker(sticker, index) {
    const packTitle = clone.querySelector('[data-field="pack_title"]');
    packTitle.textContent = sticker.pack_title || sticker.pack_name;
    clone.querySelector('[data-action="remove-sticker"]').addEventListener('click', () => {
-      currentPackStickers.splice(index, 1);
+      recordPackEdit({ op: 'remove', file_unique_id: sticker.file_unique_id });
       renderCurrentStickers();
       refreshPackSelectionDisplay();
    });
@@ -523,13 +634,14 @@ async function searchStickersToAdd(query, append = false) {
    if (!append) {
       grid.innerHTML = '';
       grid.appendChild(loadingTemplate.content.cloneNode(true));
-      stickerSearchPage = 1;
+      stickerSearchNext = null;
    } else {
       grid.appendChild(loadingTemplate.content.cloneNode(true));
    }
    isLoadingStickers = true;
    try {
-      const response = await fetch(`/api/stickers/search?q=${encodeURIComponent(query)}&page=${stickerSearchPage}&per_page=100`);
+      const after = stickerSearchNext ? `&after=${encodeURIComponent(stickerSearchNext)}` : '';
+      const response = await fetch(`/api/stickers/search?q=${encodeURIComponent(query)}&limit=100&format=compact${after}`);
       const data = await response.json();
       if (!append) {
          grid.innerHTML = '';
@@ -537,8 +649,8 @@ async function searchStickersToAdd(query, append = false) {
          const loadingEl = grid.querySelector('.loading');
          if (loadingEl) loadingEl.remove();
       }
-      stickerSearchHasMore = data.total > stickerSearchPage * 100;
-      data.stickers.forEach(item => grid.appendChild(createSelectableSticker(item)));
+      stickerSearchNext = data.next;
+      expandStickerSearch(data).forEach(item => grid.appendChild(createSelectableSticker(item)));
    } catch (error) {
       console.error('Error searching stickers:', error);
       if (!append) {
@@ -550,15 +662,14 @@ async function searchStickersToAdd(query, append = false) {
 }
 
 async function loadMoreSearchStickers() {
-   if (!stickerSearchHasMore || isLoadingStickers) return;
-   stickerSearchPage++;
+   if (!stickerSearchNext || isLoadingStickers) return;
    await searchStickersToAdd(stickerSearchQuery, true);
 }
 
 function createSelectableSticker(item) {
    const clone = selectableStickerTemplate.content.cloneNode(true);
    const card = clone.querySelector('.sticker-card');
-   const filePath = `/sticker_files/${encodeURIComponent(item.pack_name)}/${encodeURIComponent(item.sticker.file_path)}`;
+   const filePath = `/thumbs/${encodeURIComponent(item.pack_name)}/${encodeURIComponent(item.sticker.file_path)}`;
    clone.querySelector('[data-field="image"]').src = filePath;
    const emojiDiv = clone.querySelector('[data-field="emoji"]');
    if (item.emoji) {
@@ -569,26 +680,25 @@ function createSelectableSticker(item) {
    const packTitle = clone.querySelector('[data-field="pack_title"]');
    packTitle.textContent = item.pack_title;
    packTitle.title = item.pack_title;
-   const isSelected = currentPackStickers.some(
-      s => s.file_unique_id === item.sticker.file_unique_id
-   );
-   if (isSelected) {
+   if (packMembers.has(item.sticker.file_unique_id)) {
       card.classList.add('selected');
    }
    card.addEventListener('click', () => {
-      const existingIndex = currentPackStickers.findIndex(
-         s => s.file_unique_id === item.sticker.file_unique_id
-      );
-      if (existingIndex !== -1) {
-         currentPackStickers.splice(existingIndex, 1);
+      if (packMembers.has(item.sticker.file_unique_id)) {
+         recordPackEdit({ op: 'remove', file_unique_id: item.sticker.file_unique_id });
          card.classList.remove('selected');
       } else {
-         currentPackStickers.push({
-            pack_name: item.pack_name,
-            pack_title: item.pack_title,
+         recordPackEdit({
+            op: 'add',
             file_unique_id: item.sticker.file_unique_id,
-            file_path: item.sticker.file_path,
-            emoji: item.emoji
+            before: null,
+            sticker: {
+               pack_name: item.pack_name,
+               pack_title: item.pack_title,
+               file_unique_id: item.sticker.file_unique_id,
+               file_path: item.sticker.file_path,
+               emoji: item.emoji
+            }
          });
          card.classList.add('selected');
       }
@@ -604,13 +714,14 @@ async function searchPacksToAdd(query, append = false) {
    if (!append) {
       grid.innerHTML = '';
       grid.appendChild(loadingTemplate.content.cloneNode(true));
-      packSearchPage = 1;
+      packSearchNext = null;
    } else {
       grid.appendChild(loadingTemplate.content.cloneNode(true));
    }
    isLoadingPacks = true;
    try {
-      const response = await fetch(`/api/packs/search?q=${encodeURIComponent(query)}&page=${packSearchPage}&per_page=50`);
+      const after = packSearchNext ? `&after=${encodeURIComponent(packSearchNext)}` : '';
+      const response = await fetch(`/api/packs/search?q=${encodeURIComponent(query)}&limit=50${after}`);
       const data = await response.json();
       if (!append) {
          grid.innerHTML = '';
@@ -618,13 +729,9 @@ async function searchPacksToAdd(query, append = false) {
          const loadingEl = grid.querySelector('.loading');
          if (loadingEl) loadingEl.remove();
       }
-      packSearchHasMore = data.total > packSearchPage * 50;
-      for (const pack of data.packs) {
-         if (!allPackStickers.has(pack.name)) {
-            await fetchPackStickers(pack.name);
-         }
-         grid.appendChild(createSelectablePack(pack));
-      }
+      packSearchNext = data.next;
+      const counts = packMemberCounts();
+      data.packs.forEach(pack => grid.appendChild(createSelectablePack(pack, counts)));
    } catch (error) {
       console.error('Error searching packs:', error);
       if (!append) {
@@ -636,31 +743,41 @@ async function searchPacksToAdd(query, append = false) {
 }
 
 async function loadMoreSearchPacks() {
-   if (!packSearchHasMore || isLoadingPacks) return;
-   packSearchPage++;
+   if (!packSearchNext || isLoadingPacks) return;
    await searchPacksToAdd(packSearchQuery, true);
 }
 
 async function fetchPackStickers(packName) {
-   try {
-      const response = await fetch(`/api/packs/${encodeURIComponent(packName)}?per_page=10000`);
-      const pack = await response.json();
-      allPackStickers.set(packName, pack.stickers || []);
-   } catch (error) {
-      console.error(`Error fetching stickers for pack ${packName}:`, error);
-      allPackStickers.set(packName, []);
-   }
+   // Every sticker of a source pack, page by page
+   const stickers = [];
+   let after = null;
+   do {
+      const cursor = after ? `&after=${encodeURIComponent(after)}` : '';
+      const response = await fetch(`/api/packs/${encodeURIComponent(packName)}/stickers?limit=500${cursor}`);
+      const page = await response.json();
+      stickers.push(...page.stickers);
+      after = page.next;
+   } while (after);
+   packSizes.set(packName, stickers.length);
+   return stickers;
+}
+
+function packMemberCounts() {
+   const counts = new Map();
+   packMembers.forEach(packName => counts.set(packName, (counts.get(packName) || 0) + 1));
+   return counts;
 }
 
-function createSelectablePack(pack) {
+function createSelectablePack(pack, counts) {
    const clone = selectablePackTemplate.content.cloneNode(true);
    const card = clone.querySelector('.pack-card');
+   card.dataset.stickerCount = pack.sticker_count;
    if (pack.thumbnails?.length) {
       const thumbnailContainer = clone.querySelector('.pack-thumbnail');
       pack.thumbnails.slice(0, 2).forEach(thumb => {
          const imgClone = thumbnailTemplate.content.cloneNode(true);
          const img = imgClone.querySelector('img');
-         img.src = `/sticker_files/${encodeURIComponent(pack.name)}/${encodeURIComponent(thumb.file_path)}`;
+         img.src = `/thumbs/${encodeURIComponent(pack.name)}/${encodeURIComponent(thumb.file_path)}`;
          img.alt = thumb.emoji || '';
          thumbnailContainer.appendChild(imgClone);
       });
@@ -668,54 +785,64 @@ function createSelectablePack(pack) {
    clone.querySelector('[data-field="title"]').textContent = pack.title;
    clone.querySelector('[data-field="name"]').textContent = pack.name;
    clone.querySelector('[data-field="sticker_count"]').textContent = `${pack.sticker_count} stickers`;
-   updatePackCardSelection(card, pack.name);
+   updatePackCardSelection(card, pack.name, counts);
    card.addEventListener('click', async () => {
-      await togglePackSelection(pack.name);
-      updatePackCardSelection(card, pack.name);
+      await togglePackSelection(pack);
+      updatePackCardSelection(card, pack.name, packMemberCounts());
       renderCurrentStickers();
    });
    return clone;
 }
 
-function updatePackCardSelection(card, packName) {
-   const packStickers = allPackStickers.get(packName) || [];
-   const selectedCount = currentPackStickers.filter(s => s.pack_name === packName).length;
+function updatePackCardSelection(card, packName, counts) {
+   const packSize = packSizes.get(packName) ?? parseInt(card.dataset.stickerCount);
+   const selectedCount = counts.get(packName) || 0;
    card.classList.remove('selected', 'partial');
-   if (selectedCount === packStickers.length && packStickers.length > 0) {
+   if (selectedCount >= packSize && packSize > 0) {
       card.classList.add('selected');
    } else if (selectedCount > 0) {
       card.classList.add('partial');
    }
 }
 
-async function togglePackSelection(packName) {
-   if (!allPackStickers.has(packName)) {
-      await fetchPackStickers(packName);
+async function togglePackSelection(pack) {
+   let packStickers;
+   try {
+      packStickers = await fetchPackStickers(pack.name);
+   } catch (error) {
+      console.error(`Error fetching stickers for pack ${pack.name}:`, error);
+      return;
    }
-   const packStickers = allPackStickers.get(packName) || [];
-   const selectedCount = currentPackStickers.filter(s => s.pack_name === packName).length;
-   // Remove all stickers from this pack
-   currentPackStickers = currentPackStickers.filter(s => s.pack_name !== packName);
-   // If not fully selected, add all stickers
-   if (selectedCount !== packStickers.length) {
-      const response = await fetch(`/api/packs/${encodeURIComponent(packName)}`);
-      const pack = await response.json();
-      packStickers.forEach(sticker => {
-         currentPackStickers.push({
-            pack_name: packName,
+   const missing = packStickers.filter(sticker => !packMembers.has(sticker.file_unique_id));
+   if (missing.length === 0) {
+      // Fully selected, remove every sticker of this pack
+      [...packMembers].filter(([, packName]) => packName === pack.name).forEach(([id]) => {
+         recordPackEdit({ op: 'remove', file_unique_id: id });
+      });
+      return;
+   }
+   // Otherwise add the stickers that are not in the pack yet
+   missing.forEach(sticker => {
+      recordPackEdit({
+         op: 'add',
+         file_unique_id: sticker.file_unique_id,
+         before: null,
+         sticker: {
+            pack_name: pack.name,
             pack_title: pack.title,
             file_unique_id: sticker.file_unique_id,
             file_path: sticker.file_path,
             emoji: sticker.emoji
-         });
+         }
       });
-   }
+   });
 }
 
 function refreshPackSelectionDisplay() {
+   const counts = packMemberCounts();
    document.querySelectorAll('#searchPacksGrid .pack-card').forEach(card => {
       const packName = card.querySelector('[data-field="name"]').textContent;
-      updatePackCardSelection(card, packName);
+      updatePackCardSelection(card, packName, counts);
    });
 }
 
@@ -728,15 +855,25 @@ async function savePackChanges() {
    }
    try {
       const response = await fetch(`/api/custom-packs/${encodeURIComponent(currentEditingPack.name)}`, {
-         method: 'PUT',
+         method: 'PATCH',
          headers: { 'Content-Type': 'application/json' },
-         body: JSON.stringify({ title, stickers: currentPackStickers })
+         body: JSON.stringify({
+            version: currentPackVersion,
+            title,
+            ops: packEdits.map(({ op, file_unique_id, before }) => (
+               op === 'remove' ? { op, file_unique_id } : { op, file_unique_id, before }
+            ))
+         })
       });
       if (response.ok) {
          closeEditModal();
          loadCustomPacks();
+      } else if (response.status === 409) {
+         alert('This pack was changed elsewhere, it will be reloaded. Please make your changes again.');
+         await openEditModal(currentEditingPack);
       } else {
-         alert('Failed to save changes');
+         const error = await response.json();
+         alert(error.error || 'Failed to save changes');
       }
    } catch (error) {
       console.error('Error saving pack:', error);
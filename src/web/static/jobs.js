@@ -0,0 +1,35 @@
+const JOB_POLL_INTERVAL_MS = 1000;
+
+// Submits a background job and polls it until it finishes.
+// Resolves with the finished job, rejects with the job error if it failed.
+async function runJob(url, onProgress) {
+   const response = await fetch(url, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' }
+   });
+   const data = await response.json();
+   if (!response.ok || !data.job_id) {
+      throw new Error(data.error || 'Failed to start job');
+   }
+   return waitForJob(data.job_id, onProgress);
+}
+
+async function waitForJob(jobId, onProgress) {
+   while (true) {
+      const response = await fetch(`/api/jobs/${encodeURIComponent(jobId)}`);
+      const job = await response.json();
+      if (!response.ok) {
+         throw new Error(job.error || 'Failed to fetch job status');
+      }
+      if (onProgress) {
+         onProgress(job);
+      }
+      if (job.status === 'succeeded') {
+         return job;
+      }
+      if (job.status === 'failed' || job.status === 'interrupted') {
+         throw new Error(job.error || `Job ${job.status}`);
+      }
+      await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+   }
+}
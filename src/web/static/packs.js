@@ -18,6 +18,7 @@ if (updateAllBtn) {
 const packCardTemplate = document.getElementById('packCardTemplate');
 const thumbnailImageTemplate = document.getElementById('thumbnailImageTemplate');
 const thumbnailVideoTemplate = document.getElementById('thumbnailVideoTemplate');
+const spriteTileTemplate = document.getElementById('spriteTileTemplate');
 const stickerImageItemTemplate = document.getElementById('stickerImageItemTemplate');
 const stickerVideoItemTemplate = document.getElementById('stickerVideoItemTemplate');
 
@@ -26,6 +27,9 @@ let currentQuery = '';
 let isLoadingMore = false;
 let allPacks = [];
 let currentSortBy = 'last_update_desc';
+// Token of the next page of the current search, null on the last page
+let nextPage = null;
+let searchGeneration = 0;
 
 let currentFilters = {
    onSignal: 'disabled',
@@ -74,11 +78,10 @@ function cycleFilterState(filterKey, element) {
    applyFiltersAndSort();
 }
 
-let displayedCount = 0;
 const itemsPerBatch = 50;
 
 window.addEventListener('scroll', () => {
-   if (isLoadingMore) return;
+   if (isLoadingMore || !nextPage) return;
    const scrollTop = window.scrollY;
    const windowHeight = window.innerHeight;
    const docHeight = document.documentElement.scrollHeight;
@@ -87,18 +90,36 @@ window.addEventListener('scroll', () => {
    }
 });
 
-function loadMorePacks() {
-   if (isLoadingMore) return;
-   let filtered = filterPacks(allPacks, currentFilters);
-   let sorted = sortPacks(filtered, currentSortBy);
-   if (displayedCount >= sorted.length) return;
+function buildSearchUrl(after) {
+   const params = new URLSearchParams({
+      q: currentQuery,
+      limit: itemsPerBatch,
+      sort: currentSortBy,
+      on_signal: currentFilters.onSignal,
+      needs_update: currentFilters.needsUpdate,
+      in_custom_packs: currentFilters.inCustomPacks
+   });
+   if (after) params.set('after', after);
+   return `/api/packs/search?${params}`;
+}
+
+async function loadMorePacks() {
+   if (isLoadingMore || !nextPage) return;
    isLoadingMore = true;
-   const startIdx = displayedCount;
-   const endIdx = Math.min(displayedCount + itemsPerBatch, sorted.length);
-   const batch = sorted.slice(startIdx, endIdx);
-   batch.forEach(pack => packsGrid.appendChild(createPackCard(pack)));
-   displayedCount = endIdx;
-   isLoadingMore = false;
+   const generation = searchGeneration;
+   try {
+      const response = await fetch(buildSearchUrl(nextPage));
+      const data = await response.json();
+      // Drop the page if a new search started while it was loading
+      if (generation !== searchGeneration) return;
+      nextPage = data.next;
+      allPacks.push(...data.packs);
+      data.packs.forEach(pack => packsGrid.appendChild(createPackCard(pack)));
+   } catch (error) {
+      console.error('Error loading more packs:', error);
+   } finally {
+      isLoadingMore = false;
+   }
 }
 
 document.addEventListener('click', async (e) => {
@@ -116,6 +137,47 @@ function formatDate(timestamp) {
    return new Date(timestamp * 1000).toLocaleDateString();
 }
 
+function appendThumbnails(container, pack) {
+   pack.thumbnails.forEach(thumb => {
+      const tagClone = thumbnailImageTemplate.content.cloneNode(true);
+      const t = tagClone.querySelector('img');
+      t.src = `/thumbs/${encodeURIComponent(pack.name)}/${encodeURIComponent(thumb.file_path)}`;
+      t.alt = thumb.emoji || '';
+      if (thumb.file_path.includes("webm")) {
+         // The server redirects to the original when it cannot make a thumbnail, play it as a video instead
+         t.addEventListener('error', () => {
+            const videoClone = thumbnailVideoTemplate.content.cloneNode(true);
+            videoClone.querySelector('video').src = `/sticker_files/${encodeURIComponent(pack.name)}/${encodeURIComponent(thumb.file_path)}`;
+            t.replaceWith(videoClone);
+         }, { once: true });
+      }
+      container.appendChild(tagClone);
+   });
+}
+
+function appendSpriteTiles(container, pack) {
+   // One sprite sheet request per card; each tile shows its part of the sheet
+   const { url, width, height, tile, offsets } = pack.sprite;
+   pack.thumbnails.forEach((thumb, i) => {
+      const tileClone = spriteTileTemplate.content.cloneNode(true);
+      const div = tileClone.querySelector('.sprite-tile');
+      const [x, y] = offsets[i];
+      div.style.backgroundImage = `url("${url}")`;
+      div.style.backgroundSize = `${(width / tile) * 100}% ${(height / tile) * 100}%`;
+      div.style.backgroundPosition = `${width > tile ? (x / (width - tile)) * 100 : 0}% ${height > tile ? (y / (height - tile)) * 100 : 0}%`;
+      div.setAttribute('aria-label', thumb.emoji || '');
+      div.title = thumb.emoji || '';
+      container.appendChild(tileClone);
+   });
+   // The sheet cannot be built when a thumbnail cannot be decoded, show the stickers one by one instead
+   const probe = new Image();
+   probe.addEventListener('error', () => {
+      container.replaceChildren();
+      appendThumbnails(container, pack);
+   }, { once: true });
+   probe.src = url;
+}
+
 function createPackCard(pack) {
    const clone = packCardTemplate.content.cloneNode(true);
    const badgeContainer = clone.querySelector('[data-badge-container]');
@@ -143,13 +205,11 @@ function createPackCard(pack) {
    }
    if (pack.thumbnails?.length) {
       const thumbnailContainer = clone.querySelector('.pack-thumbnail');
-      pack.thumbnails.forEach(thumb => {
-         const tagClone = thumb.file_path.includes("webm") ? thumbnailVideoTemplate.content.cloneNode(true) : thumbnailImageTemplate.content.cloneNode(true);
-         const t = tagClone.querySelector(thumb.file_path.includes("webm") ? 'video' : 'img');
-         t.src = `/sticker_files/${encodeURIComponent(pack.name)}/${encodeURIComponent(thumb.file_path)}`;
-         t.alt = thumb.emoji || '';
-         thumbnailContainer.appendChild(tagClone);
-      });
+      if (pack.sprite) {
+         appendSpriteTiles(thumbnailContainer, pack);
+      } else {
+         appendThumbnails(thumbnailContainer, pack);
+      }
    }
    clone.querySelector('[data-field="title"]').textContent = pack.title;
    clone.querySelector('[data-field="name"]').textContent = pack.name;
@@ -210,17 +270,15 @@ async function updateAllPacks() {
    const originalText = updateAllBtn.textContent;
    updateAllBtn.textContent = 'Updating all…';
    try {
-      const response = await fetch('/api/packs/update-all', {
-         method: 'POST'
+      const job = await runJob('/api/packs/update-all', (progress) => {
+         if (progress.total) {
+            updateAllBtn.textContent = `Updating ${progress.completed}/${progress.total}…`;
+         }
       });
-      const data = await response.json();
-      if (!response.ok || !data.success) {
-         throw new Error(data.error || 'Bulk update failed');
-      }
       alert(
          `Update complete:\n` +
-         `${data.updated} succeeded\n` +
-         `${data.failed} failed`
+         `${job.result.updated} succeeded\n` +
+         `${job.result.failed} failed`
       );
       await searchPacks(currentQuery);
    } catch (err) {
@@ -238,14 +296,7 @@ async function updateSinglePack(packName, button) {
    const originalText = button.textContent;
    button.textContent = 'Updating…';
    try {
-      const response = await fetch(
-         `/api/packs/${encodeURIComponent(packName)}/update`,
-         { method: 'POST' }
-      );
-      const data = await response.json();
-      if (!response.ok || !data.success) {
-         throw new Error(data.error || 'Update failed');
-      }
+      await runJob(`/api/packs/${encodeURIComponent(packName)}/update`);
       await searchPacks(currentQuery);
    } catch (err) {
       console.error(err);
@@ -264,99 +315,33 @@ function createStickerItem(packName, sticker) {
    return tagClone;
 }
 
-function sortPacks(packs, sortBy) {
-   const sorted = [...packs];
-   switch (sortBy) {
-      case 'last_update_desc':
-         sorted.sort((a, b) => b.last_update - a.last_update);
-         break;
-      case 'last_update_asc':
-         sorted.sort((a, b) => a.last_update - b.last_update);
-         break;
-      case 'title_asc':
-         sorted.sort((a, b) => a.title.localeCompare(b.title));
-         break;
-      case 'title_desc':
-         sorted.sort((a, b) => b.title.localeCompare(a.title));
-         break;
-      case 'name_asc':
-         sorted.sort((a, b) => a.name.localeCompare(b.name));
-         break;
-      case 'name_desc':
-         sorted.sort((a, b) => b.name.localeCompare(a.name));
-         break;
-      case 'artist_asc':
-         sorted.sort((a, b) => a.artist.localeCompare(b.artist));
-         break;
-      case 'artist_desc':
-         sorted.sort((a, b) => b.artist.localeCompare(a.artist));
-         break;
-      case 'count_desc':
-         sorted.sort((a, b) => b.sticker_count - a.sticker_count);
-         break;
-      case 'count_asc':
-         sorted.sort((a, b) => a.sticker_count - b.sticker_count);
-         break;
-   }
-   return sorted;
-}
-
-function filterPacks(packs, filters) {
-   let filtered = [...packs];
-   if (filters.onSignal === 'show') {
-      filtered = filtered.filter(pack => pack.signal_url);
-   } else if (filters.onSignal === 'hide') {
-      filtered = filtered.filter(pack => !pack.signal_url);
-   }
-   if (filters.needsUpdate === 'show') {
-      filtered = filtered.filter(pack => pack.needs_signal_update);
-   } else if (filters.needsUpdate === 'hide') {
-      filtered = filtered.filter(pack => !pack.needs_signal_update);
-   }
-   if (filters.inCustomPacks === 'show') {
-      filtered = filtered.filter(pack => pack.used_in_custom_packs);
-   } else if (filters.inCustomPacks === 'hide') {
-      filtered = filtered.filter(pack => !pack.used_in_custom_packs);
-   }
-   return filtered;
-}
-
 function applyFiltersAndSort() {
-   loading.style.display = 'block';
-   packsGrid.style.display = 'none';
-   emptyState.style.display = 'none';
-   resultsCount.style.display = 'none';
-   let filtered = filterPacks(allPacks, currentFilters);
-   let sorted = sortPacks(filtered, currentSortBy);
-   loading.style.display = 'none';
-   if (sorted.length === 0) {
-      emptyState.style.display = 'block';
-      return;
-   }
-   resultsCount.style.display = 'block';
-   resultsCount.textContent = `Found ${sorted.length} sticker pack${sorted.length !== 1 ? 's' : ''}`;
-   packsGrid.style.display = 'grid';
-   packsGrid.innerHTML = '';
-   displayedCount = 0;
-   const firstBatch = sorted.slice(0, Math.min(itemsPerBatch, sorted.length));
-   firstBatch.forEach(pack => packsGrid.appendChild(createPackCard(pack)));
-   displayedCount = firstBatch.length;
+   return searchPacks(currentQuery);
 }
 
 async function searchPacks(query) {
    currentQuery = query;
+   const generation = ++searchGeneration;
    loading.style.display = 'block';
    packsGrid.style.display = 'none';
    emptyState.style.display = 'none';
    resultsCount.style.display = 'none';
    try {
-      const response = await fetch(`/api/packs/search?q=${encodeURIComponent(query)}`);
+      const response = await fetch(buildSearchUrl(null));
       const data = await response.json();
-      allPacks = data.packs.map(pack => ({
-         ...pack,
-         needs_signal_update: pack.signal_uploaded_at && pack.last_update > pack.signal_uploaded_at
-      }));
-      applyFiltersAndSort();
+      if (generation !== searchGeneration) return;
+      allPacks = data.packs;
+      nextPage = data.next;
+      loading.style.display = 'none';
+      if (data.total === 0) {
+         emptyState.style.display = 'block';
+         return;
+      }
+      resultsCount.style.display = 'block';
+      resultsCount.textContent = `Found ${data.total} sticker pack${data.total !== 1 ? 's' : ''}`;
+      packsGrid.style.display = 'grid';
+      packsGrid.innerHTML = '';
+      allPacks.forEach(pack => packsGrid.appendChild(createPackCard(pack)));
    } catch (error) {
       console.error('Error searching packs:', error);
       loading.style.display = 'none';
@@ -375,6 +360,14 @@ async function showPack(packName) {
       modalStickers.innerHTML = '';
       pack.stickers.forEach(sticker => modalStickers.appendChild(createStickerItem(packName, sticker)));
       modal.classList.add('active');
+      // Larger packs come in further pages
+      let after = pack.next;
+      while (after && currentPackName === packName) {
+         const pageResponse = await fetch(`/api/packs/${encodeURIComponent(packName)}/stickers?limit=500&after=${encodeURIComponent(after)}`);
+         const page = await pageResponse.json();
+         page.stickers.forEach(sticker => modalStickers.appendChild(createStickerItem(packName, sticker)));
+         after = page.next;
+      }
    } catch (error) {
       console.error('Error loading pack:', error);
       alert('Failed to load pack stickers');
@@ -407,20 +400,16 @@ async function uploadToSignal(packName) {
       return;
    }
    try {
-      const response = await fetch(`/api/packs/${encodeURIComponent(packName)}/upload-signal`, {
-         method: 'POST',
-         headers: { 'Content-Type': 'application/json' }
-      });
-      const data = await response.json();
-      if (response.ok) {
-         alert(`Successfully uploaded to Signal!\n\nURL: ${data.signal_url}`);
-         await searchPacks(currentQuery);
-      } else {
-         alert(`Failed to upload to Signal: ${data.error}`);
+      const url = `/api/packs/${encodeURIComponent(packName)}/upload-signal`;
+      let job = await runJob(url);
+      if (!job.result.uploaded && confirm('Signal already has this version of the pack. Upload it again anyway?')) {
+         job = await runJob(`${url}?force=1`);
       }
+      alert(`Successfully uploaded to Signal!\n\nURL: ${job.result.signal_url}`);
+      await searchPacks(currentQuery);
    } catch (error) {
       console.error('Error uploading to Signal:', error);
-      alert('Failed to upload to Signal');
+      alert(`Failed to upload to Signal: ${error.message}`);
    }
 }
 
@@ -15,8 +15,10 @@ let currentQuery = '';
 let isLoadingMore = false;
 let allStickers = [];
 let currentSortBy = 'pack_update_desc';
+// Token of the next page of the current search, null on the last page
+let nextPage = null;
+let searchGeneration = 0;
 
-let displayedCount = 0;
 const itemsPerBatch = 100;
 
 searchStickers('');
@@ -28,11 +30,11 @@ searchInput.addEventListener('input', (e) => {
 
 sortBy.addEventListener('change', (e) => {
    currentSortBy = e.target.value;
-   applySort();
+   searchStickers(currentQuery);
 });
 
 window.addEventListener('scroll', () => {
-   if (isLoadingMore) return;
+   if (isLoadingMore || !nextPage) return;
    const scrollTop = window.scrollY;
    const windowHeight = window.innerHeight;
    const docHeight = document.documentElement.scrollHeight;
@@ -41,17 +43,35 @@ window.addEventListener('scroll', () => {
    }
 });
 
-function loadMoreStickers() {
-   if (isLoadingMore) return;
-   let sorted = sortStickers(allStickers, currentSortBy);
-   if (displayedCount >= sorted.length) return;
+function buildSearchUrl(after) {
+   const params = new URLSearchParams({
+      q: currentQuery,
+      limit: itemsPerBatch,
+      sort: currentSortBy,
+      format: 'compact'
+   });
+   if (after) params.set('after', after);
+   return `/api/stickers/search?${params}`;
+}
+
+async function loadMoreStickers() {
+   if (isLoadingMore || !nextPage) return;
    isLoadingMore = true;
-   const startIdx = displayedCount;
-   const endIdx = Math.min(displayedCount + itemsPerBatch, sorted.length);
-   const batch = sorted.slice(startIdx, endIdx);
-   batch.forEach(item => stickersGrid.appendChild(createStickerCard(item)));
-   displayedCount = endIdx;
-   isLoadingMore = false;
+   const generation = searchGeneration;
+   try {
+      const response = await fetch(buildSearchUrl(nextPage));
+      const data = await response.json();
+      // Drop the page if a new search started while it was loading
+      if (generation !== searchGeneration) return;
+      nextPage = data.next;
+      const stickers = expandStickerSearch(data);
+      allStickers.push(...stickers);
+      stickers.forEach(item => stickersGrid.appendChild(createStickerCard(item)));
+   } catch (error) {
+      console.error('Error loading more stickers:', error);
+   } finally {
+      isLoadingMore = false;
+   }
 }
 
 document.addEventListener('click', (e) => {
@@ -66,7 +86,7 @@ document.addEventListener('click', (e) => {
 function createStickerCard(item) {
    const clone = stickerCardTemplate.content.cloneNode(true);
    const filePath = `/sticker_files/${encodeURIComponent(item.pack_name)}/${encodeURIComponent(item.sticker.file_path)}`;
-   clone.querySelector('[data-field="image"]').src = filePath;
+   clone.querySelector('[data-field="image"]').src = `/thumbs/${encodeURIComponent(item.pack_name)}/${encodeURIComponent(item.sticker.file_path)}`;
    const emojiDiv = clone.querySelector('[data-field="emoji"]');
    if (item.emoji) {
       emojiDiv.textContent = item.emoji;
@@ -83,68 +103,29 @@ function createStickerCard(item) {
    return clone;
 }
 
-function sortStickers(stickers, sortBy) {
-   const sorted = [...stickers];
-   switch (sortBy) {
-      case 'pack_update_desc':
-         break;
-      case 'pack_update_asc':
-         sorted.reverse();
-         break;
-      case 'pack_name_asc':
-         sorted.sort((a, b) => a.pack_name.localeCompare(b.pack_name));
-         break;
-      case 'pack_name_desc':
-         sorted.sort((a, b) => b.pack_name.localeCompare(a.pack_name));
-         break;
-      case 'pack_title_asc':
-         sorted.sort((a, b) => a.pack_title.localeCompare(b.pack_title));
-         break;
-      case 'pack_title_desc':
-         sorted.sort((a, b) => b.pack_title.localeCompare(a.pack_title));
-         break;
-      case 'artist_asc':
-         sorted.sort((a, b) => a.artist.localeCompare(b.artist));
-         break;
-      case 'artist_desc':
-         sorted.sort((a, b) => b.artist.localeCompare(a.artist));
-         break;
-   }
-   return sorted;
-}
-
-function applySort() {
-   loading.style.display = 'block';
-   stickersGrid.style.display = 'none';
-   emptyState.style.display = 'none';
-   resultsCount.style.display = 'none';
-   let sorted = sortStickers(allStickers, currentSortBy);
-   loading.style.display = 'none';
-   if (sorted.length === 0) {
-      emptyState.style.display = 'block';
-      return;
-   }
-   resultsCount.style.display = 'block';
-   resultsCount.textContent = `Found ${sorted.length} sticker${sorted.length !== 1 ? 's' : ''}`;
-   stickersGrid.style.display = 'grid';
-   stickersGrid.innerHTML = '';
-   displayedCount = 0;
-   const firstBatch = sorted.slice(0, Math.min(itemsPerBatch, sorted.length));
-   firstBatch.forEach(item => stickersGrid.appendChild(createStickerCard(item)));
-   displayedCount = firstBatch.length;
-}
-
 async function searchStickers(query) {
    currentQuery = query;
+   const generation = ++searchGeneration;
    loading.style.display = 'block';
    stickersGrid.style.display = 'none';
    emptyState.style.display = 'none';
    resultsCount.style.display = 'none';
    try {
-      const response = await fetch(`/api/stickers/search?q=${encodeURIComponent(query)}`);
+      const response = await fetch(buildSearchUrl(null));
       const data = await response.json();
-      allStickers = data.stickers;
-      applySort();
+      if (generation !== searchGeneration) return;
+      allStickers = expandStickerSearch(data);
+      nextPage = data.next;
+      loading.style.display = 'none';
+      if (data.total === 0) {
+         emptyState.style.display = 'block';
+         return;
+      }
+      resultsCount.style.display = 'block';
+      resultsCount.textContent = `Found ${data.total} sticker${data.total !== 1 ? 's' : ''}`;
+      stickersGrid.style.display = 'grid';
+      stickersGrid.innerHTML = '';
+      allStickers.forEach(item => stickersGrid.appendChild(createStickerCard(item)));
    } catch (error) {
       console.error('Error searching stickers:', error);
       loading.style.display = 'none';
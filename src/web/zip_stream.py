@@ -0,0 +1,51 @@
+import io
+import time
+import zipfile
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+# Read size when copying media files into the archive
+COPY_CHUNK_SIZE: int = 64 * 1024
+
+class _ChunkBuffer(io.RawIOBase):
+    # Write-only, unseekable sink for ZipFile; the bytes written since the last drain are handed out as a chunk
+    def __init__(self) -> None:
+        super().__init__()
+        self._chunks: list[bytes] = []
+        self._position: int = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b: bytes) -> int:  # pyright: ignore[reportIncompatibleMethodOverride]
+        self._chunks.append(bytes(b))
+        self._position += len(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        chunk: bytes = b''.join(self._chunks)
+        self._chunks = []
+        return chunk
+
+def stream_zip(entries: Iterable[tuple[str, str | Path]]) -> Iterator[bytes]:
+    # Yields a ZIP archive chunk by chunk. Entries are (archive name, text or file on disk);
+    # text is deflated, files (already compressed stickers) are stored as they are.
+    buffer: _ChunkBuffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in entries:
+            if isinstance(content, Path):
+                if not content.is_file():
+                    continue
+                info: zipfile.ZipInfo = zipfile.ZipInfo(name, time.localtime(content.stat().st_mtime)[:6])
+                info.compress_type = zipfile.ZIP_STORED
+                with content.open('rb') as source, archive.open(info, 'w') as target:
+                    while chunk := source.read(COPY_CHUNK_SIZE):
+                        _ = target.write(chunk)
+                        yield buffer.drain()
+            else:
+                archive.writestr(name, content)
+            yield buffer.drain()
+    yield buffer.drain()
@@ -0,0 +1,75 @@
+import gzip
+import json
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask, Response, jsonify
+from flask.testing import FlaskClient
+
+from src.web import compression
+from src.web.compression import COMPRESS_MIN_SIZE, init_compression
+
+LARGE: dict[str, list[str]] = {'items': [f"sticker_{idx}" for idx in range(COMPRESS_MIN_SIZE)]}
+
+@pytest.fixture
+def client(monkeypatch: pytest.MonkeyPatch) -> FlaskClient:
+    # Brotli is optional, tests pick the encoding they need
+    monkeypatch.setattr(compression, 'brotli', None)
+    app: Flask = Flask(__name__)
+    init_compression(app)
+
+    @app.route('/large')
+    def large() -> Response:
+        response: Response = jsonify(LARGE)
+        response.set_etag("large")
+        return response
+
+    @app.route('/small')
+    def small() -> Response:
+        return jsonify({'ok': True})
+
+    @app.route('/image')
+    def image() -> Response:
+        return Response(b'\x89PNG' + bytes(4 * COMPRESS_MIN_SIZE), mimetype='image/png')
+
+    @app.route('/encoded')
+    def encoded() -> Response:
+        response: Response = Response(gzip.compress(json.dumps(LARGE).encode()), mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+        return response
+
+    @app.route('/streamed')
+    def streamed() -> Response:
+        return Response((json.dumps(LARGE) for _ in range(2)), mimetype='application/json')
+
+    return app.test_client()
+
+def test_large_json_is_gzipped(client: FlaskClient) -> None:
+    response = client.get('/large', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert json.loads(gzip.decompress(response.data)) == LARGE
+    # The compressed body gets an ETag of its own
+    assert response.headers['ETag'] == '"large-gzip"'
+
+def test_brotli_is_preferred_when_installed(client: FlaskClient, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(compression, 'brotli', SimpleNamespace(compress=lambda data, quality: b'br:' + data))
+    response = client.get('/large', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert json.loads(response.data.removeprefix(b'br:')) == LARGE
+
+def test_client_without_accepted_encoding(client: FlaskClient) -> None:
+    response = client.get('/large', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.json == LARGE
+
+@pytest.mark.parametrize('path', ['/small', '/image', '/streamed'])
+def test_small_binary_and_streamed_responses_are_not_compressed(client: FlaskClient, path: str) -> None:
+    response = client.get(path, headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+def test_already_encoded_responses_are_passed_through(client: FlaskClient) -> None:
+    response = client.get('/encoded', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    # Compressed once, not twice
+    assert json.loads(gzip.decompress(response.data)) == LARGE
@@ -0,0 +1,129 @@
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+
+from src.database import (
+    CUSTOM_PACK_ORDER_GAP,
+    CustomPackConflict,
+    CustomPackSticker,
+    Database,
+    StickerPackRecord,
+    StickerRecord,
+)
+
+PACK_NAME: str = "source"
+CUSTOM_PACK_NAME: str = "custom"
+STICKER_IDS: list[str] = [f"sticker_{idx}" for idx in range(20)]
+
+@pytest.fixture
+def db(tmp_path: Path) -> Iterator[Database]:
+    # One source pack of 20 stickers, and a custom pack holding the first three of them
+    db = Database(tmp_path / "sticker_data.sqlite")
+    pack: StickerPackRecord = StickerPackRecord(
+        name=PACK_NAME, title=PACK_NAME, artist="artist", last_update=0, sticker_count=len(STICKER_IDS),
+        signal_url=None, signal_uploaded_at=None, signal_fingerprint=None, used_in_custom_packs=False
+    )
+    stickers: list[StickerRecord] = [
+        StickerRecord(file_id=f"{unique_id}_file", file_unique_id=unique_id, emoji="🙂",
+                      file_path=f"{unique_id}.webp", display_order=idx)
+        for idx, unique_id in enumerate(STICKER_IDS)
+    ]
+    db.upsert_pack_stickers(pack, stickers, {})
+    assert db.create_custom_pack(CUSTOM_PACK_NAME, "Custom")
+    assert db.update_custom_pack(CUSTOM_PACK_NAME, "Custom", [
+        CustomPackSticker(pack_name=PACK_NAME, pack_title=PACK_NAME, file_unique_id=unique_id,
+                          file_path=f"{unique_id}.webp", emoji="🙂", display_order=idx)
+        for idx, unique_id in enumerate(STICKER_IDS[:3])
+    ])
+    yield db
+    db.close()
+
+def pack_stickers(db: Database) -> list[CustomPackSticker]:
+    return db.get_custom_pack_stickers(CUSTOM_PACK_NAME, limit=100)['items']
+
+def pack_order(db: Database) -> list[str]:
+    return [s['file_unique_id'] for s in pack_stickers(db)]
+
+def current_version(db: Database) -> int:
+    pack = db.get_custom_pack(CUSTOM_PACK_NAME)
+    assert pack is not None
+    return pack['version']
+
+def test_add_between_neighbours(db: Database) -> None:
+    version: int = current_version(db)
+    new_version: int = db.patch_custom_pack(CUSTOM_PACK_NAME, version, [
+        {'op': 'add', 'file_unique_id': 'sticker_10', 'before': 'sticker_1'},
+        {'op': 'add', 'file_unique_id': 'sticker_11', 'before': None},
+    ])
+    assert new_version == version + 1 == current_version(db)
+    assert pack_order(db) == ['sticker_0', 'sticker_10', 'sticker_1', 'sticker_2', 'sticker_11']
+    orders: dict[str, int] = {s['file_unique_id']: s['display_order'] for s in pack_stickers(db)}
+    # Only the added rows were written, at the midpoint of their neighbours and after the last one
+    assert orders['sticker_0'] == CUSTOM_PACK_ORDER_GAP
+    assert orders['sticker_1'] == 2 * CUSTOM_PACK_ORDER_GAP
+    assert orders['sticker_10'] == CUSTOM_PACK_ORDER_GAP + CUSTOM_PACK_ORDER_GAP // 2
+    assert orders['sticker_11'] == 4 * CUSTOM_PACK_ORDER_GAP
+
+def test_respace_once_the_gap_is_exhausted(db: Database) -> None:
+    # Each sticker placed right before sticker_1 halves the gap left below it, until none is left
+    added: list[str] = STICKER_IDS[3:17]
+    version: int = db.patch_custom_pack(CUSTOM_PACK_NAME, current_version(db), [
+        {'op': 'add', 'file_unique_id': unique_id, 'before': 'sticker_1'} for unique_id in added
+    ])
+    assert version == current_version(db)
+    assert pack_order(db) == ['sticker_0', *added, 'sticker_1', 'sticker_2']
+    orders: list[int] = [s['display_order'] for s in pack_stickers(db)]
+    assert len(set(orders)) == len(orders)
+    # The pack was spread out evenly again on the way, so the next insert has room without respacing
+    assert orders[-1] - orders[-2] > 1
+    assert orders[0] == CUSTOM_PACK_ORDER_GAP
+
+def test_respace_keeps_the_order(db: Database) -> None:
+    # Crowd the keys between sticker_0 and sticker_1 by hand, then move a sticker in between
+    with db._connect() as conn:
+        _ = conn.execute(
+            "UPDATE custom_pack_stickers SET display_order = ? WHERE custom_pack_name = ? AND file_unique_id = ?",
+            (CUSTOM_PACK_ORDER_GAP + 1, CUSTOM_PACK_NAME, 'sticker_1')
+        )
+    _ = db.patch_custom_pack(CUSTOM_PACK_NAME, current_version(db), [
+        {'op': 'move', 'file_unique_id': 'sticker_2', 'before': 'sticker_1'},
+    ])
+    assert pack_order(db) == ['sticker_0', 'sticker_2', 'sticker_1']
+    # Respaced to whole gaps, then the moved sticker took the midpoint below sticker_1
+    orders: list[int] = [s['display_order'] for s in pack_stickers(db)]
+    assert orders == [CUSTOM_PACK_ORDER_GAP, CUSTOM_PACK_ORDER_GAP + CUSTOM_PACK_ORDER_GAP // 2, 2 * CUSTOM_PACK_ORDER_GAP]
+
+def test_move_then_remove(db: Database) -> None:
+    _ = db.patch_custom_pack(CUSTOM_PACK_NAME, current_version(db), [
+        {'op': 'move', 'file_unique_id': 'sticker_2', 'before': 'sticker_0'},
+        {'op': 'move', 'file_unique_id': 'sticker_0', 'before': None},
+        {'op': 'remove', 'file_unique_id': 'sticker_1'},
+    ])
+    assert pack_order(db) == ['sticker_2', 'sticker_0']
+
+def test_stale_version_conflicts(db: Database) -> None:
+    version: int = current_version(db)
+    _ = db.patch_custom_pack(CUSTOM_PACK_NAME, version, [{'op': 'remove', 'file_unique_id': 'sticker_0'}])
+    with pytest.raises(CustomPackConflict) as conflict:
+        _ = db.patch_custom_pack(CUSTOM_PACK_NAME, version, [{'op': 'remove', 'file_unique_id': 'sticker_1'}],
+                                 title="Stale")
+    assert conflict.value.version == version + 1
+    # Nothing of the stale patch was written
+    assert pack_order(db) == ['sticker_1', 'sticker_2']
+    pack = db.get_custom_pack(CUSTOM_PACK_NAME)
+    assert pack is not None and pack['title'] == "Custom" and pack['version'] == version + 1
+
+def test_invalid_edit_writes_nothing(db: Database) -> None:
+    version: int = current_version(db)
+    with pytest.raises(ValueError):
+        _ = db.patch_custom_pack(CUSTOM_PACK_NAME, version, [
+            {'op': 'remove', 'file_unique_id': 'sticker_0'},
+            {'op': 'move', 'file_unique_id': 'sticker_19', 'before': None},
+        ])
+    assert pack_order(db) == ['sticker_0', 'sticker_1', 'sticker_2']
+    assert current_version(db) == version
+
+def test_missing_pack(db: Database) -> None:
+    with pytest.raises(KeyError):
+        _ = db.patch_custom_pack("missing", 0, [])
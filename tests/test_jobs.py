@@ -0,0 +1,56 @@
+import time
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+
+from src.database import Database, JobRecord
+from src.web.jobs import JobProgress, JobQueue
+
+@pytest.fixture
+def db(tmp_path: Path) -> Iterator[Database]:
+    db = Database(tmp_path / "sticker_data.sqlite")
+    # Left running by a previous process
+    db.create_job("stale", 'update_all', None)
+    db.start_job("stale")
+    yield db
+    db.close()
+
+def job_status(db: Database, job_id: str) -> str | None:
+    job: JobRecord | None = db.get_job(job_id)
+    return job['status'] if job else None
+
+def wait_for(db: Database, job_id: str) -> JobRecord:
+    deadline: float = time.monotonic() + 5
+    while job_status(db, job_id) in ('queued', 'running'):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    job: JobRecord | None = db.get_job(job_id)
+    assert job is not None
+    return job
+
+def test_construction_has_no_side_effects(db: Database) -> None:
+    queue: JobQueue = JobQueue(db)
+    assert job_status(db, "stale") == 'running'
+    assert queue._thread is None
+    queue.start()
+    queue.start()
+    assert job_status(db, "stale") == 'interrupted'
+    assert queue._thread is None
+
+def test_submit_starts_the_queue(db: Database) -> None:
+    queue: JobQueue = JobQueue(db)
+
+    async def run(report: JobProgress) -> dict[str, object]:
+        report({'a': True}, 1)
+        return {'done': True}
+
+    try:
+        job_id, created = queue.submit('update_all', None, run)
+        assert created
+        # Unfinished jobs are interrupted before the first new one is created, not after
+        assert job_status(db, "stale") == 'interrupted'
+        job: JobRecord = wait_for(db, job_id)
+        assert job['status'] == 'succeeded' and job['result'] == {'done': True}
+    finally:
+        queue.shutdown()
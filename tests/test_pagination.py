@@ -0,0 +1,171 @@
+import base64
+import json
+import sqlite3
+from collections.abc import Callable, Iterator
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from src.database import (
+    PACK_SORT_ORDERS,
+    STICKER_SORT_ORDERS,
+    CustomPackSticker,
+    Database,
+    StickerPackRecord,
+    StickerRecord,
+)
+from src.pagination import Page, collect, decode_token, encode_token, seek_condition
+
+# Few distinct last_update and display_order values, so most sort keys are tied
+PACK_COUNT: int = 12
+STICKERS_PER_PACK: int = 5
+
+def walk(fetch: Callable[[str | None], Page[Any]], size: int) -> list[Any]:
+    # Every item of a listing read page by page, checking that only the last page is short
+    items: list[Any] = []
+    after: str | None = None
+    while True:
+        page: Page[Any] = fetch(after)
+        items.extend(page['items'])
+        after = page['next']
+        if after is None:
+            assert len(page['items']) <= size
+            return items
+        assert len(page['items']) == size
+
+@pytest.fixture
+def db(tmp_path: Path) -> Iterator[Database]:
+    db = Database(tmp_path / "sticker_data.sqlite")
+    for idx in range(PACK_COUNT):
+        name: str = f"pack_{idx:02d}"
+        pack: StickerPackRecord = StickerPackRecord(
+            name=name, title=f"Title {idx % 3}", artist=f"Artist {idx % 2}", last_update=idx % 3,
+            sticker_count=STICKERS_PER_PACK, signal_url=None, signal_uploaded_at=None, signal_fingerprint=None,
+            used_in_custom_packs=False
+        )
+        stickers: list[StickerRecord] = [
+            StickerRecord(file_id=f"{name}_{order}_file", file_unique_id=f"{name}_{order}", emoji="🙂",
+                          file_path=f"{name}_{order}.webp", display_order=order // 2)
+            for order in range(STICKERS_PER_PACK)
+        ]
+        db.upsert_pack_stickers(pack, stickers, {})
+    for idx in range(7):
+        assert db.create_custom_pack(f"custom_{idx}", f"Custom {idx}")
+    assert db.update_custom_pack("custom_0", "Custom 0", [
+        CustomPackSticker(pack_name=f"pack_{idx:02d}", pack_title="", file_unique_id=f"pack_{idx:02d}_0",
+                          file_path="", emoji="", display_order=0)
+        for idx in range(PACK_COUNT)
+    ])
+    yield db
+    db.close()
+
+def test_token_round_trip() -> None:
+    token: str = encode_token("listing:a", [3, "name", None])
+    assert decode_token(token, "listing:a", 3) == [3, "name", None]
+    # URL safe without padding, so it can go in a query string as it is
+    assert all(c.isalnum() or c in '-_' for c in token)
+
+@pytest.mark.parametrize('token', ["", "garbage!!", "bm90IGpzb24", base64.urlsafe_b64encode(b"{}").decode()])
+def test_garbage_tokens_are_rejected(token: str) -> None:
+    with pytest.raises(ValueError):
+        _ = decode_token(token, "listing:a", 2)
+
+def test_tokens_of_another_listing_are_rejected() -> None:
+    token: str = encode_token("listing:a", [3, "name"])
+    with pytest.raises(ValueError, match="does not belong"):
+        _ = decode_token(token, "listing:b", 2)
+    with pytest.raises(ValueError, match="does not belong"):
+        _ = decode_token(token, "listing:a", 3)
+
+def test_tampered_keys_are_rejected() -> None:
+    payload: list[Any] = json.loads(base64.urlsafe_b64decode(encode_token("listing:a", [3, "name"]) + '=='))
+    payload[1] = {'rowid': 1}
+    token: str = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+    with pytest.raises(ValueError, match="Malformed"):
+        _ = decode_token(token, "listing:a", 2)
+
+# Every order ends with the last column, so it is unique over the table
+@pytest.mark.parametrize('order', [
+    [('a', False), ('b', False), ('c', False)],
+    [('a', True), ('b', True), ('c', True)],
+    [('a', True), ('b', False), ('c', False)],
+    [('a', False), ('b', True), ('c', False)],
+])
+def test_seek_condition_selects_the_rows_after_the_key(order: list[tuple[str, bool]]) -> None:
+    conn: sqlite3.Connection = sqlite3.connect(":memory:")
+    _ = conn.execute("CREATE TABLE t (a INTEGER, b TEXT, c INTEGER)")
+    _ = conn.executemany("INSERT INTO t VALUES (?, ?, ?)", [
+        (a, b, c) for a in range(3) for b in ('x', 'y') for c in range(2)
+    ])
+    columns: str = ', '.join(column for column, _ in order)
+    order_by: str = ', '.join(f"{column}{' DESC' if descending else ''}" for column, descending in order)
+    rows: list[tuple[Any, ...]] = conn.execute(f"SELECT {columns} FROM t ORDER BY {order_by}").fetchall()
+    for idx, key in enumerate(rows):
+        condition, params = seek_condition(order, list(key))
+        after: list[tuple[Any, ...]] = conn.execute(
+            f"SELECT {columns} FROM t WHERE {condition} ORDER BY {order_by}", params
+        ).fetchall()
+        assert after == rows[idx + 1:]
+
+def test_collect_follows_the_tokens() -> None:
+    pages: dict[str | None, Page[int]] = {
+        None: Page(items=[1, 2], next="b", total=None),
+        "b": Page(items=[3, 4], next="c", total=None),
+        "c": Page(items=[5], next=None, total=None),
+    }
+    assert collect(lambda after: pages[after]) == [1, 2, 3, 4, 5]
+
+@pytest.mark.parametrize('sort', ['', *PACK_SORT_ORDERS])
+def test_pack_search_pages_cover_every_pack_once(db: Database, sort: str) -> None:
+    expected: list[str] = [p['name'] for p in db.search_sticker_packs("", None, 100, sort=sort)['items']]
+    assert len(expected) == PACK_COUNT
+    for size in (1, 5, 7):
+        packs = walk(lambda after: db.search_sticker_packs("", after, size, sort=sort), size)
+        assert [p['name'] for p in packs] == expected
+
+@pytest.mark.parametrize('sort', ['', 'title_asc', 'last_update_desc'])
+def test_ranked_pack_search_pages(db: Database, sort: str) -> None:
+    ranked: list[str] = [f"pack_{idx:02d}" for idx in (7, 3, 11, 0, 5, 9, 1)]
+    packs = walk(lambda after: db.search_sticker_packs("q", after, 2, ranked=ranked, sort=sort), 2)
+    names: list[str] = [p['name'] for p in packs]
+    assert sorted(names) == sorted(ranked)
+    if not sort:
+        assert names == ranked
+
+@pytest.mark.parametrize('sort', ['', *STICKER_SORT_ORDERS])
+def test_sticker_search_pages_cover_every_sticker_once(db: Database, sort: str) -> None:
+    expected: list[str] = [s['file_unique_id'] for s in db.search_stickers("", None, 500, sort=sort)['items']]
+    assert len(expected) == PACK_COUNT * STICKERS_PER_PACK
+    stickers = walk(lambda after: db.search_stickers("", after, 7, sort=sort), 7)
+    assert [s['file_unique_id'] for s in stickers] == expected
+
+def test_pack_sticker_pages_with_tied_orders(db: Database) -> None:
+    stickers = walk(lambda after: db.get_pack_stickers("pack_03", after, 2), 2)
+    assert [s['file_unique_id'] for s in stickers] == [f"pack_03_{order}" for order in range(STICKERS_PER_PACK)]
+
+def test_custom_pack_pages(db: Database) -> None:
+    stickers = walk(lambda after: db.get_custom_pack_stickers("custom_0", after, 5), 5)
+    assert [s['file_unique_id'] for s in stickers] == [f"pack_{idx:02d}_0" for idx in range(PACK_COUNT)]
+    packs = walk(lambda after: db.get_all_custom_packs(after, 3), 3)
+    assert [p['name'] for p in packs] == [f"custom_{idx}" for idx in range(7)]
+
+def test_tokens_do_not_cross_listings(db: Database) -> None:
+    token: str | None = db.get_pack_stickers("pack_03", None, 2)['next']
+    assert token is not None
+    with pytest.raises(ValueError):
+        _ = db.get_pack_stickers("pack_04", token, 2)
+    token = db.search_sticker_packs("", None, 2, sort='title_asc')['next']
+    assert token is not None
+    with pytest.raises(ValueError):
+        _ = db.search_sticker_packs("", token, 2, sort='title_desc')
+    with pytest.raises(ValueError):
+        _ = db.search_sticker_packs("", token, 2, sort='title_asc', filters={'on_signal': True})
+    with pytest.raises(ValueError):
+        _ = db.search_stickers("", "garbage!!", 2)
+
+def test_totals(db: Database) -> None:
+    assert db.search_sticker_packs("", None, 1, with_total=True)['total'] == PACK_COUNT
+    assert db.search_sticker_packs("", None, 1, filters={'on_signal': True}, with_total=True)['total'] == 0
+    assert db.search_stickers("", None, 1, with_total=True)['total'] == PACK_COUNT * STICKERS_PER_PACK
+    assert db.get_all_custom_packs(None, 1, with_total=True)['total'] == 7
@@ -0,0 +1,134 @@
+import asyncio
+from collections.abc import Iterator
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+from telegram.error import BadRequest, RetryAfter, TimedOut
+
+from src.bot import update_service
+from src.bot.clients import TelegramClients
+from src.bot.update_service import UpdateService
+from src.database import Database, StickerPackRecord, StickerRecord
+from src.storage import BlobStore
+from src.thumbnails import ThumbnailCache
+
+PACK_NAMES: list[str] = [f"pack_{idx}" for idx in range(6)]
+
+class FakeBot:
+    # get_sticker_set raising the errors queued for a pack before answering, and tracking how many
+    # calls are in flight at once
+    def __init__(self, errors: dict[str, list[Exception]] | None = None) -> None:
+        self.errors: dict[str, list[Exception]] = errors or {}
+        self.calls: list[str] = []
+        self.in_flight: int = 0
+        self.max_in_flight: int = 0
+        # Set to hold get_sticker_set for the given pack until the test releases it
+        self.hold: str | None = None
+        self.held: asyncio.Event = asyncio.Event()
+        self.release: asyncio.Event = asyncio.Event()
+
+    async def get_sticker_set(self, name: str) -> Any:
+        self.calls.append(name)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if name == self.hold:
+                self.held.set()
+                await self.release.wait()
+            if self.errors.get(name):
+                raise self.errors[name].pop(0)
+            return SimpleNamespace(name=name, stickers=[SimpleNamespace(file_unique_id=f"{name}_0")])
+        finally:
+            self.in_flight -= 1
+
+class FakeManager:
+    def __init__(self) -> None:
+        self.updated: list[str] = []
+
+    async def update_sticker_set(self, telegram_pack: Any, bot: Any) -> None:
+        self.updated.append(telegram_pack.name)
+
+@pytest.fixture
+def db(tmp_path: Path) -> Iterator[Database]:
+    db = Database(tmp_path / "sticker_data.sqlite")
+    for idx, name in enumerate(PACK_NAMES):
+        pack: StickerPackRecord = StickerPackRecord(
+            name=name, title=name, artist="artist", last_update=idx, sticker_count=1,
+            signal_url=None, signal_uploaded_at=None, signal_fingerprint=None, used_in_custom_packs=False
+        )
+        sticker: StickerRecord = StickerRecord(
+            file_id=f"{name}_file", file_unique_id=f"{name}_0", emoji="🙂", file_path=f"{name}_0.webp", display_order=0
+        )
+        db.upsert_pack_stickers(pack, [sticker], {})
+    yield db
+    db.close()
+
+@pytest.fixture
+def service(tmp_path: Path, db: Database, monkeypatch: pytest.MonkeyPatch) -> UpdateService:
+    monkeypatch.setattr(update_service, 'UPDATE_WORKERS', 2)
+    monkeypatch.setattr(update_service, 'UPDATE_MAX_ATTEMPTS', 3)
+    monkeypatch.setattr(update_service, 'UPDATE_RETRY_BACKOFF_SECONDS', 0)
+    monkeypatch.setattr(update_service, 'UPDATE_REQUESTS_PER_SECOND', 1000)
+    service = UpdateService(
+        tmp_path / "pack_files", db, TelegramClients(), BlobStore(tmp_path / "blobs"), ThumbnailCache(tmp_path / "thumbnails")
+    )
+    service.manager = FakeManager()  # pyright: ignore[reportAttributeAccessIssue]
+    return service
+
+def test_workers_are_capped(service: UpdateService) -> None:
+    bot = FakeBot()
+    results = asyncio.run(service.update_all_packs(bot))  # pyright: ignore[reportArgumentType]
+    assert results == {name: True for name in PACK_NAMES}
+    assert bot.max_in_flight == 2
+    assert sorted(service.manager.updated) == PACK_NAMES
+
+def test_retry_after_and_timeouts_are_retried(service: UpdateService) -> None:
+    bot = FakeBot({
+        'pack_0': [RetryAfter(0), RetryAfter(0)],
+        'pack_1': [TimedOut(), TimedOut()],
+    })
+    results = asyncio.run(service.update_all_packs(bot))  # pyright: ignore[reportArgumentType]
+    assert results == {name: True for name in PACK_NAMES}
+    assert bot.calls.count('pack_0') == 3
+    assert bot.calls.count('pack_1') == 3
+
+def test_timeouts_give_up_after_max_attempts(service: UpdateService) -> None:
+    bot = FakeBot({'pack_1': [TimedOut() for _ in range(5)]})
+    results = asyncio.run(service.update_all_packs(bot))  # pyright: ignore[reportArgumentType]
+    assert results['pack_1'] is False
+    assert bot.calls.count('pack_1') == 3
+
+def test_bad_request_is_not_retried(service: UpdateService) -> None:
+    bot = FakeBot({'pack_2': [BadRequest("Stickerset_invalid"), BadRequest("Stickerset_invalid")]})
+    results = asyncio.run(service.update_all_packs(bot))  # pyright: ignore[reportArgumentType]
+    assert results['pack_2'] is False
+    assert bot.calls.count('pack_2') == 1
+    assert 'pack_2' not in service.manager.updated
+
+def test_interrupted_run_resumes_pending_packs(service: UpdateService, db: Database,
+                                               monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(update_service, 'UPDATE_WORKERS', 1)
+    # Packs are taken in the order of get_all_pack_names, hold the fourth one and stop the run there
+    order: list[str] = db.get_all_pack_names()
+    bot = FakeBot()
+    bot.hold = order[3]
+
+    async def interrupt() -> None:
+        run = asyncio.create_task(service.update_all_packs(bot))  # pyright: ignore[reportArgumentType]
+        _ = await bot.held.wait()
+        _ = run.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await run
+
+    asyncio.run(interrupt())
+    assert service.manager.updated == order[:3]
+
+    resumed = FakeBot()
+    results = asyncio.run(service.update_all_packs(resumed))  # pyright: ignore[reportArgumentType]
+    assert sorted(resumed.calls) == sorted(order[3:])
+    assert results == {name: True for name in order[3:]}
+    # A finished run clears the progress, so the next one covers every pack again
+    assert sorted(db.begin_pack_update_run(PACK_NAMES)) == PACK_NAMES
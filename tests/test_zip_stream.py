@@ -0,0 +1,35 @@
+import io
+import json
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from src.web import zip_stream
+from src.web.zip_stream import stream_zip
+
+def test_streamed_archive_opens_with_the_expected_members(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    # Small copy chunks, so the sticker file is streamed over several chunks
+    monkeypatch.setattr(zip_stream, 'COPY_CHUNK_SIZE', 1024)
+    sticker: Path = tmp_path / "sticker.webp"
+    _ = sticker.write_bytes(bytes(range(256)) * 40)
+    document: str = json.dumps({'name': "pack", 'stickers': [{'file_path': "sticker.webp"}] * 50})
+    chunks: list[bytes] = list(stream_zip([
+        ("pack.json", document),
+        ("pack/sticker.webp", sticker),
+        # Removed since the listing was made, left out of the archive
+        ("pack/missing.webp", tmp_path / "missing.webp"),
+    ]))
+    assert len([chunk for chunk in chunks if chunk]) > 2
+    with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == ["pack.json", "pack/sticker.webp"]
+        assert archive.read("pack.json").decode() == document
+        assert archive.read("pack/sticker.webp") == sticker.read_bytes()
+        # Text is deflated, sticker files are already compressed and stored as they are
+        assert archive.getinfo("pack.json").compress_type == zipfile.ZIP_DEFLATED
+        assert archive.getinfo("pack/sticker.webp").compress_type == zipfile.ZIP_STORED
+
+def test_empty_archive() -> None:
+    with zipfile.ZipFile(io.BytesIO(b''.join(stream_zip([])))) as archive:
+        assert archive.namelist() == []